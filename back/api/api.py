@@ -1,6 +1,6 @@
 from fastapi import APIRouter
 
-from api.endpoints import videos, subtitles, categories, playlists
+from api.endpoints import videos, subtitles, categories, playlists, admin
 from core.config import settings
 
 api_router = APIRouter()
@@ -13,3 +13,5 @@ api_router.include_router(
     categories.router, prefix="/categories", tags=["categories"])
 api_router.include_router(
     playlists.router, prefix="/playlists", tags=["playlists"])
+api_router.include_router(
+    admin.router, prefix="/admin", tags=["admin"])
@@ -1,4 +1,11 @@
-from fastapi import Depends, HTTPException, status
+from typing import Optional
+from fastapi import Depends, HTTPException, Request, status
 from sqlalchemy.orm import Session
 
-from db.database import get_db
+from db.database import get_db, get_session_factory
+from utils.streaming import client_host
+
+
+def get_client_host(request: Request) -> Optional[str]:
+    """Address of the client, signed stream URLs can be bound to it"""
+    return client_host(request)
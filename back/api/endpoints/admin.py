@@ -0,0 +1,82 @@
+from fastapi import APIRouter, Depends
+
+from core.config import settings
+from db.database import get_pool_status
+from services.omdb_client import omdb_client
+from services.thumbnail_service import thumbnail_service
+from services.transcode_service import transcode_service
+from services.video_file_resolver import video_file_resolver
+from utils.admin_auth import require_admin
+from utils.admission import admission
+from utils.chunk_cache import chunk_cache
+from utils.pacing import pacing_stats
+from utils.rate_limit import get_rate_limiter
+from utils.segment_cache import segment_cache
+from utils.single_flight import chunk_reads
+from utils.stream_registry import stream_registry
+
+# Stats list client addresses, and the actions drain workers or start bulk jobs
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+
+@router.get("/stats")
+def get_stats():
+    """
+    Get runtime statistics for this worker
+    """
+    return {
+        "db_pool": get_pool_status(),
+        "video_files": video_file_resolver.stats(),
+        "chunk_cache": chunk_cache.stats(),
+        "chunk_reads": chunk_reads.stats(),
+        "hls_segments": segment_cache.stats(),
+        "transcode": transcode_service.stats(),
+        "pacing": pacing_stats.stats(),
+        "streams": stream_registry.stats(),
+        "admission": admission.load(),
+        "rate_limit": get_rate_limiter().stats(),
+        "omdb": omdb_client.stats(),
+    }
+
+
+@router.get("/streams")
+def get_active_streams():
+    """
+    Get the streams this worker is sending, with their progress and current rate
+    """
+    return {**stream_registry.stats(), "streams": stream_registry.list()}
+
+
+@router.post("/drain")
+def start_drain():
+    """
+    Stop this worker taking new streams and hand off its active ones before STREAM_DRAIN_TIMEOUT.
+    Workers also drain by themselves when they shut down
+    """
+    stream_registry.drain(settings.STREAM_DRAIN_TIMEOUT, settings.STREAM_DRAIN_SPREAD)
+    return stream_registry.stats()
+
+
+@router.delete("/drain")
+def stop_drain():
+    """
+    Let this worker take new streams again
+    """
+    stream_registry.resume()
+    return stream_registry.stats()
+
+
+@router.post("/transcode/backfill")
+def backfill_renditions():
+    """
+    Queue the rendition ladder of every video that has none yet, behind new uploads
+    """
+    return {"queued": transcode_service.backfill()}
+
+
+@router.post("/thumbnails/backfill")
+def backfill_thumbnails():
+    """
+    Queue thumbnail generation for every video, videos with up to date thumbnails are skipped
+    """
+    return {"queued": thumbnail_service.backfill()}
@@ -1,14 +1,30 @@
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
 from sqlalchemy.orm import Session
 
 from api.dependencies import get_db
+from core.config import settings
 from services.subtitle_service import subtitle_service
+from utils.streaming import verify_stream_url
+from utils.subtitles import build_signed_subtitle_response
 
 router = APIRouter()
 
 @router.get("/content/{subtitle_id}")
-async def get_subtitle_content(subtitle_id: int, db: Session = Depends(get_db)):
+async def get_subtitle_content(
+    subtitle_id: int,
+    request: Request,
+    token: Optional[str] = Query(None, description="Token of a signed subtitle URL"),
+    db: Session = Depends(get_db)
+):
     """
-    Get subtitle file content by ID
+    Get subtitle file content by ID, signed URLs are served without any database access
     """
-    return subtitle_service.get_subtitle_content(db, subtitle_id=subtitle_id)
+    if token is not None:
+        grant = verify_stream_url(token, request, video_id=None, subtitle_id=subtitle_id)
+        return build_signed_subtitle_response(grant, request.headers)
+    if settings.STREAM_REQUIRE_SIGNED_URLS:
+        raise HTTPException(status_code=401, detail="A signed subtitle URL is required")
+
+    return subtitle_service.get_subtitle_content(
+        db, subtitle_id=subtitle_id, request_headers=request.headers)
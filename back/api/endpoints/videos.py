@@ -1,13 +1,23 @@
-from typing import List, Optional
-from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Request, status
-from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
+from typing import List, Literal, Optional
+from fastapi import APIRouter, Depends, File, UploadFile, HTTPException, Query, Request, Response, status
+from sqlalchemy.orm import Session, sessionmaker
+from starlette.concurrency import run_in_threadpool
 
-from api.dependencies import get_db
+from api.dependencies import get_client_host, get_db, get_session_factory
+from models.rendition import AUDIO_RENDITION
 from services.video_service import video_service
+from services.video_file_resolver import VideoFile, video_file_resolver
+from services.ingest_service import ingest_service
+from services.sample_index_service import sample_index_service
+from services.hls_service import hls_service
+from services.transcode_service import transcode_service
+from services.thumbnail_service import VTT_FILENAME, thumbnail_service
 from schemas.video import VideoSchema, VideoCreate
-from utils.file_handlers import get_range_header, ranged_file_sender, file_sender
-import os
+from schemas.rendition import RenditionSchema
+from utils.async_io import run_io
+from utils.http_cache import is_not_modified, validator_headers
+from utils.stream_tokens import StreamGrant
+from utils.streaming import authorize_video, build_video_response, signed_query
 
 router = APIRouter(
     tags=["Videos"],
@@ -15,19 +25,49 @@ router = APIRouter(
 
 
 @router.get("/", response_model=List[VideoSchema])
-def list_videos(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def list_videos(
+    skip: int = 0,
+    limit: int = 100,
+    db: Session = Depends(get_db),
+    client: Optional[str] = Depends(get_client_host)
+):
     """
     List all available videos with pagination
     """
-    return video_service.list_videos(db, skip=skip, limit=limit)
+    return video_service.list_videos(db, skip=skip, limit=limit, client=client)
 
 
 @router.get("/{video_id}", response_model=VideoSchema)
-def get_video(video_id: int, db: Session = Depends(get_db)):
+def get_video(video_id: int, db: Session = Depends(get_db), client: Optional[str] = Depends(get_client_host)):
+    """
+    Get video details by ID, its stream URL is signed when stream URL signing is enabled
+    """
+    return video_service.get_video(db, video_id=video_id, client=client)
+
+
+@router.get("/{video_id}/renditions", response_model=List[RenditionSchema], dependencies=[Depends(authorize_video)])
+def list_renditions(video_id: int, db: Session = Depends(get_db), client: Optional[str] = Depends(get_client_host)):
+    """
+    List the renditions of a video and their encoding state, the finished ones with their stream URL
+    """
+    return transcode_service.list_renditions(db, video_id=video_id, client=client)
+
+
+@router.get("/{video_id}/thumbnails.vtt", dependencies=[Depends(authorize_video)])
+def get_thumbnail_track(video_id: int, request: Request):
     """
-    Get video details by ID
+    Get the WebVTT thumbnail track of a video, its cues point at tiles of the sprite sheets
     """
-    return video_service.get_video(db, video_id=video_id)
+    return thumbnail_service.get_file_response(video_id, VTT_FILENAME, request.headers, query=signed_query(request))
+
+
+@router.get("/{video_id}/thumbnails/{sheet_name}", dependencies=[Depends(authorize_video)])
+def get_thumbnail_sheet(video_id: int, sheet_name: str, request: Request):
+    """
+    Get a trickplay sprite sheet of a video
+    """
+    return thumbnail_service.get_file_response(
+        video_id, sheet_name, request.headers, range_header=request.headers.get("range"))
 
 
 @router.post("/upload", status_code=status.HTTP_201_CREATED, response_model=VideoSchema)
@@ -35,54 +75,164 @@ async def upload_video(
     imdb_id: str,
     file: UploadFile = File(...),
     subtitle: Optional[UploadFile] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    client: Optional[str] = Depends(get_client_host)
+):
+    """
+    Upload a new video file with metadata and imdb_id to get video metadata from OMDB API.
+    The file is indexed and transcoded on the ingest pool, the response doesn't wait for it
+    """
+    video = await video_service.upload_video(db, imdb_id=imdb_id, file=file, subtitle=subtitle, client=client)
+    ingest_service.schedule(video["id"])
+    return video
+
+
+@router.get("/{video_id}/seek")
+async def seek_video(
+    video_id: int,
+    t: float = Query(..., ge=0, description="Time to seek to, in seconds"),
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
 ):
     """
-    Upload a new video file with metadata and imdb_id to get video metadata from OMDB API
+    Map a time to the keyframe at or before it and the byte range to request from the stream
     """
-    return await video_service.upload_video(db, imdb_id=imdb_id, file=file, subtitle=subtitle)
+    video_file = await _resolve_video_file(video_id, None, grant, session_factory)
+    position = await run_io(sample_index_service.seek, video_file.filename, video_file.size, video_file.mtime, t)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Seek index not available for this video")
+
+    keyframe_time, start = position
+    return {
+        "time": keyframe_time,
+        "start": start,
+        "end": video_file.size - 1,
+        "range": f"bytes={start}-",
+    }
+
+
+async def _resolve_video_file(
+    video_id: int, rendition: Optional[str], grant: Optional[StreamGrant], session_factory: sessionmaker
+) -> VideoFile:
+    """
+    Resolve the original file of a video, or one of its renditions. The grant of a signed URL
+    names the original file, so it is served without database access
+    """
+    if rendition is not None:
+        return await video_file_resolver.resolve_rendition(video_id, rendition, session_factory)
+    if grant is not None:
+        return await video_file_resolver.resolve_signed(grant)
+    return await video_file_resolver.resolve(video_id, session_factory)
 
 
 @router.get("/stream/{video_id}")
-async def stream_video(video_id: int, request: Request, db: Session = Depends(get_db)):
-    """
-    Stream video with support for range requests (important for seeking in videos)
-    """
-    file_path = video_service.get_video_file_path(db, video_id=video_id)
-
-    # Get video details for content type
-    video = video_service.get_video(db, video_id=video_id)
-    file_size = os.path.getsize(file_path)
-    content_type = "video/mp4"  # Default content type
-
-    # Handle range requests
-    range_header = request.headers.get("range")
-
-    if range_header:
-        start, end = get_range_header(range_header, file_size)
-        size = end - start + 1
-
-        headers = {
-            "Content-Range": f"bytes {start}-{end}/{file_size}",
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(size),
-            "Content-Disposition": f"inline; filename={video['filename']}"
-        }
-
-        return StreamingResponse(
-            ranged_file_sender(file_path, start, end),
-            status_code=206,
-            media_type=content_type,
-            headers=headers
-        )
-
-    # No range header, return full file
-    return StreamingResponse(
-        file_sender(file_path),
-        media_type=content_type,
-        headers={
-            "Accept-Ranges": "bytes",
-            "Content-Length": str(file_size),
-            "Content-Disposition": f"inline; filename={video['filename']}"
-        }
-    )
+@router.head("/stream/{video_id}")
+async def stream_video(
+    video_id: int,
+    request: Request,
+    t: Optional[float] = Query(None, ge=0, description="Start at the keyframe at or before this time, in seconds"),
+    rendition: Optional[str] = Query(None, description="Stream a rendition of the ladder instead of the original"),
+    mode: Literal["video", "audio"] = Query("video", description="audio streams the audio-only rendition"),
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Stream video with support for range and conditional requests (important for seeking in videos).
+    HEAD requests are answered from cached metadata without opening the file, and signed URLs
+    of the original file are served without any database access
+    """
+    if mode == "audio":
+        if rendition is not None:
+            raise HTTPException(status_code=400, detail="The audio mode can't be combined with a rendition")
+        rendition = AUDIO_RENDITION
+
+    # Cached after the first request, so seeking costs no database round trips.
+    # On a miss the session is closed before streaming, a stream can stay open for hours
+    video_file = await _resolve_video_file(video_id, rendition, grant, session_factory)
+
+    seek_offset = None
+    if t is not None:
+        position = await run_io(sample_index_service.seek, video_file.filename, video_file.size, video_file.mtime, t)
+        seek_offset = position[1] if position is not None else None
+    return build_video_response(request, video_file, rendition, seek_offset)
+
+
+@router.get("/hls/{video_id}/master.m3u8")
+async def get_hls_master_playlist(
+    video_id: int,
+    request: Request,
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Get the HLS master playlist of a video, listing the original and every finished rendition.
+    The token of a signed URL is passed on to the variant playlists and their segments
+    """
+    video_file = await _resolve_video_file(video_id, None, grant, session_factory)
+    renditions = await run_in_threadpool(transcode_service.get_ready_renditions, video_id, session_factory)
+    playlist = await hls_service.get_master_playlist(video_file, renditions, signed_query(request))
+    return Response(content=playlist, media_type="application/vnd.apple.mpegurl")
+
+
+@router.get("/hls/{video_id}/index.m3u8")
+@router.get("/hls/{video_id}/{rendition}/index.m3u8")
+async def get_hls_playlist(
+    video_id: int,
+    request: Request,
+    rendition: Optional[str] = None,
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Get the HLS media playlist of a video or rendition, packaged from the stored MP4 on demand
+    """
+    video_file = await _resolve_video_file(video_id, rendition, grant, session_factory)
+    headers = validator_headers(video_file.etag, video_file.mtime)
+    if is_not_modified(request.headers, video_file.etag, video_file.mtime):
+        return Response(status_code=304, headers=headers)
+
+    playlist = await hls_service.get_playlist(video_file, signed_query(request))
+    return Response(content=playlist, media_type="application/vnd.apple.mpegurl", headers=headers)
+
+
+@router.get("/hls/{video_id}/init.mp4")
+@router.get("/hls/{video_id}/{rendition}/init.mp4")
+async def get_hls_init_segment(
+    video_id: int,
+    request: Request,
+    rendition: Optional[str] = None,
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Get the fragmented MP4 initialization segment of a video or rendition
+    """
+    video_file = await _resolve_video_file(video_id, rendition, grant, session_factory)
+    headers = validator_headers(video_file.etag, video_file.mtime)
+    if is_not_modified(request.headers, video_file.etag, video_file.mtime):
+        return Response(status_code=304, headers=headers)
+
+    segment = await hls_service.get_init_segment(video_file)
+    return Response(content=segment, media_type="video/mp4", headers=headers)
+
+
+@router.get("/hls/{video_id}/{segment_number}.m4s")
+@router.get("/hls/{video_id}/{rendition}/{segment_number}.m4s")
+async def get_hls_media_segment(
+    video_id: int,
+    segment_number: int,
+    request: Request,
+    rendition: Optional[str] = None,
+    grant: Optional[StreamGrant] = Depends(authorize_video),
+    session_factory: sessionmaker = Depends(get_session_factory)
+):
+    """
+    Get a fragmented MP4 media segment of a video or rendition, remuxed from the stored MP4 without transcoding
+    """
+    video_file = await _resolve_video_file(video_id, rendition, grant, session_factory)
+    headers = validator_headers(video_file.etag, video_file.mtime)
+    if is_not_modified(request.headers, video_file.etag, video_file.mtime):
+        return Response(status_code=304, headers=headers)
+
+    segment = await hls_service.get_media_segment(video_file, segment_number)
+    return Response(content=segment, media_type="video/iso.segment", headers=headers)
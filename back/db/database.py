@@ -1,3 +1,5 @@
+import os
+from typing import Any, Dict
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
@@ -7,6 +9,10 @@ from core.config import settings
 # Create SQLAlchemy engine
 engine = create_engine(settings.DATABASE_URL)
 
+# Workers forked from a preloaded app open their own connections instead of sharing the parent's
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
 # Create local session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -20,3 +26,18 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+# Dependency for endpoints that must release their connection before the response is sent
+def get_session_factory() -> sessionmaker:
+    return SessionLocal
+
+# Snapshot of connection pool occupancy
+def get_pool_status() -> Dict[str, Any]:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            status[name] = method()
+    return status
@@ -0,0 +1,92 @@
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from sqlalchemy import func, select, text, update
+from sqlalchemy.orm import Session
+
+from db.repositories.base import BaseRepository
+from models.rendition import Rendition, RENDITION_FAILED, RENDITION_PENDING, RENDITION_PROCESSING, RENDITION_READY
+from schemas.rendition import RenditionCreate, RenditionUpdate
+
+# Postgres advisory lock serializing the disk budget checks of every worker and box
+BUDGET_LOCK_KEY = 0x72656e64
+
+class RenditionRepository(BaseRepository[Rendition, RenditionCreate, RenditionUpdate]):
+    """Repository for rendition operations"""
+    
+    def __init__(self):
+        super().__init__(Rendition)
+    
+    def get_by_video_id(self, db: Session, *, video_id: int) -> List[Rendition]:
+        """Get all renditions of a video"""
+        return db.query(Rendition).filter(Rendition.video_id == video_id).all()
+    
+    def get_by_video_id_and_name(self, db: Session, *, video_id: int, name: str) -> Optional[Rendition]:
+        """Get a rendition by video ID and ladder rung name"""
+        return db.query(Rendition).filter(
+            Rendition.video_id == video_id,
+            Rendition.name == name
+        ).first()
+    
+    def get_ready_by_video_id(self, db: Session, *, video_id: int) -> List[Rendition]:
+        """Get the renditions of a video that can be streamed, highest first"""
+        return db.query(Rendition).filter(
+            Rendition.video_id == video_id,
+            Rendition.status == RENDITION_READY
+        ).order_by(Rendition.height.desc()).all()
+    
+    def get_pending_ids(self, db: Session) -> List[int]:
+        """Get the IDs of the renditions waiting to be encoded, oldest first"""
+        return [rendition_id for (rendition_id,) in db.query(Rendition.id).filter(
+            Rendition.status == RENDITION_PENDING
+        ).order_by(Rendition.id).all()]
+    
+    def requeue_stale(self, db: Session, *, started_before: datetime) -> int:
+        """Put renditions whose encoding started before started_before back to pending, their job is gone"""
+        result = db.execute(
+            update(Rendition)
+            .where(Rendition.status == RENDITION_PROCESSING, Rendition.updated_at < started_before)
+            .values(status=RENDITION_PENDING, size_bytes=0, updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount
+    
+    def claim(self, db: Session, *, rendition_id: int, reserve_bytes: int, budget_bytes: int) -> bool:
+        """
+        Move a pending or failed rendition to processing and reserve reserve_bytes of the disk budget
+        for it, in a single statement. False when another worker claimed it first or the budget is full
+        """
+        return self._update_within_budget(
+            db, rendition_id, (RENDITION_PENDING, RENDITION_FAILED), reserve_bytes, budget_bytes,
+            {"status": RENDITION_PROCESSING, "error": None},
+        )
+    
+    def finish(self, db: Session, *, rendition_id: int, size_bytes: int, budget_bytes: int, obj_in: Dict[str, Any]) -> bool:
+        """Mark a processing rendition ready with its actual size, False when that size doesn't fit the budget"""
+        return self._update_within_budget(
+            db, rendition_id, (RENDITION_PROCESSING,), size_bytes, budget_bytes,
+            {**obj_in, "status": RENDITION_READY},
+        )
+    
+    def _update_within_budget(
+        self, db: Session, rendition_id: int, statuses: tuple, size_bytes: int, budget_bytes: int, values: Dict[str, Any]
+    ) -> bool:
+        if db.get_bind().dialect.name == "postgresql":
+            # Concurrent checks would each see the space the other is about to take as free
+            db.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": BUDGET_LOCK_KEY})
+        # Finished renditions and the reservations of the ones being encoded, besides this one
+        used_bytes = select(func.coalesce(func.sum(Rendition.size_bytes), 0)).where(
+            Rendition.status.in_((RENDITION_READY, RENDITION_PROCESSING)),
+            Rendition.id != rendition_id,
+        ).scalar_subquery()
+        result = db.execute(
+            update(Rendition)
+            .where(Rendition.id == rendition_id, Rendition.status.in_(statuses), used_bytes + size_bytes <= budget_bytes)
+            .values(**values, size_bytes=size_bytes, updated_at=datetime.now())
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        return result.rowcount == 1
+
+# Create a singleton instance
+rendition_repository = RenditionRepository()
@@ -1,14 +1,21 @@
 import models.category
 import models.subtitle
 import models.video
+import models.rendition
 
-import uvicorn
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
 from core.config import settings
 from db.database import engine
 from api.api import api_router
+from services.omdb_client import omdb_client
+from services.transcode_service import transcode_service
+from utils.admission import AdmissionMiddleware, admission
+from utils.rate_limit import RateLimitMiddleware
+from utils.stream_registry import stream_registry
 
 # Create tables in the database - order matters for foreign key relationships
 # Create Category tables first (referenced by Video)
@@ -17,16 +24,52 @@ models.category.Base.metadata.create_all(bind=engine)
 models.video.Base.metadata.create_all(bind=engine)
 # Create Subtitle tables last (depends on Video)
 models.subtitle.Base.metadata.create_all(bind=engine)
+# Create Rendition tables (depends on Video)
+models.rendition.Base.metadata.create_all(bind=engine)
 # Create tables for other models if needed
 
+
+# Set by before_fork in the server supervisor, the workers it forks inherit it
+_stale_renditions_reset = False
+
+
+def before_fork() -> None:
+    """Run once by the server supervisor after preloading the app, before it forks any worker"""
+    global _stale_renditions_reset
+    # Encodings interrupted by the previous run, reset once rather than by every (recycled) worker
+    transcode_service.reset_stale()
+    _stale_renditions_reset = True
+    # Workers must not share the pooled connections of the supervisor
+    engine.dispose()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Served without the supervisor, e.g. by plain uvicorn
+    if not _stale_renditions_reset:
+        await run_in_threadpool(transcode_service.reset_stale)
+    # Encodings queued by a worker that is gone
+    await run_in_threadpool(transcode_service.queue_pending)
+    yield
+    # Close pooled connections to external APIs
+    await omdb_client.aclose()
+
+
 # Create application in FastAPI
 app = FastAPI(
     title=settings.PROJECT_NAME,
     description="API for streaming videos",
     version="0.1.0",
-    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+    openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
 )
 
+# Shed requests past the concurrency limits, inside CORS so rejections carry its headers
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Per-client limits apply before a client takes an admission slot
+app.add_middleware(RateLimitMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -42,9 +85,21 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 
 # Health check endpoint to verify that the API is working
 @app.get("/health")
-def health_check():
+def health_check(response: Response):
+    if stream_registry.draining:
+        # Load balancers stop sending requests to a draining worker
+        response.status_code = 503
+        return {"status": "draining", "message": "API is draining its streams"}
     return {"status": "healthy", "message": "API is running"}
 
 
+# Occupancy of this worker per route class, for load balancers to prefer the least loaded workers
+@app.get("/load")
+def load_report():
+    return admission.load()
+
+
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    # Production workers, `make run` serves with reload for development
+    import server
+    server.run("main:app")
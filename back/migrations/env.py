@@ -1,14 +1,17 @@
 from logging.config import fileConfig
 
 from alembic import context
-from db.database import DATABASE_URL, Base
-from models import music, video
+from core.config import settings
+from db.database import Base
+# Imported for their tables, so autogenerate sees every model
+from models import category, playlist, rendition, subtitle, video  # noqa: F401
 from sqlalchemy import engine_from_config, pool
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
-config.set_main_option("sqlalchemy.url", DATABASE_URL)
+# The ini file goes through configparser interpolation, % must be escaped
+config.set_main_option("sqlalchemy.url", settings.DATABASE_URL.replace("%", "%%"))
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -19,10 +22,7 @@ if config.config_file_name is not None:
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-# target_metadata = music.Music.metadata
-# target_metadata = video.Video.metadata
-target_metadata = music.Music.metadata
-target_metadata = video.Video.metadata
+target_metadata = Base.metadata
 
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
@@ -0,0 +1,90 @@
+"""video probe columns and renditions
+
+Adds the columns the ingest pipeline and the container probe fill in, and the
+renditions table of the bitrate ladder. Databases created by Base.metadata.create_all
+before these models changed already have some of them, so only missing ones are added.
+
+Revision ID: 3f2a9c1d7b4e
+Revises:
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Optional, Sequence, Set, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7b4e'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+VIDEO_COLUMNS = [
+    sa.Column('is_faststart', sa.Boolean(), nullable=True, server_default=sa.false()),
+    sa.Column('container', sa.String(), nullable=True),
+    sa.Column('duration_seconds', sa.Float(), nullable=True),
+    sa.Column('bitrate', sa.Integer(), nullable=True),
+    sa.Column('width', sa.Integer(), nullable=True),
+    sa.Column('height', sa.Integer(), nullable=True),
+    sa.Column('video_codec', sa.String(), nullable=True),
+    sa.Column('audio_codec', sa.String(), nullable=True),
+]
+
+
+def _existing_tables() -> Optional[Set[str]]:
+    # Offline (--sql) there is no database to look at, everything is emitted
+    if context.is_offline_mode():
+        return None
+    return set(sa.inspect(op.get_bind()).get_table_names())
+
+
+def _existing_columns(table: str) -> Set[str]:
+    if context.is_offline_mode():
+        return set()
+    return {column['name'] for column in sa.inspect(op.get_bind()).get_columns(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    tables = _existing_tables()
+
+    # A fresh database gets the videos table from create_all, with these columns
+    if tables is None or 'videos' in tables:
+        existing = _existing_columns('videos')
+        for column in VIDEO_COLUMNS:
+            if column.name not in existing:
+                op.add_column('videos', column.copy())
+
+    if tables is None or 'renditions' not in tables:
+        op.create_table(
+            'renditions',
+            sa.Column('id', sa.Integer(), nullable=False),
+            sa.Column('video_id', sa.Integer(), nullable=True),
+            sa.Column('name', sa.String(), nullable=True),
+            sa.Column('filename', sa.String(), nullable=True),
+            sa.Column('height', sa.Integer(), nullable=True),
+            sa.Column('width', sa.Integer(), nullable=True),
+            sa.Column('video_bitrate', sa.Integer(), nullable=True),
+            sa.Column('audio_bitrate', sa.Integer(), nullable=True),
+            sa.Column('bandwidth', sa.Integer(), nullable=True),
+            sa.Column('size_bytes', sa.BigInteger(), nullable=True),
+            sa.Column('status', sa.String(), nullable=True),
+            sa.Column('error', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+            sa.ForeignKeyConstraint(['video_id'], ['videos.id']),
+            sa.PrimaryKeyConstraint('id'),
+        )
+        op.create_index(op.f('ix_renditions_id'), 'renditions', ['id'], unique=False)
+        op.create_index(op.f('ix_renditions_video_id'), 'renditions', ['video_id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_renditions_video_id'), table_name='renditions')
+    op.drop_index(op.f('ix_renditions_id'), table_name='renditions')
+    op.drop_table('renditions')
+    for column in reversed(VIDEO_COLUMNS):
+        op.drop_column('videos', column.name)
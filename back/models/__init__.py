@@ -3,7 +3,8 @@ from models.associations import *
 from models.category import Category
 from models.subtitle import Subtitle
 from models.video import Video
+from models.rendition import Rendition
 from models.playlist import Playlist
 
 # This ensures all models are imported when the models package is imported
-__all__ = ['Category', 'Subtitle', 'Video', 'Playlist']
+__all__ = ['Category', 'Subtitle', 'Video', 'Rendition', 'Playlist']
@@ -0,0 +1,37 @@
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, ForeignKey
+from datetime import datetime
+from sqlalchemy.orm import relationship
+from db.database import Base
+
+# Lifecycle of a rendition
+RENDITION_PENDING = "pending"
+RENDITION_PROCESSING = "processing"
+RENDITION_READY = "ready"
+RENDITION_FAILED = "failed"
+
+# Name of the audio-only rendition, every other rendition is a rung of the video ladder
+AUDIO_RENDITION = "audio"
+
+
+class Rendition(Base):
+    __tablename__ = "renditions"
+
+    id = Column(Integer, primary_key=True, index=True)
+    video_id = Column(Integer, ForeignKey("videos.id"), index=True)
+    name = Column(String)
+    filename = Column(String)
+    height = Column(Integer)
+    width = Column(Integer)
+    video_bitrate = Column(Integer)  # Target bitrates of the ladder rung, in kbit/s
+    audio_bitrate = Column(Integer)
+    bandwidth = Column(Integer)  # Measured average bitrate of the output, in bit/s
+    size_bytes = Column(BigInteger, default=0)
+    status = Column(String, default=RENDITION_PENDING)
+    error = Column(String)
+    # Callables, evaluated on each insert and update
+    created_at = Column(DateTime, default=datetime.now)
+    updated_at = Column(DateTime, default=datetime.now,
+                        onupdate=datetime.now)
+
+    # Relationship
+    video = relationship("Video", back_populates="renditions")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Boolean, Column, Float, Integer, String, DateTime, ForeignKey
 from datetime import datetime
 from sqlalchemy.orm import relationship
 from db.database import Base
@@ -22,4 +22,15 @@ class Video(Base):
     thumbnail = Column(String)
     year = Column(Integer)
     subtitles = relationship("Subtitle", back_populates="video")
+    renditions = relationship("Rendition", back_populates="video")
     content_type = Column(String)
+    # Set by the ingest pipeline once the moov box is known to precede the media data
+    is_faststart = Column(Boolean, default=False)
+    # Read from the container headers by the probe, None until the file was probed
+    container = Column(String)
+    duration_seconds = Column(Float)
+    bitrate = Column(Integer)
+    width = Column(Integer)
+    height = Column(Integer)
+    video_codec = Column(String)
+    audio_codec = Column(String)
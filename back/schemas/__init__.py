@@ -2,4 +2,5 @@
 from schemas.video import VideoBase, VideoCreate, VideoUpdate, VideoSchema
 from schemas.subtitle import SubtitleBase, SubtitleCreate, SubtitleUpdate, SubtitleSchema
 from schemas.category import CategoryBase, CategoryCreate, CategoryUpdate, CategorySchema
+from schemas.rendition import RenditionBase, RenditionCreate, RenditionUpdate, RenditionSchema
 from schemas.playlist import PlaylistBase, PlaylistCreate, PlaylistUpdate, PlaylistSchema
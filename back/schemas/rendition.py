@@ -0,0 +1,35 @@
+from pydantic import BaseModel
+from typing import Optional
+
+class RenditionBase(BaseModel):
+    """Base schema for rendition data"""
+    name: str
+    height: int
+    video_bitrate: int
+    audio_bitrate: int
+
+class RenditionCreate(RenditionBase):
+    """Schema for creating a new rendition"""
+    video_id: int
+    filename: str
+
+class RenditionUpdate(BaseModel):
+    """Schema for updating an existing rendition"""
+    status: Optional[str] = None
+    error: Optional[str] = None
+    width: Optional[int] = None
+    bandwidth: Optional[int] = None
+    size_bytes: Optional[int] = None
+
+class RenditionSchema(RenditionBase):
+    """Schema for rendition response"""
+    id: int
+    video_id: int
+    status: str
+    width: Optional[int] = None
+    bandwidth: Optional[int] = None
+    size_bytes: Optional[int] = None
+    stream_url: Optional[str] = None
+
+    class Config:
+        orm_mode = True
@@ -35,7 +35,15 @@ class VideoSchema(VideoBase):
     upload_date: datetime
     categories: List[str] = []
     stream_url: str
+    hls_url: Optional[str] = None
     subtitles_urls: List[str] = []
+    container: Optional[str] = None
+    duration_seconds: Optional[float] = None
+    bitrate: Optional[int] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_codec: Optional[str] = None
+    audio_codec: Optional[str] = None
 
     class Config:
         orm_mode = True
@@ -0,0 +1,220 @@
+"""
+Production server: runs the app in several uvicorn worker processes sharing one listening
+socket. With preload the app is imported once before forking so workers share its memory,
+and workers that exit (e.g. after SERVER_MAX_REQUESTS) are replaced
+
+    python server.py                  # metadata API (main:app)
+    python server.py stream_app:app   # stream node
+"""
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import sys
+import time
+from typing import Any, Dict, List, Optional, Set
+
+import uvicorn
+
+from core.config import settings
+from utils.stream_registry import stream_registry
+
+logger = logging.getLogger("uvicorn.error")
+
+# Exit code of a worker that couldn't start serving, the server stops instead of respawning it
+WORKER_BOOT_ERROR = 3
+
+
+def worker_count() -> int:
+    """Number of worker processes, one per CPU core unless configured"""
+    return settings.SERVER_WORKERS or multiprocessing.cpu_count()
+
+
+def server_options(port: Optional[int] = None) -> Dict[str, Any]:
+    """uvicorn options shared by every worker"""
+    return {
+        "host": settings.SERVER_HOST,
+        "port": port or settings.SERVER_PORT,
+        "loop": settings.SERVER_LOOP,
+        "http": settings.SERVER_HTTP,
+        "backlog": settings.SERVER_BACKLOG,
+        "timeout_keep_alive": settings.SERVER_KEEP_ALIVE,
+        "timeout_graceful_shutdown": settings.SERVER_GRACEFUL_TIMEOUT,
+        "forwarded_allow_ips": settings.SERVER_FORWARDED_ALLOW_IPS,
+        "access_log": settings.SERVER_ACCESS_LOG,
+    }
+
+
+def max_requests() -> Optional[int]:
+    """Requests a new worker serves before it is recycled, None to never recycle"""
+    if not settings.SERVER_MAX_REQUESTS:
+        return None
+    return settings.SERVER_MAX_REQUESTS + random.randint(0, settings.SERVER_MAX_REQUESTS_JITTER)
+
+
+class Server(uvicorn.Server):
+    """uvicorn server that drains its streams when shutting down, e.g. on SIGTERM or when recycled"""
+
+    async def shutdown(self, sockets: Optional[List[socket.socket]] = None) -> None:
+        stream_registry.drain(settings.STREAM_DRAIN_TIMEOUT, settings.STREAM_DRAIN_SPREAD)
+        await super().shutdown(sockets)
+
+
+class Supervisor:
+    """Forks the workers and keeps their number up until told to stop"""
+
+    def __init__(self, config: uvicorn.Config, workers: int, preload: bool):
+        self.config = config
+        self.workers = workers
+        self.preload = preload
+        # Started workers by pid
+        self.children: Dict[int, float] = {}
+        # Workers told to stop, they drain their streams while replacements already serve
+        self.retiring: Set[int] = set()
+        self.should_exit = False
+        self.should_recycle = False
+        self.exit_code = 0
+
+    def run(self) -> int:
+        """Serve until SIGINT or SIGTERM, SIGHUP gracefully replaces every worker"""
+        if self.preload:
+            self.config.load()
+            self._before_fork()
+        sock = self.config.bind_socket()
+        signal.signal(signal.SIGINT, self._handle_exit)
+        signal.signal(signal.SIGTERM, self._handle_exit)
+        signal.signal(signal.SIGHUP, self._handle_recycle)
+        logger.info(
+            "Starting %d workers (loop=%s, http=%s, preload=%s)",
+            self.workers, self.config.loop, self.config.http, self.preload,
+        )
+
+        try:
+            while not self.should_exit:
+                if self.should_recycle:
+                    self.should_recycle = False
+                    self._signal_workers(signal.SIGTERM)
+                    self.retiring.update(self.children)
+                self._reap()
+                while not self.should_exit and len(self.children) - len(self.retiring) < self.workers:
+                    self._spawn(sock)
+                time.sleep(0.5)
+        finally:
+            self._stop()
+            sock.close()
+        return self.exit_code
+
+    def _before_fork(self) -> None:
+        """
+        Run the before_fork() function of the preloaded app's module, if it has one: work done once
+        for the life of the supervisor, that recycled workers must not repeat
+        """
+        if not isinstance(self.config.app, str):
+            return
+        module = sys.modules.get(self.config.app.partition(":")[0])
+        before_fork = getattr(module, "before_fork", None)
+        if before_fork is not None:
+            before_fork()
+
+    def _spawn(self, sock: socket.socket) -> None:
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.monotonic()
+            return
+
+        code = 0
+        try:
+            code = self._serve(sock)
+        except SystemExit as exc:
+            code = exc.code if isinstance(exc.code, int) else 1
+        except BaseException:
+            logger.exception("Worker %d crashed", os.getpid())
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _serve(self, sock: socket.socket) -> int:
+        """Body of a worker process"""
+        # Out of the terminal's process group, a Ctrl-C reaches the workers once, through the supervisor
+        os.setpgid(0, 0)
+        for signum in (signal.SIGINT, signal.SIGTERM, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_DFL)
+        self.config.limit_max_requests = max_requests()
+        server = Server(self.config)
+        server.run(sockets=[sock])
+        return 0 if server.started else WORKER_BOOT_ERROR
+
+    def _reap(self) -> None:
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self.children.clear()
+                return
+            if pid == 0:
+                return
+            if self.children.pop(pid, None) is None:
+                continue
+            if pid in self.retiring:
+                self.retiring.discard(pid)
+                continue
+
+            code = os.waitstatus_to_exitcode(status)
+            if code == WORKER_BOOT_ERROR and not self.should_exit:
+                logger.error("Worker %d failed to boot, stopping", pid)
+                self.should_exit = True
+                self.exit_code = WORKER_BOOT_ERROR
+            elif not self.should_exit:
+                logger.info("Worker %d exited with code %d, replacing it", pid, code)
+
+    def _stop(self) -> None:
+        """Let the workers finish their requests, then kill the ones still running"""
+        self.should_exit = True
+        self._signal_workers(signal.SIGTERM)
+        deadline = time.monotonic() + settings.SERVER_GRACEFUL_TIMEOUT + 5
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        self._signal_workers(signal.SIGKILL)
+        for pid in list(self.children):
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        self.children.clear()
+        self.retiring.clear()
+
+    def _signal_workers(self, signum: int) -> None:
+        for pid in list(self.children):
+            # A second SIGTERM makes uvicorn skip the graceful shutdown
+            if signum == signal.SIGTERM and pid in self.retiring:
+                continue
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _handle_exit(self, signum, frame) -> None:
+        self.should_exit = True
+
+    def _handle_recycle(self, signum, frame) -> None:
+        self.should_recycle = True
+
+
+def run(app: str = "main:app", port: Optional[int] = None) -> int:
+    """Serve app ("module:attribute") with the configured workers"""
+    options = server_options(port)
+    workers = worker_count()
+    if not hasattr(os, "fork"):
+        # Without fork (Windows), uvicorn spawns the workers and each imports the app itself
+        uvicorn.run(app, workers=workers, **options)
+        return 0
+
+    config = uvicorn.Config(app, **options)
+    return Supervisor(config, workers, settings.SERVER_PRELOAD).run()
+
+
+if __name__ == "__main__":
+    sys.exit(run(*sys.argv[1:2]))
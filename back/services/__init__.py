@@ -1,2 +1,8 @@
 from services.video_service import video_service
 from services.subtitle_service import subtitle_service
+from services.video_file_resolver import video_file_resolver
+from services.ingest_service import ingest_service
+from services.sample_index_service import sample_index_service
+from services.hls_service import hls_service
+from services.transcode_service import transcode_service
+from services.thumbnail_service import thumbnail_service
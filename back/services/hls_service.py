@@ -0,0 +1,157 @@
+import os
+import struct
+from functools import lru_cache
+from typing import Awaitable, Callable, Hashable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from core.config import settings
+from models.rendition import Rendition, AUDIO_RENDITION
+from services.sample_index_service import sample_index_service
+from services.video_file_resolver import VideoFile
+from utils.async_io import run_io
+from utils.file_handlers import SharedFile
+from utils.fmp4 import (
+    Segment, build_init_segment, build_master_playlist, build_media_playlist, build_media_segment, plan_segments
+)
+from utils.mp4 import MP4Error
+from utils.mp4_index import SampleIndex
+from utils.probe import ProbeError, probe_file
+from utils.segment_cache import SegmentCache, segment_cache
+from utils.single_flight import SingleFlight
+
+# Errors raised while parsing a file that turns out not to be a usable MP4
+PACKAGING_ERRORS = (MP4Error, OSError, struct.error, IndexError)
+
+
+@lru_cache(maxsize=settings.SAMPLE_INDEX_CACHE_SIZE)
+def _plan(index: SampleIndex, segment_duration: float) -> List[Segment]:
+    """Segment list of an index, cached for as long as the index itself is"""
+    return plan_segments(index, segment_duration)
+
+
+def _read_variant_infos(paths: List[str]) -> List[Tuple[Optional[Tuple[int, int]], Optional[str]]]:
+    """Resolution and HLS CODECS value (RFC 6381, video then audio) of stored files, from their headers"""
+    infos = []
+    for path in paths:
+        try:
+            info = probe_file(path, settings.PROBE_MAX_HEADER_BYTES)
+        except (ProbeError, OSError):
+            infos.append((None, None))
+            continue
+        resolution = (info.width, info.height) if info.width and info.height else None
+        codecs = ",".join(codec for codec in (info.video_codec, info.audio_codec) if codec)
+        infos.append((resolution, codecs or None))
+    return infos
+
+
+def _package_media_segment(file: SharedFile, index: SampleIndex, segment: Segment) -> bytes:
+    """
+    Package a media segment from the shared descriptor of a file. A retired file is reopened
+    by path, which may now hold a newer version than the one the index and plan describe
+    """
+    fd = file.acquire()
+    try:
+        stat = os.fstat(fd)
+        if not index.matches(stat.st_size, stat.st_mtime):
+            raise HTTPException(status_code=404, detail="Video file changed while it was packaged")
+        return build_media_segment(fd, index, segment)
+    finally:
+        file.release()
+
+
+class HLSService:
+    """Packages stored MP4 files into HLS fragmented MP4 segments on demand, without transcoding"""
+
+    def __init__(self, cache: SegmentCache, segment_duration: float):
+        self.cache = cache
+        self.segment_duration = segment_duration
+        # Concurrent requests for a segment that is not cached yet package it once
+        self._builds = SingleFlight()
+
+    async def get_playlist(self, video_file: VideoFile, query: str = "") -> str:
+        """Get the media playlist of a video, query is appended to the segment URIs"""
+        segments = _plan(await self._get_index(video_file), self.segment_duration)
+        return build_media_playlist(segments, f"init.mp4{query}", f"{{}}.m4s{query}")
+
+    async def get_master_playlist(self, video_file: VideoFile, renditions: List[Rendition], query: str = "") -> str:
+        """
+        Get the master playlist of a video: the original file and every finished rendition.
+        query is appended to the variant URIs
+        """
+        index = await self._get_index(video_file)
+        source_bandwidth = int(video_file.size * 8 / index.duration) if index.duration else 0
+        # Players may pick an audio-only variant on a slow link, it is served by the audio stream mode instead
+        renditions = [rendition for rendition in renditions if rendition.name != AUDIO_RENDITION]
+        # Every variant carries its codecs, so players skip the ones they can't decode without fetching them
+        paths = [video_file.path] + [os.path.join(settings.RENDITIONS_DIR, rendition.filename) for rendition in renditions]
+        variant_infos = await run_io(_read_variant_infos, paths)
+        source_resolution, source_codecs = variant_infos[0]
+
+        variants: List[Tuple[str, int, Optional[Tuple[int, int]], Optional[str]]] = [
+            (f"index.m3u8{query}", source_bandwidth, source_resolution, source_codecs)
+        ]
+        for rendition, (_, codecs) in zip(renditions, variant_infos[1:]):
+            resolution = (rendition.width, rendition.height) if rendition.width else None
+            bandwidth = rendition.bandwidth or (rendition.video_bitrate + rendition.audio_bitrate) * 1000
+            variants.append((f"{rendition.name}/index.m3u8{query}", bandwidth, resolution, codecs))
+        return build_master_playlist(variants)
+
+    async def get_init_segment(self, video_file: VideoFile) -> bytes:
+        """Get the initialization segment of a video"""
+        index = await self._get_index(video_file)
+        return await self._cached(
+            (video_file.path, video_file.mtime, "init"),
+            lambda: run_io(build_init_segment, video_file.path, index),
+        )
+
+    async def get_media_segment(self, video_file: VideoFile, number: int) -> bytes:
+        """Get a media segment of a video"""
+        index = await self._get_index(video_file)
+        segments = _plan(index, self.segment_duration)
+        if not 0 <= number < len(segments):
+            raise HTTPException(status_code=404, detail="Segment not found")
+
+        return await self._cached(
+            (video_file.path, video_file.mtime, number),
+            # Opening the descriptor on first use touches the disk
+            lambda: run_io(_package_media_segment, video_file.file, index, segments[number]),
+        )
+
+    async def _get_index(self, video_file: VideoFile) -> SampleIndex:
+        """Get the sample index of a video, building it for files uploaded before indexing existed"""
+        # Stats the sidecar, and loads it when it isn't cached yet
+        index = await run_io(sample_index_service.get_index, video_file.filename, video_file.size, video_file.mtime)
+        if index is not None:
+            return index
+
+        async def build() -> SampleIndex:
+            return await run_io(sample_index_service.build_index, video_file.path, video_file.filename)
+
+        try:
+            index = await self._builds.do((video_file.path, video_file.mtime, "index"), build)
+        except PACKAGING_ERRORS:
+            raise HTTPException(status_code=404, detail="HLS not available for this video")
+        if not index.matches(video_file.size, video_file.mtime):
+            raise HTTPException(status_code=404, detail="Video file changed while it was indexed")
+        return index
+
+    async def _cached(self, key: Hashable, package: Callable[[], Awaitable[bytes]]) -> bytes:
+        """Get a packaged segment from the cache, packaging it on a miss"""
+        data = self.cache.get(key)
+        if data is not None:
+            return data
+
+        async def package_and_cache() -> bytes:
+            packaged = await package()
+            self.cache.put(key, packaged)
+            return packaged
+
+        try:
+            return await self._builds.do(key, package_and_cache)
+        except PACKAGING_ERRORS:
+            raise HTTPException(status_code=404, detail="HLS not available for this video")
+
+
+# Create a singleton instance
+hls_service = HLSService(cache=segment_cache, segment_duration=settings.HLS_SEGMENT_DURATION)
@@ -0,0 +1,109 @@
+import logging
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.database import SessionLocal
+from db.repositories.video_repository import video_repository
+from services.sample_index_service import sample_index_service
+from services.thumbnail_service import thumbnail_service
+from services.transcode_service import PRIORITY_UPLOAD, transcode_service
+from utils.mp4 import MP4Error, normalize_faststart
+from utils.probe import ProbeError, probe_file
+
+logger = logging.getLogger(__name__)
+
+
+class IngestService:
+    """Post-upload processing of video files, run on a worker pool outside the request path"""
+
+    def __init__(self, session_factory: Callable[[], Session], max_workers: int = 1):
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def schedule(self, video_id: int) -> None:
+        """Queue the ingest of a video on the worker pool, the upload request doesn't wait for it"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ingest")
+        self._executor.submit(self._run, video_id)
+
+    def process_video(self, video_id: int) -> None:
+        """Run the ingest steps of a freshly uploaded video, the upload itself already made it faststart"""
+        self.probe_video(video_id)
+        # The index records byte offsets, so it is built after the file was rewritten
+        self.build_sample_index(video_id)
+        # New uploads go ahead of any backfill still waiting for a slot
+        transcode_service.schedule_video(video_id, PRIORITY_UPLOAD)
+        thumbnail_service.schedule(video_id)
+
+    def normalize_faststart(self, video_id: int) -> bool:
+        """Move the moov box of a stored MP4 in front of its media data and record the result"""
+        file_path = self._get_video_file_path(video_id)
+        if file_path is None:
+            return False
+
+        try:
+            normalize_faststart(file_path)
+        except (MP4Error, OSError) as error:
+            logger.warning("Could not normalize video %s to faststart: %s", video_id, error)
+            return False
+
+        # Updating the video also invalidates the stream path's cached file
+        self._update_video(video_id, {"is_faststart": True})
+        return True
+
+    def probe_video(self, video_id: int) -> bool:
+        """Record the container, exact duration, average bitrate, resolution and codecs of a video"""
+        file_path = self._get_video_file_path(video_id)
+        if file_path is None:
+            return False
+
+        try:
+            media_info = probe_file(file_path, settings.PROBE_MAX_HEADER_BYTES)
+        except (ProbeError, OSError) as error:
+            logger.warning("Could not probe video %s: %s", video_id, error)
+            return False
+        self._update_video(video_id, {"content_type": media_info.content_type, **media_info.to_dict()})
+        return True
+
+    def build_sample_index(self, video_id: int) -> bool:
+        """Build the keyframe/sample index sidecar used for time-based seeking"""
+        file_path = self._get_video_file_path(video_id)
+        if file_path is None:
+            return False
+
+        try:
+            sample_index_service.build_index(file_path, os.path.basename(file_path))
+        except (MP4Error, OSError, struct.error, IndexError) as error:
+            logger.warning("Could not build the sample index of video %s: %s", video_id, error)
+            return False
+        return True
+
+    def _run(self, video_id: int) -> None:
+        try:
+            self.process_video(video_id)
+        except Exception:
+            logger.exception("Ingesting video %s crashed", video_id)
+
+    def _get_video_file_path(self, video_id: int) -> Optional[str]:
+        """Get the file path of a video with a short-lived session"""
+        with self.session_factory() as db:
+            video = video_repository.get(db, id=video_id)
+            if not video:
+                return None
+            return os.path.join(settings.VIDEOS_DIR, video.filename)
+
+    def _update_video(self, video_id: int, obj_in: dict) -> None:
+        """Update a video with a short-lived session"""
+        with self.session_factory() as db:
+            video = video_repository.get(db, id=video_id)
+            if video:
+                video_repository.update(db, db_obj=video, obj_in=obj_in)
+
+
+# Create a singleton instance
+ingest_service = IngestService(session_factory=SessionLocal, max_workers=settings.INGEST_WORKERS)
@@ -0,0 +1,160 @@
+import asyncio
+import logging
+import random
+import time
+from typing import Any, Dict, Optional
+
+import httpx
+
+from core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class OMDBError(Exception):
+    """OMDB answered, but not with the movie (unknown id, invalid key...)"""
+
+
+class OMDBUnavailable(Exception):
+    """OMDB couldn't be reached, or the circuit breaker is open after repeated failures"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service: after failure_threshold consecutive failures calls are refused
+    for reset_timeout seconds, then a single trial call decides whether it closes again
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset_timeout else "open"
+
+    def retry_after(self) -> float:
+        """Seconds until calls are tried again"""
+        if self.opened_at is None:
+            return 0.0
+        return max(self.reset_timeout - (time.monotonic() - self.opened_at), 0.0)
+
+    def allow(self) -> bool:
+        """Whether a call may go out now, a half-open breaker lets one trial call through"""
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half-open" and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._trial_running or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("OMDB circuit breaker opened after %d failures", self.failures)
+            # A failed trial keeps it open for another reset_timeout
+            self.opened_at = time.monotonic()
+        self._trial_running = False
+
+    def abandon(self) -> None:
+        """A call was cancelled before its outcome was known, let another trial through"""
+        self._trial_running = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "failures": self.failures, "retry_after": round(self.retry_after(), 1)}
+
+
+class OMDBClient:
+    """
+    Shared async client of the OMDB API: pooled keep-alive connections, strict timeouts, bounded
+    retries with jittered backoff for transient failures and a circuit breaker in front
+    """
+
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.OMDB_BREAKER_FAILURES, settings.OMDB_BREAKER_RESET)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use, so each forked worker opens its own connections
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=settings.OMDB_BASE_URL,
+                timeout=httpx.Timeout(settings.OMDB_TIMEOUT, connect=settings.OMDB_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=settings.OMDB_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.OMDB_MAX_CONNECTIONS,
+                ),
+            )
+        return self._client
+
+    async def get_movie(self, imdb_id: str) -> Dict[str, Any]:
+        """Get the OMDB record of a movie by IMDB id"""
+        if not self.breaker.allow():
+            raise OMDBUnavailable("OMDB API is unavailable", self.breaker.retry_after())
+
+        try:
+            return await self._get_with_retries(imdb_id)
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+
+    async def _get_with_retries(self, imdb_id: str) -> Dict[str, Any]:
+        error: Optional[Exception] = None
+        for attempt in range(settings.OMDB_RETRIES + 1):
+            if attempt:
+                # Full jitter, so retries of concurrent uploads don't line up
+                await asyncio.sleep(random.uniform(0, settings.OMDB_RETRY_BACKOFF * 2 ** (attempt - 1)))
+            try:
+                response = await self.client.get("/", params={"i": imdb_id, "apikey": settings.OMDB_API_KEY})
+            except httpx.HTTPError as exc:
+                error = exc
+                continue
+            if response.status_code == 429 or response.status_code >= 500:
+                error = OMDBError(f"OMDB API answered {response.status_code}")
+                continue
+
+            # A definite answer, OMDB itself is up
+            self.breaker.record_success()
+            if response.status_code != 200:
+                raise OMDBError(f"OMDB API answered {response.status_code}")
+            try:
+                data = response.json()
+            except ValueError:
+                raise OMDBError("Invalid answer from OMDB API")
+            if data.get("Error"):
+                raise OMDBError(data["Error"])
+            return data
+
+        self.breaker.record_failure()
+        logger.warning("OMDB request for %s failed: %s", imdb_id, error)
+        raise OMDBUnavailable("OMDB API is unavailable", self.breaker.retry_after())
+
+    async def aclose(self) -> None:
+        """Close the pooled connections"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"breaker": self.breaker.stats()}
+
+
+# Create a singleton instance
+omdb_client = OMDBClient()
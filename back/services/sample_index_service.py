@@ -0,0 +1,47 @@
+import os
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from core.config import settings
+from utils.mp4 import MP4Error
+from utils.mp4_index import SampleIndex
+
+
+@lru_cache(maxsize=settings.SAMPLE_INDEX_CACHE_SIZE)
+def _load_index(index_path: str, index_mtime: float) -> SampleIndex:
+    """Load a sidecar index, cached per sidecar version"""
+    return SampleIndex.load(index_path)
+
+
+class SampleIndexService:
+    """Builds and serves the keyframe/sample index sidecars of video files"""
+
+    def get_index_path(self, filename: str) -> str:
+        """Path of the sidecar index of a video file"""
+        return os.path.join(settings.INDEXES_DIR, f"{filename}.idx")
+
+    def build_index(self, file_path: str, filename: str) -> SampleIndex:
+        """Parse the sample tables of a video file and write its sidecar index"""
+        index = SampleIndex.build(file_path)
+        index.save(self.get_index_path(filename))
+        return index
+
+    def get_index(self, filename: str, size: int, mtime: float) -> Optional[SampleIndex]:
+        """Get the index of a video file, None if it was never built or is stale"""
+        index_path = self.get_index_path(filename)
+        try:
+            index = _load_index(index_path, os.stat(index_path).st_mtime)
+        except (OSError, MP4Error, ValueError):
+            return None
+        return index if index.matches(size, mtime) else None
+
+    def seek(self, filename: str, size: int, mtime: float, seconds: float) -> Optional[Tuple[float, int]]:
+        """Map a time to the (keyframe time, first byte) of a video file"""
+        index = self.get_index(filename, size, mtime)
+        if index is None:
+            return None
+        return index.seek(seconds)
+
+
+# Create a singleton instance
+sample_index_service = SampleIndexService()
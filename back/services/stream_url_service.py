@@ -0,0 +1,75 @@
+import os
+from typing import Optional
+
+from core.config import settings
+from models.subtitle import Subtitle
+from models.video import Video
+from utils.http_cache import make_etag
+from utils.stream_tokens import StreamGrant, expiry_from_now, sign_stream_grant
+from utils.subtitles import get_subtitle_media_type
+from utils.video_files import DEFAULT_CONTENT_TYPE
+
+
+class StreamURLService:
+    """
+    Builds the stream, HLS and subtitle URLs handed out by the metadata endpoints. With a signing key
+    they are signed and expiring so stream nodes can serve them without looking anything up,
+    and with STREAM_BASE_URL the stream and subtitle URLs point at those nodes
+    """
+
+    def build_stream_url(self, video: Video, client: Optional[str] = None) -> str:
+        """Stream URL of a video"""
+        return self._build_video_url(f"/videos/stream/{video.id}", video, client, settings.STREAM_BASE_URL)
+
+    def build_rendition_url(self, video: Video, rendition: str, client: Optional[str] = None) -> str:
+        """Stream URL of a rendition of a video, served by this API since renditions are looked up"""
+        return self._build_video_url(f"/videos/stream/{video.id}?rendition={rendition}", video, client)
+
+    def build_hls_url(self, video: Video, client: Optional[str] = None) -> str:
+        """HLS master playlist URL of a video, its token is passed on to every playlist and segment"""
+        return self._build_video_url(f"/videos/hls/{video.id}/master.m3u8", video, client)
+
+    def build_subtitle_url(self, subtitle: Subtitle, client: Optional[str] = None) -> str:
+        """Content URL of a subtitle"""
+        path = os.path.join(settings.SUBTITLES_DIR, subtitle.filename)
+        return self._build_url(f"/subtitles/content/{subtitle.id}", path, client, lambda version: StreamGrant(
+            video_id=subtitle.video_id,
+            path=os.path.relpath(path, settings.UPLOAD_DIR),
+            version=version,
+            content_type=get_subtitle_media_type(subtitle.filename),
+            expires_at=expiry_from_now(settings.STREAM_URL_TTL),
+            subtitle_id=subtitle.id,
+        ), settings.STREAM_BASE_URL)
+
+    def _build_video_url(self, url: str, video: Video, client: Optional[str], base_url: str = "") -> str:
+        # The grant is for the original file, it covers the renditions and HLS packaging of the video too
+        path = os.path.join(settings.VIDEOS_DIR, video.filename)
+        return self._build_url(url, path, client, lambda version: StreamGrant(
+            video_id=video.id,
+            path=os.path.relpath(path, settings.UPLOAD_DIR),
+            version=version,
+            content_type=video.content_type or DEFAULT_CONTENT_TYPE,
+            expires_at=expiry_from_now(settings.STREAM_URL_TTL),
+            bitrate=video.bitrate,
+        ), base_url)
+
+    def _build_url(self, url: str, path: str, client: Optional[str], make_grant, base_url: str = "") -> str:
+        if not settings.STREAM_SIGNING_KEY:
+            return url
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Nothing to grant access to, the plain URL answers 404
+            return url
+
+        grant = make_grant(make_etag(stat.st_size, stat.st_mtime))
+        if settings.STREAM_URL_BIND_CLIENT:
+            grant.client = client
+        token = sign_stream_grant(grant, settings.STREAM_SIGNING_KEY)
+        separator = "&" if "?" in url else "?"
+        return f"{base_url.rstrip('/')}{url}{separator}token={token}"
+
+
+# Create a singleton instance
+stream_url_service = StreamURLService()
@@ -0,0 +1,148 @@
+import logging
+import os
+import shutil
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Mapping, Optional, Set
+from fastapi.responses import Response
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.database import SessionLocal
+from db.repositories.video_repository import video_repository
+from models.video import Video
+from services.sample_index_service import sample_index_service
+from utils import ffmpeg
+from utils.mp4 import MP4Error
+from utils.mp4_index import read_video_dimensions
+from utils.trickplay import (
+    SHEET_PATTERN, VTT_FILENAME, build_thumbnail_response, build_thumbnail_vtt, get_trickplay_dir, thumbnail_size
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ThumbnailService:
+    """
+    Generates trickplay sprite sheets and their WebVTT thumbnail track in the background.
+    Generation is idempotent: a video whose track is newer than its file is skipped
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_workers: int):
+        self.session_factory = session_factory
+        self.max_workers = max_workers
+        self._in_progress: Set[int] = set()
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TRICKPLAY_ENABLED and ffmpeg.is_available(settings.FFMPEG_PATH)
+
+    def get_output_dir(self, video_id: int) -> str:
+        """Directory holding the sprite sheets and thumbnail track of a video"""
+        return get_trickplay_dir(video_id)
+
+    def schedule(self, video_id: int) -> bool:
+        """Queue the generation of a video's thumbnails on the worker pool"""
+        if not self.enabled:
+            return False
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="trickplay")
+        self._executor.submit(self.generate, video_id)
+        return True
+
+    def backfill(self) -> int:
+        """Queue every video, the ones with up to date thumbnails are skipped by the job itself"""
+        with self.session_factory() as db:
+            video_ids = [video_id for (video_id,) in db.query(Video.id).order_by(Video.id).all()]
+        return sum(1 for video_id in video_ids if self.schedule(video_id))
+
+    def generate(self, video_id: int) -> bool:
+        """Generate the thumbnails of a video unless they are up to date or already being generated"""
+        with self._lock:
+            if video_id in self._in_progress:
+                return False
+            self._in_progress.add(video_id)
+        try:
+            return self._generate(video_id)
+        finally:
+            with self._lock:
+                self._in_progress.discard(video_id)
+
+    def get_file_response(
+        self,
+        video_id: int,
+        name: str,
+        request_headers: Mapping[str, str],
+        range_header: Optional[str] = None,
+        query: str = ""
+    ) -> Response:
+        """Serve the thumbnail track or a sprite sheet of a video, answering conditional requests with 304"""
+        return build_thumbnail_response(video_id, name, request_headers, range_header, query)
+
+    def _generate(self, video_id: int) -> bool:
+        with self.session_factory() as db:
+            video = video_repository.get(db, id=video_id)
+            if not video:
+                return False
+            filename = video.filename
+        source_path = os.path.join(settings.VIDEOS_DIR, filename)
+        output_dir = self.get_output_dir(video_id)
+        vtt_path = os.path.join(output_dir, VTT_FILENAME)
+
+        try:
+            source_stat = os.stat(source_path)
+        except OSError:
+            return False
+        if os.path.exists(vtt_path) and os.path.getmtime(vtt_path) >= source_stat.st_mtime:
+            return False
+
+        try:
+            dimensions = read_video_dimensions(source_path)
+        except (MP4Error, OSError, struct.error, IndexError):
+            dimensions = None
+        index = sample_index_service.get_index(filename, source_stat.st_size, source_stat.st_mtime)
+        width, height = thumbnail_size(settings.TRICKPLAY_WIDTH, dimensions)
+        image_format = settings.TRICKPLAY_FORMAT
+
+        # Sheets are written next to the live ones and swapped in once complete
+        temp_dir = f"{output_dir}.tmp"
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        os.makedirs(temp_dir)
+        try:
+            ffmpeg.run(ffmpeg.build_sprite_command(
+                settings.FFMPEG_PATH, source_path, os.path.join(temp_dir, f"sprite_%03d.{image_format}"),
+                interval=settings.TRICKPLAY_INTERVAL,
+                width=width,
+                height=height,
+                columns=settings.TRICKPLAY_COLUMNS,
+                rows=settings.TRICKPLAY_ROWS,
+                image_format=image_format,
+            ), timeout=settings.TRANSCODE_TIMEOUT)
+            sheets = sorted(name for name in os.listdir(temp_dir) if SHEET_PATTERN.match(name))
+            if not sheets:
+                raise ffmpeg.FFmpegError("No frames could be sampled")
+            # Without an index the duration is only known up to the last sheet
+            duration = index.duration if index else \
+                len(sheets) * settings.TRICKPLAY_COLUMNS * settings.TRICKPLAY_ROWS * settings.TRICKPLAY_INTERVAL
+            vtt = build_thumbnail_vtt(
+                duration, settings.TRICKPLAY_INTERVAL, width, height,
+                settings.TRICKPLAY_COLUMNS, settings.TRICKPLAY_ROWS,
+                sheet_name=f"thumbnails/sprite_{{:03d}}.{image_format}",
+            )
+            with open(os.path.join(temp_dir, VTT_FILENAME), "w") as f:
+                f.write(vtt)
+        except (ffmpeg.FFmpegError, OSError) as error:
+            logger.warning("Could not generate thumbnails of video %s: %s", video_id, error)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            return False
+
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.replace(temp_dir, output_dir)
+        return True
+
+
+# Create a singleton instance
+thumbnail_service = ThumbnailService(session_factory=SessionLocal, max_workers=settings.TRICKPLAY_WORKERS)
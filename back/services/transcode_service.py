@@ -0,0 +1,383 @@
+import heapq
+import itertools
+import logging
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.database import SessionLocal
+from db.repositories.rendition_repository import rendition_repository
+from db.repositories.video_repository import video_repository
+from models.rendition import (
+    Rendition, AUDIO_RENDITION, RENDITION_FAILED, RENDITION_PENDING, RENDITION_READY
+)
+from models.video import Video
+from schemas.rendition import RenditionSchema
+from services.sample_index_service import sample_index_service
+from services.stream_url_service import stream_url_service
+from utils import ffmpeg
+from utils.mp4 import MP4Error
+from utils.mp4_index import read_track_handlers, read_video_dimensions
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, jobs are only limited per worker
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_UPLOAD = 0
+PRIORITY_BACKFILL = 10
+
+# Outcomes of a transcode job, a skipped job had nothing left to encode, e.g. another worker claimed it
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_SKIPPED = "skipped"
+
+# Seconds between two looks for a free transcode slot of the box
+SLOT_POLL_INTERVAL = 1.0
+# Share added to the expected size of a rendition when reserving its disk space
+RESERVE_MARGIN = 1.2
+# Seconds past TRANSCODE_TIMEOUT after which a processing rendition is presumed abandoned
+STALE_GRACE = 60
+
+
+def default_max_jobs() -> int:
+    """Concurrent ffmpeg jobs that keep every core busy without oversubscribing them"""
+    return max(1, (os.cpu_count() or 1) // max(1, settings.TRANSCODE_THREADS_PER_JOB))
+
+
+class TranscodeService:
+    """
+    Encodes the rendition ladder of videos in the background. Jobs wait in a priority
+    queue and at most max_jobs ffmpeg processes run at once on the box: every worker process
+    dispatches, but a job needs one of max_jobs slot locks shared by the box, and a rendition
+    is claimed in the database so only one worker anywhere encodes it
+    """
+
+    def __init__(self, session_factory: Callable[[], Session], max_jobs: int):
+        self.session_factory = session_factory
+        self.max_jobs = max_jobs
+        self.completed = 0
+        self.failed = 0
+        self.skipped = 0
+        self._queue: List[Tuple[int, int, int]] = []
+        self._sequence = itertools.count()
+        self._running = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Looks for a free slot again while other workers hold every slot of the box
+        self._retry: Optional[threading.Timer] = None
+
+    @property
+    def enabled(self) -> bool:
+        return settings.TRANSCODE_ENABLED and ffmpeg.is_available(settings.FFMPEG_PATH)
+
+    def schedule_video(self, video_id: int, priority: int = PRIORITY_UPLOAD) -> List[int]:
+        """Create the missing renditions of a video and queue their encoding"""
+        if not self.enabled:
+            return []
+
+        with self.session_factory() as db:
+            video = video_repository.get(db, id=video_id)
+            if not video:
+                return []
+            source_path = os.path.join(settings.VIDEOS_DIR, video.filename)
+            existing = {rendition.name for rendition in rendition_repository.get_by_video_id(db, video_id=video_id)}
+            rungs = [rung for rung in self._ladder_for(source_path) if rung["name"] not in existing]
+
+            base_name = os.path.splitext(video.filename)[0]
+            rendition_ids = []
+            for rung in rungs:
+                rendition = Rendition(
+                    video_id=video_id,
+                    name=rung["name"],
+                    filename=f"{base_name}_{rung['name']}.mp4",
+                    height=rung["height"],
+                    video_bitrate=rung["video_bitrate"],
+                    audio_bitrate=rung["audio_bitrate"],
+                    status=RENDITION_PENDING,
+                )
+                db.add(rendition)
+                db.flush()
+                rendition_ids.append(rendition.id)
+            db.commit()
+
+        for rendition_id in rendition_ids:
+            self.enqueue(rendition_id, priority)
+        return rendition_ids
+
+    def backfill(self) -> int:
+        """Queue the missing renditions of every video, after new uploads"""
+        with self.session_factory() as db:
+            video_ids = [video_id for (video_id,) in db.query(Video.id).order_by(Video.id).all()]
+        return sum(len(self.schedule_video(video_id, PRIORITY_BACKFILL)) for video_id in video_ids)
+
+    def enqueue(self, rendition_id: int, priority: int) -> None:
+        """Queue a rendition for encoding"""
+        with self._lock:
+            heapq.heappush(self._queue, (priority, next(self._sequence), rendition_id))
+        self._dispatch()
+
+    def transcode_rendition(self, rendition_id: int) -> str:
+        """Encode a single rendition, recording its outcome. Returns JOB_COMPLETED, JOB_FAILED or JOB_SKIPPED"""
+        with self.session_factory() as db:
+            rendition = rendition_repository.get(db, id=rendition_id)
+            if not rendition or rendition.status not in (RENDITION_PENDING, RENDITION_FAILED):
+                return JOB_SKIPPED
+            video = video_repository.get(db, id=rendition.video_id)
+            if not video:
+                return JOB_SKIPPED
+            source_path = os.path.join(settings.VIDEOS_DIR, video.filename)
+            output_path = os.path.join(settings.RENDITIONS_DIR, rendition.filename)
+            if rendition.name == AUDIO_RENDITION:
+                command = ffmpeg.build_audio_rendition_command(
+                    settings.FFMPEG_PATH, source_path, f"{output_path}.tmp",
+                    audio_bitrate=rendition.audio_bitrate,
+                    codec=settings.TRANSCODE_AUDIO_CODEC,
+                    threads=settings.TRANSCODE_THREADS_PER_JOB,
+                )
+            else:
+                command = ffmpeg.build_rendition_command(
+                    settings.FFMPEG_PATH, source_path, f"{output_path}.tmp",
+                    height=rendition.height,
+                    video_bitrate=rendition.video_bitrate,
+                    audio_bitrate=rendition.audio_bitrate,
+                    keyframe_interval=settings.HLS_SEGMENT_DURATION,
+                    threads=settings.TRANSCODE_THREADS_PER_JOB,
+                    preset=settings.TRANSCODE_PRESET,
+                )
+            filename = rendition.filename
+            # The expected size is held from the budget while encoding, so concurrent jobs can't overrun it
+            if not rendition_repository.claim(
+                db,
+                rendition_id=rendition_id,
+                reserve_bytes=self._reserve_size(rendition, video, source_path),
+                budget_bytes=settings.TRANSCODE_DISK_BUDGET_BYTES,
+            ):
+                db.refresh(rendition)
+                if rendition.status in (RENDITION_PENDING, RENDITION_FAILED):
+                    rendition_repository.update(db, db_obj=rendition, obj_in={
+                        "status": RENDITION_FAILED, "error": "Rendition disk budget exhausted"
+                    })
+                    return JOB_FAILED
+                # Otherwise another worker claimed it first
+                return JOB_SKIPPED
+
+        try:
+            ffmpeg.run(command, timeout=settings.TRANSCODE_TIMEOUT)
+            os.replace(f"{output_path}.tmp", output_path)
+            size = os.path.getsize(output_path)
+            # Renditions are packaged and seeked like any other stored MP4
+            index = sample_index_service.build_index(output_path, filename)
+            width = (read_video_dimensions(output_path) or (None, None))[0]
+            bandwidth = int(size * 8 / index.duration) if index.duration else None
+            with self.session_factory() as db:
+                finished = rendition_repository.finish(
+                    db,
+                    rendition_id=rendition_id,
+                    size_bytes=size,
+                    budget_bytes=settings.TRANSCODE_DISK_BUDGET_BYTES,
+                    obj_in={"width": width, "bandwidth": bandwidth},
+                )
+            if not finished:
+                raise ffmpeg.FFmpegError("Rendition disk budget exhausted")
+        except (ffmpeg.FFmpegError, MP4Error, OSError, struct.error, IndexError) as error:
+            logger.warning("Could not encode rendition %s: %s", rendition_id, error)
+            for path in (f"{output_path}.tmp", output_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            # Gives back its reservation
+            self._update_rendition(rendition_id, {"status": RENDITION_FAILED, "error": str(error)[:1000], "size_bytes": 0})
+            return JOB_FAILED
+        return JOB_COMPLETED
+
+    def reset_stale(self) -> int:
+        """
+        Put the renditions whose job died with its worker, e.g. on a restart, back to pending. A processing
+        rendition is only presumed abandoned past TRANSCODE_TIMEOUT, its job may run on another box.
+        Run once per server start, by the supervisor before it forks the workers
+        """
+        if not self.enabled:
+            return 0
+        started_before = datetime.now() - timedelta(seconds=settings.TRANSCODE_TIMEOUT + STALE_GRACE)
+        try:
+            with self.session_factory() as db:
+                requeued = rendition_repository.requeue_stale(db, started_before=started_before)
+        except SQLAlchemyError:
+            logger.exception("Could not reset abandoned renditions")
+            return 0
+        if requeued:
+            logger.info("Reset %d abandoned renditions", requeued)
+        return requeued
+
+    def queue_pending(self) -> int:
+        """Queue the renditions left pending, e.g. by a worker that is gone"""
+        if not self.enabled:
+            return 0
+        try:
+            with self.session_factory() as db:
+                pending = rendition_repository.get_pending_ids(db)
+        except SQLAlchemyError:
+            logger.exception("Could not queue pending renditions")
+            return 0
+        # Every worker queues them, the claim lets a single one encode each
+        for rendition_id in pending:
+            self.enqueue(rendition_id, PRIORITY_BACKFILL)
+        return len(pending)
+
+    def list_renditions(self, db: Session, video_id: int, client: Optional[str] = None) -> List[Dict[str, Any]]:
+        """List the renditions of a video and their encoding state, the finished ones with their stream URL"""
+        video = video_repository.get(db, id=video_id)
+        if not video:
+            raise HTTPException(status_code=404, detail="Video not found")
+        return [
+            {
+                **RenditionSchema.from_orm(rendition).dict(),
+                "stream_url": stream_url_service.build_rendition_url(video, rendition.name, client)
+                if rendition.status == RENDITION_READY else None,
+            }
+            for rendition in rendition_repository.get_by_video_id(db, video_id=video_id)
+        ]
+
+    def get_ready_renditions(self, video_id: int, session_factory: Callable[[], Session]) -> List[Rendition]:
+        """Get the renditions of a video that can be streamed, with a short-lived session"""
+        with session_factory() as db:
+            return rendition_repository.get_ready_by_video_id(db, video_id=video_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get queue occupancy and job counters"""
+        return {
+            "enabled": self.enabled,
+            "max_jobs": self.max_jobs,
+            "running": self._running,
+            "queued": len(self._queue),
+            "completed": self.completed,
+            "failed": self.failed,
+            "skipped": self.skipped,
+        }
+
+    def _ladder_for(self, source_path: str) -> List[Dict[str, Any]]:
+        """Rungs of the configured ladder that don't upscale the source, and the audio-only rendition"""
+        try:
+            handlers = read_track_handlers(source_path)
+            dimensions = read_video_dimensions(source_path)
+        except (MP4Error, OSError, struct.error, IndexError):
+            # Not an MP4 we can read, let ffmpeg produce the whole ladder
+            handlers, dimensions = None, None
+
+        ladder = settings.TRANSCODE_LADDER
+        if dimensions is not None:
+            # A source smaller than every rung still gets the smallest one
+            ladder = [rung for rung in ladder if rung["height"] <= dimensions[1]] or ladder[-1:]
+        elif handlers is not None:
+            # An audio-only source has no video ladder
+            ladder = []
+        if settings.TRANSCODE_AUDIO_ENABLED and (handlers is None or b"soun" in handlers):
+            ladder = ladder + [{
+                "name": AUDIO_RENDITION,
+                "height": 0,
+                "video_bitrate": 0,
+                "audio_bitrate": settings.TRANSCODE_AUDIO_BITRATE,
+            }]
+        return ladder
+
+    def _reserve_size(self, rendition: Rendition, video: Video, source_path: str) -> int:
+        """Disk space held for a rendition while it encodes: its bitrates over the source duration, or the source size"""
+        if video.duration_seconds:
+            kbits_per_second = (rendition.video_bitrate or 0) + (rendition.audio_bitrate or 0)
+            return int(kbits_per_second * 1000 / 8 * video.duration_seconds * RESERVE_MARGIN)
+        try:
+            return os.path.getsize(source_path)
+        except OSError:
+            return 0
+
+    def _try_acquire_slot(self) -> Optional[int]:
+        """
+        Lock a free one of the max_jobs transcode slots shared by every worker process of the box,
+        without waiting. Returns the locked descriptor, closing it frees the slot, or None when all are taken
+        """
+        for slot in range(self.max_jobs):
+            path = os.path.join(settings.TRANSCODE_LOCK_DIR, f"transcode-slot-{slot}.lock")
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                os.close(fd)
+        return None
+
+    def _dispatch(self) -> None:
+        """Start queued jobs while there are free slots, a job only leaves the queue with its slot"""
+        with self._lock:
+            while self._queue and self._running < self.max_jobs:
+                slot = None
+                if fcntl is not None:
+                    slot = self._try_acquire_slot()
+                    if slot is None:
+                        # Other workers run every job the box allows, their slots free up without telling us
+                        self._schedule_retry()
+                        break
+                _, _, rendition_id = heapq.heappop(self._queue)
+                self._running += 1
+                self._get_executor().submit(self._run, rendition_id, slot)
+
+    def _schedule_retry(self) -> None:
+        # Called with the lock held
+        if self._retry is None:
+            self._retry = threading.Timer(SLOT_POLL_INTERVAL, self._retry_dispatch)
+            self._retry.daemon = True
+            self._retry.start()
+
+    def _retry_dispatch(self) -> None:
+        with self._lock:
+            self._retry = None
+        self._dispatch()
+
+    def _run(self, rendition_id: int, slot: Optional[int]) -> None:
+        try:
+            outcome = self.transcode_rendition(rendition_id)
+        except Exception:
+            logger.exception("Transcoding rendition %s crashed", rendition_id)
+            outcome = JOB_FAILED
+        finally:
+            if slot is not None:
+                os.close(slot)
+        with self._lock:
+            self._running -= 1
+            if outcome == JOB_COMPLETED:
+                self.completed += 1
+            elif outcome == JOB_SKIPPED:
+                self.skipped += 1
+            else:
+                self.failed += 1
+        self._dispatch()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        # Each job is an ffmpeg process, threads only wait on them
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_jobs, thread_name_prefix="transcode")
+        return self._executor
+
+    def _update_rendition(self, rendition_id: int, obj_in: dict) -> None:
+        """Update a rendition with a short-lived session"""
+        with self.session_factory() as db:
+            rendition = rendition_repository.get(db, id=rendition_id)
+            if rendition:
+                rendition_repository.update(db, db_obj=rendition, obj_in=obj_in)
+
+
+# Create a singleton instance
+transcode_service = TranscodeService(
+    session_factory=SessionLocal,
+    max_jobs=settings.TRANSCODE_MAX_JOBS or default_max_jobs(),
+)
@@ -0,0 +1,78 @@
+import os
+from typing import Callable
+from fastapi import HTTPException
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from db.repositories.rendition_repository import rendition_repository
+from db.repositories.video_repository import video_repository
+from models.rendition import Rendition, AUDIO_RENDITION, RENDITION_READY
+from models.video import Video
+from utils.video_files import DEFAULT_CONTENT_TYPE, VideoFile, VideoFileCache
+
+AUDIO_CONTENT_TYPE = "audio/mp4"
+
+
+class VideoFileResolver(VideoFileCache):
+    """Cache of resolved files that also maps video IDs (and video ID, rendition name pairs) to their files"""
+
+    async def resolve(self, video_id: int, session_factory: Callable[[], Session]) -> VideoFile:
+        """Get the file of a video, only touching the database and disk on a cache miss"""
+        return await self._resolve(video_id, self._load, video_id, session_factory)
+
+    async def resolve_rendition(self, video_id: int, name: str, session_factory: Callable[[], Session]) -> VideoFile:
+        """Get the file of a finished rendition of a video"""
+        return await self._resolve((video_id, name), self._load_rendition, video_id, name, session_factory)
+
+    def _load(self, video_id: int, session_factory: Callable[[], Session]) -> VideoFile:
+        """Load video metadata with a short-lived session and stat its file"""
+        with session_factory() as db:
+            video = video_repository.get(db, id=video_id)
+            if not video:
+                raise HTTPException(status_code=404, detail="Video not found")
+            filename = video.filename
+            content_type = video.content_type or DEFAULT_CONTENT_TYPE
+            bitrate = video.bitrate
+
+        path = os.path.join(settings.VIDEOS_DIR, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="Video file not found")
+
+        return VideoFile(video_id, filename, path, stat.st_size, stat.st_mtime, content_type, bitrate)
+
+    def _load_rendition(self, video_id: int, name: str, session_factory: Callable[[], Session]) -> VideoFile:
+        """Load rendition metadata with a short-lived session and stat its file"""
+        with session_factory() as db:
+            rendition = rendition_repository.get_by_video_id_and_name(db, video_id=video_id, name=name)
+            if not rendition or rendition.status != RENDITION_READY:
+                raise HTTPException(status_code=404, detail="Rendition not found")
+            filename = rendition.filename
+            bitrate = rendition.bandwidth
+
+        path = os.path.join(settings.RENDITIONS_DIR, filename)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="Rendition file not found")
+
+        content_type = AUDIO_CONTENT_TYPE if name == AUDIO_RENDITION else DEFAULT_CONTENT_TYPE
+        return VideoFile(video_id, filename, path, stat.st_size, stat.st_mtime, content_type, bitrate)
+
+
+# Create a singleton instance
+video_file_resolver = VideoFileResolver(max_entries=settings.STREAM_RESOLVER_MAX_ENTRIES)
+
+
+@event.listens_for(Video, "after_update")
+@event.listens_for(Video, "after_delete")
+def _invalidate_video_file(mapper, connection, target: Video) -> None:
+    video_file_resolver.invalidate(target.id)
+
+
+@event.listens_for(Rendition, "after_update")
+@event.listens_for(Rendition, "after_delete")
+def _invalidate_rendition_file(mapper, connection, target: Rendition) -> None:
+    video_file_resolver.invalidate((target.video_id, target.name))
@@ -1,8 +1,8 @@
 import os
 import shutil
+import struct
 from datetime import datetime
 from typing import List, Optional, Dict, Any
-import requests
 from fastapi import UploadFile, HTTPException
 from sqlalchemy.orm import Session
 
@@ -11,30 +11,37 @@ from db.repositories.video_repository import video_repository
 from db.repositories.category_repository import category_repository
 from db.repositories.subtitle_repository import subtitle_repository
 from models.video import Video
+from schemas.subtitle import SubtitleCreate
 from schemas.video import VideoCreate, VideoUpdate, VideoSchema
+from services.omdb_client import OMDBError, OMDBUnavailable, omdb_client
+from services.stream_url_service import stream_url_service
+from utils.async_io import run_io
+from utils.mp4 import MP4Error, normalize_faststart
+from utils.probe import MediaInfo, ProbeError, probe_file
 
 class VideoService:
     """Service for video operations"""
     
-    def get_video(self, db: Session, video_id: int) -> VideoSchema:
-        """Get video details by ID"""
+    def get_video(self, db: Session, video_id: int, client: Optional[str] = None) -> VideoSchema:
+        """Get video details by ID, with a stream URL for the given client"""
         video = video_repository.get_with_categories(db, video_id=video_id)
         if not video:
             raise HTTPException(status_code=404, detail="Video not found")
         
-        return self._map_video_to_schema(video)
+        return self._map_video_to_schema(video, client)
     
-    def list_videos(self, db: Session, skip: int = 0, limit: int = 100) -> List[VideoSchema]:
+    def list_videos(self, db: Session, skip: int = 0, limit: int = 100, client: Optional[str] = None) -> List[VideoSchema]:
         """List all available videos with pagination"""
         videos = video_repository.get_multi(db, skip=skip, limit=limit)
-        return [self._map_video_to_schema(video) for video in videos]
+        return [self._map_video_to_schema(video, client) for video in videos]
     
     async def upload_video(
         self,
         db: Session,
         imdb_id: str,
         file: UploadFile,
-        subtitle: Optional[UploadFile] = None
+        subtitle: Optional[UploadFile] = None,
+        client: Optional[str] = None
     ) -> VideoSchema:
         """Upload a new video file with metadata from OMDB API"""
         # Validate file type
@@ -54,16 +61,21 @@ class VideoService:
             )
 
         # Get metadata from OMDB API
-        video_metadata = self._get_omdb_metadata(imdb_id)
+        video_metadata = await self._get_omdb_metadata(imdb_id)
         
         # Create unique filename
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
         filename = f"{timestamp}_{file.filename}"
         file_path = os.path.join(settings.VIDEOS_DIR, filename)
 
-        # Save video file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        # Save video file, on the I/O pool so streams keep flowing during a large upload
+        await run_io(self._save_file, file, file_path)
+
+        # Rewritten before the stream URL is signed, the grant pins the size and mtime of the final file
+        faststart = await run_io(self._normalize_upload, file_path)
+
+        # The container headers tell what the file really is, the client's content type is only a hint
+        media_info = await run_io(self._probe_upload, file_path)
 
         # Prepare video data
         video_data = {
@@ -74,7 +86,9 @@ class VideoService:
             "description": video_metadata["description"],
             "imdb_id": imdb_id,
             "filename": filename,
-            "content_type": content_type
+            "content_type": media_info.content_type,
+            **media_info.to_dict(),
+            "is_faststart": faststart,
         }
 
         # Get or create categories
@@ -91,7 +105,7 @@ class VideoService:
         if subtitle:
             await self._save_subtitle(db, db_video.id, subtitle)
 
-        return self._map_video_to_schema(db_video)
+        return self._map_video_to_schema(db_video, client)
     
     def get_video_file_path(self, db: Session, video_id: int) -> str:
         """Get the file path for a video"""
@@ -105,18 +119,44 @@ class VideoService:
         
         return file_path
     
-    def _get_omdb_metadata(self, imdb_id: str) -> Dict[str, Any]:
+    def _save_file(self, upload: UploadFile, file_path: str) -> None:
+        """Copy an uploaded file to file_path, blocking"""
+        with open(file_path, "wb") as buffer:
+            shutil.copyfileobj(upload.file, buffer)
+
+    def _normalize_upload(self, file_path: str) -> bool:
+        """Make an uploaded MP4 faststart, other containers and unreadable files are left to the probe"""
+        try:
+            normalize_faststart(file_path)
+        except (MP4Error, OSError, struct.error, IndexError):
+            return False
+        return True
+
+    def _probe_upload(self, file_path: str) -> MediaInfo:
+        """Probe an uploaded file, deleting it and rejecting the upload if browsers can't play it"""
+        try:
+            media_info = probe_file(file_path, settings.PROBE_MAX_HEADER_BYTES)
+            if not media_info.is_playable:
+                raise ProbeError(
+                    f"Unsupported codecs: {media_info.video_codec or 'no video'}, {media_info.audio_codec or 'no audio'}"
+                )
+        except (ProbeError, OSError) as error:
+            os.remove(file_path)
+            raise HTTPException(status_code=400, detail=f"Invalid video file. {error}")
+        return media_info
+    
+    async def _get_omdb_metadata(self, imdb_id: str) -> Dict[str, Any]:
         """Get video metadata from OMDB API"""
-        response = requests.get(
-            f"https://www.omdbapi.com/?i={imdb_id}&apikey={settings.OMDB_API_KEY}"
-        )
-        
-        if response.status_code != 200:
-            raise HTTPException(status_code=400, detail="Failed to fetch metadata from OMDB API")
-        
-        data = response.json()
-        if data.get("Error"):
-            raise HTTPException(status_code=400, detail=data.get("Error"))
+        try:
+            data = await omdb_client.get_movie(imdb_id)
+        except OMDBError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        except OMDBUnavailable as error:
+            raise HTTPException(
+                status_code=503,
+                detail="Failed to fetch metadata from OMDB API",
+                headers={"Retry-After": str(max(int(error.retry_after), 1))},
+            )
         
         # Extract and format metadata
         categories = data.get("Genre", "").split(",")
@@ -135,8 +175,7 @@ class VideoService:
         """Save a subtitle file and create a database entry"""
         subtitle_path = os.path.join(settings.SUBTITLES_DIR, subtitle_file.filename)
         
-        with open(subtitle_path, "wb") as buffer:
-            shutil.copyfileobj(subtitle_file.file, buffer)
+        await run_io(self._save_file, subtitle_file, subtitle_path)
         
         # Create subtitle in database
         subtitle_data = {
@@ -147,7 +186,7 @@ class VideoService:
         
         subtitle_repository.create(db, obj_in=SubtitleCreate(**subtitle_data))
     
-    def _map_video_to_schema(self, video: Video) -> VideoSchema:
+    def _map_video_to_schema(self, video: Video, client: Optional[str] = None) -> VideoSchema:
         """Map a Video model to a VideoSchema"""
         return {
             "id": video.id,
@@ -156,12 +195,22 @@ class VideoService:
             "categories": [category.name for category in video.categories],
             "imdb_id": video.imdb_id,
             "filename": video.filename,
-            "stream_url": f"/videos/stream/{video.id}",
+            "stream_url": stream_url_service.build_stream_url(video, client),
+            "hls_url": stream_url_service.build_hls_url(video, client),
             "year": video.year,
             "duration": video.duration,
             "thumbnail": video.thumbnail,
             "description": video.description,
-            "subtitles_urls": [f"/subtitles/content/{s.id}" for s in video.subtitles] if video.subtitles else [],
+            "subtitles_urls": [
+                stream_url_service.build_subtitle_url(s, client) for s in video.subtitles
+            ] if video.subtitles else [],
+            "container": video.container,
+            "duration_seconds": video.duration_seconds,
+            "bitrate": video.bitrate,
+            "width": video.width,
+            "height": video.height,
+            "video_codec": video.video_codec,
+            "audio_codec": video.audio_codec,
         }
 
 # Create a singleton instance
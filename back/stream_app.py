@@ -0,0 +1,158 @@
+"""
+Stream node: serves signed stream, subtitle and thumbnail URLs straight from the uploads
+directory. It never imports the ORM or opens a database connection, so it can be scaled out
+independently of the metadata API (main.py), which hands out the signed URLs
+"""
+from fastapi import APIRouter, Depends, FastAPI, Query, Request, Response
+from fastapi.middleware.cors import CORSMiddleware
+
+from core.config import settings
+from utils.admin_auth import require_admin
+from utils.admission import AdmissionMiddleware, admission
+from utils.rate_limit import RateLimitMiddleware, get_rate_limiter
+from utils.chunk_cache import chunk_cache
+from utils.single_flight import chunk_reads
+from utils.pacing import pacing_stats
+from utils.stream_registry import stream_registry
+from utils.streaming import authorize_video, build_video_response, signed_query, verify_stream_url
+from utils.subtitles import build_signed_subtitle_response
+from utils.trickplay import VTT_FILENAME, build_thumbnail_response
+from utils.video_files import VideoFileCache
+
+# Files of signed URLs, keyed by path and version so a replaced file is never served stale
+video_files = VideoFileCache(max_entries=settings.STREAM_RESOLVER_MAX_ENTRIES)
+
+router = APIRouter()
+
+
+@router.get("/videos/stream/{video_id}")
+@router.head("/videos/stream/{video_id}")
+async def stream_video(
+    video_id: int,
+    request: Request,
+    token: str = Query(..., description="Token of a signed stream URL"),
+):
+    """
+    Stream the video file a signed URL grants access to, with range and conditional requests
+    """
+    video_file = await video_files.resolve_signed(verify_stream_url(token, request, video_id))
+    return build_video_response(request, video_file)
+
+
+@router.get("/subtitles/content/{subtitle_id}")
+def get_subtitle_content(
+    subtitle_id: int,
+    request: Request,
+    token: str = Query(..., description="Token of a signed subtitle URL"),
+):
+    """
+    Get the subtitle file a signed URL grants access to
+    """
+    grant = verify_stream_url(token, request, video_id=None, subtitle_id=subtitle_id)
+    return build_signed_subtitle_response(grant, request.headers)
+
+
+@router.get("/videos/{video_id}/thumbnails.vtt", dependencies=[Depends(authorize_video)])
+def get_thumbnail_track(video_id: int, request: Request):
+    """
+    Get the WebVTT thumbnail track of a video
+    """
+    return build_thumbnail_response(video_id, VTT_FILENAME, request.headers, query=signed_query(request))
+
+
+@router.get("/videos/{video_id}/thumbnails/{sheet_name}", dependencies=[Depends(authorize_video)])
+def get_thumbnail_sheet(video_id: int, sheet_name: str, request: Request):
+    """
+    Get a trickplay sprite sheet of a video
+    """
+    return build_thumbnail_response(
+        video_id, sheet_name, request.headers, range_header=request.headers.get("range"))
+
+
+@router.get("/admin/stats", dependencies=[Depends(require_admin)])
+def get_stats():
+    """
+    Get the cache, pacing and stream counters of this node
+    """
+    return {
+        "video_files": video_files.stats(),
+        "chunk_cache": chunk_cache.stats(),
+        "chunk_reads": chunk_reads.stats(),
+        "pacing": pacing_stats.stats(),
+        "streams": stream_registry.stats(),
+        "admission": admission.load(),
+        "rate_limit": get_rate_limiter().stats(),
+    }
+
+
+@router.get("/admin/streams", dependencies=[Depends(require_admin)])
+def get_active_streams():
+    """
+    List the streams this node is sending
+    """
+    return {**stream_registry.stats(), "streams": stream_registry.list()}
+
+
+@router.post("/admin/drain", dependencies=[Depends(require_admin)])
+def start_drain():
+    """
+    Stop taking new streams and hand off the active ones before STREAM_DRAIN_TIMEOUT
+    """
+    stream_registry.drain(settings.STREAM_DRAIN_TIMEOUT, settings.STREAM_DRAIN_SPREAD)
+    return stream_registry.stats()
+
+
+@router.delete("/admin/drain", dependencies=[Depends(require_admin)])
+def stop_drain():
+    """
+    Take new streams again
+    """
+    stream_registry.resume()
+    return stream_registry.stats()
+
+
+# Create application in FastAPI
+app = FastAPI(
+    title=f"{settings.PROJECT_NAME} stream node",
+    description="Serves signed stream URLs without database access",
+    version="0.1.0",
+    openapi_url=f"{settings.API_V1_STR}/openapi.json"
+)
+
+# Shed requests past the concurrency limits, inside CORS so rejections carry its headers
+app.add_middleware(AdmissionMiddleware, controller=admission)
+
+# Per-client limits apply before a client takes an admission slot
+app.add_middleware(RateLimitMiddleware)
+
+# Configure CORS
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=settings.CORS_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
+app.include_router(router, prefix=settings.API_V1_STR)
+
+
+# Health check endpoint to verify that the node is working
+@app.get("/health")
+def health_check(response: Response):
+    if stream_registry.draining:
+        # Load balancers stop sending requests to a draining node
+        response.status_code = 503
+        return {"status": "draining", "message": "Stream node is draining its streams"}
+    return {"status": "healthy", "message": "Stream node is running"}
+
+
+# Occupancy of this node per route class, for load balancers to prefer the least loaded nodes
+@app.get("/load")
+def load_report():
+    return admission.load()
+
+
+if __name__ == "__main__":
+    import server
+    server.run("stream_app:app", port=8001)
@@ -0,0 +1,105 @@
+import struct
+
+# Layout of the synthetic movie built by build_mp4
+VIDEO_TIMESCALE = 1000
+VIDEO_SAMPLE_DURATION = 100
+VIDEO_SAMPLE_SIZES = [500, 120, 130, 110, 140, 480, 100, 150, 120, 130]
+VIDEO_KEYFRAMES = [1, 6]  # 1-based sample numbers
+AUDIO_TIMESCALE = 48000
+AUDIO_SAMPLE_DURATION = 1024
+AUDIO_SAMPLE_SIZES = [64] * 20
+
+
+def box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return box(box_type, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+def _track(track_id, handler, timescale, durations, sizes, chunk_offsets, samples_per_chunk, sample_entry, keyframes=None):
+    duration = sum(durations)
+    is_video = handler == b"vide"
+    tkhd = full_box(b"tkhd", 0, 3, struct.pack(
+        ">IIIII8xhhhH", 0, 0, track_id, 0, duration * 1000 // timescale, 0, 0, 0x100 if not is_video else 0, 0
+    ) + MATRIX + struct.pack(">II", (640 << 16) if is_video else 0, (360 << 16) if is_video else 0))
+    mdhd = full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, timescale, duration, 0x55C4, 0))
+    hdlr = full_box(b"hdlr", 0, 0, struct.pack(">I4s12x", 0, handler) + b"handler\x00")
+    media_header = full_box(b"vmhd", 0, 1, b"\x00" * 8) if is_video else full_box(b"smhd", 0, 0, b"\x00" * 4)
+    dinf = box(b"dinf", full_box(b"dref", 0, 0, struct.pack(">I", 1) + full_box(b"url ", 0, 1, b"")))
+
+    stts_entries = []
+    for value in durations:
+        if stts_entries and stts_entries[-1][1] == value:
+            stts_entries[-1][0] += 1
+        else:
+            stts_entries.append([1, value])
+    stbl_children = [
+        full_box(b"stsd", 0, 0, struct.pack(">I", 1) + sample_entry),
+        full_box(b"stts", 0, 0, struct.pack(">I", len(stts_entries)) + b"".join(struct.pack(">II", *e) for e in stts_entries)),
+        full_box(b"stsc", 0, 0, struct.pack(">IIII", 1, 1, samples_per_chunk, 1)),
+        full_box(b"stsz", 0, 0, struct.pack(">II", 0, len(sizes)) + b"".join(struct.pack(">I", s) for s in sizes)),
+        full_box(b"stco", 0, 0, struct.pack(">I", len(chunk_offsets)) + b"".join(struct.pack(">I", o) for o in chunk_offsets)),
+    ]
+    if keyframes is not None:
+        stbl_children.append(full_box(b"stss", 0, 0, struct.pack(">I", len(keyframes)) + b"".join(struct.pack(">I", k) for k in keyframes)))
+    minf = box(b"minf", media_header + dinf + box(b"stbl", b"".join(stbl_children)))
+    return box(b"trak", tkhd + box(b"mdia", mdhd + hdlr + minf))
+
+
+def _video_sample_entry():
+    avcc = box(b"avcC", bytes([1, 0x64, 0, 0x1F, 0xFF, 0xE1]) + struct.pack(">H", 4) + b"\x67\x64\x00\x1f"
+               + bytes([1]) + struct.pack(">H", 4) + b"\x68\xee\x3c\x80")
+    return box(b"avc1", b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 16 + struct.pack(
+        ">HHIIIH32sHh", 640, 360, 0x480000, 0x480000, 0, 1, b"", 24, -1) + avcc)
+
+
+def _audio_sample_entry():
+    esds = full_box(b"esds", 0, 0, bytes([0x03, 0x19, 0x00, 0x02, 0x00, 0x04, 0x11, 0x40, 0x15]) + b"\x00" * 11
+                    + bytes([0x05, 0x02, 0x11, 0x90, 0x06, 0x01, 0x02]))
+    return box(b"mp4a", b"\x00" * 6 + struct.pack(">H", 1) + b"\x00" * 8 + struct.pack(">HHHHI", 2, 16, 0, 0, AUDIO_TIMESCALE << 16) + esds)
+
+
+def sample_data(track: str, index: int, size: int) -> bytes:
+    """Recognizable payload of a sample"""
+    marker = (b"V" if track == "video" else b"A") + bytes([index])
+    return (marker * (size // 2 + 1))[:size]
+
+
+def build_mp4(moov_first: bool = True, moov_between_tracks: bool = False) -> bytes:
+    """
+    Build a small but complete MP4 with one H.264 video track and one AAC audio track.
+    With moov_between_tracks each track has its own mdat and the moov sits between them
+    """
+    ftyp = box(b"ftyp", b"isom" + struct.pack(">I", 512) + b"isomiso2avc1mp41")
+    video = b"".join(sample_data("video", i, s) for i, s in enumerate(VIDEO_SAMPLE_SIZES))
+    audio = b"".join(sample_data("audio", i, s) for i, s in enumerate(AUDIO_SAMPLE_SIZES))
+
+    def moov_for(mdat_payload_offset, audio_offset=None):
+        if audio_offset is None:
+            audio_offset = mdat_payload_offset + len(video)
+        video_chunks = [mdat_payload_offset, mdat_payload_offset + sum(VIDEO_SAMPLE_SIZES[:5])]
+        audio_chunks = [audio_offset, audio_offset + sum(AUDIO_SAMPLE_SIZES[:10])]
+        video_duration = VIDEO_SAMPLE_DURATION * len(VIDEO_SAMPLE_SIZES)
+        mvhd = full_box(b"mvhd", 0, 0, struct.pack(">IIIIIH10x", 0, 0, 1000, video_duration, 0x10000, 0x100)
+                        + MATRIX + b"\x00" * 24 + struct.pack(">I", 3))
+        return box(b"moov", mvhd
+                   + _track(1, b"vide", VIDEO_TIMESCALE, [VIDEO_SAMPLE_DURATION] * len(VIDEO_SAMPLE_SIZES),
+                            VIDEO_SAMPLE_SIZES, video_chunks, 5, _video_sample_entry(), VIDEO_KEYFRAMES)
+                   + _track(2, b"soun", AUDIO_TIMESCALE, [AUDIO_SAMPLE_DURATION] * len(AUDIO_SAMPLE_SIZES),
+                            AUDIO_SAMPLE_SIZES, audio_chunks, 10, _audio_sample_entry()))
+
+    if moov_between_tracks:
+        moov_size = len(moov_for(0))
+        video_offset = len(ftyp) + 8
+        audio_offset = video_offset + len(video) + moov_size + 8
+        return ftyp + box(b"mdat", video) + moov_for(video_offset, audio_offset) + box(b"mdat", audio)
+    mdat = box(b"mdat", video + audio)
+    if moov_first:
+        moov_size = len(moov_for(0))
+        return ftyp + moov_for(len(ftyp) + moov_size + 8) + mdat
+    return ftyp + mdat + moov_for(len(ftyp) + 8)
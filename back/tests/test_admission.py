@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from utils.admission import AdmissionController, AdmissionGate, AdmissionMiddleware, AdmissionRejected, route_class
+
+
+def test_gate_queues_then_rejects():
+    async def run():
+        gate = AdmissionGate("stream", limit=1, queue_depth=1, queue_timeout=5)
+        await gate.acquire()
+
+        queued = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        assert gate.stats()["queued"] == 1
+
+        # Limit and queue are full, the next request is shed at once
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+
+        # The released slot goes straight to the queued request
+        gate.release()
+        await queued
+        assert gate.active == 1
+        gate.release()
+        return gate.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["admitted"] == 2
+    assert stats["rejected"] == 1
+
+
+def test_gate_sheds_requests_that_wait_too_long():
+    async def run():
+        gate = AdmissionGate("upload", limit=1, queue_depth=4, queue_timeout=0.01)
+        await gate.acquire()
+        with pytest.raises(AdmissionRejected):
+            await gate.acquire()
+        return gate.stats()
+
+    stats = asyncio.run(run())
+    assert stats["timed_out"] == 1
+    assert stats["queued"] == 0
+    assert stats["active"] == 1
+
+
+def test_requests_are_classified_by_route(monkeypatch):
+    monkeypatch.setattr("core.config.settings.ADMISSION_CATALOG_LIMIT", 0)
+    controller = AdmissionController()
+
+    assert route_class("GET", "/api/videos/stream/1") == "stream"
+    assert route_class("GET", "/api/videos/hls/1/index.m3u8") == "stream"
+    assert route_class("POST", "/api/videos/upload") == "upload"
+    assert route_class("GET", "/api/videos/") == "catalog"
+    assert route_class("GET", "/api/admin/stats") == "catalog"
+    assert route_class("GET", "/health") is None
+    # A class without a limit is not gated
+    assert set(controller.gates) == {"stream", "upload"}
+
+
+def test_middleware_answers_503_with_retry_after(monkeypatch):
+    monkeypatch.setattr("core.config.settings.ADMISSION_CATALOG_LIMIT", 1)
+    monkeypatch.setattr("core.config.settings.ADMISSION_CATALOG_QUEUE", 0)
+    monkeypatch.setattr("core.config.settings.ADMISSION_RETRY_AFTER", 3)
+    controller = AdmissionController()
+    app = FastAPI()
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+
+    @app.get("/api/videos/")
+    def list_videos():
+        return []
+
+    client = TestClient(app)
+    assert client.get("/api/videos/").status_code == 200
+
+    # Hold the only slot, like a request still being served
+    asyncio.run(controller.gates["catalog"].acquire())
+    response = client.get("/api/videos/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "3"
+    assert controller.load()["load"] == 1.0
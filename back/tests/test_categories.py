@@ -92,6 +92,13 @@ def test_categories_in_video_response(client, test_db, monkeypatch):
         video.duration = 120
         video.thumbnail = "thumbnail.jpg"
         video.description = "A test movie description"
+        video.container = None
+        video.duration_seconds = None
+        video.bitrate = None
+        video.width = None
+        video.height = None
+        video.video_codec = None
+        video.audio_codec = None
         
         # Create mock categories
         category1 = MagicMock()
@@ -143,6 +150,13 @@ def test_categories_in_video_list(client, test_db, monkeypatch):
         video1.duration = 120
         video1.thumbnail = "thumbnail1.jpg"
         video1.description = "A test movie description"
+        video1.container = None
+        video1.duration_seconds = None
+        video1.bitrate = None
+        video1.width = None
+        video1.height = None
+        video1.video_codec = None
+        video1.audio_codec = None
         
         # Create mock categories for video1
         category1 = MagicMock()
@@ -168,6 +182,13 @@ def test_categories_in_video_list(client, test_db, monkeypatch):
         video2.duration = 110
         video2.thumbnail = "thumbnail2.jpg"
         video2.description = "Another test movie description"
+        video2.container = None
+        video2.duration_seconds = None
+        video2.bitrate = None
+        video2.width = None
+        video2.height = None
+        video2.video_codec = None
+        video2.audio_codec = None
         
         # Create mock categories for video2
         category3 = MagicMock()
@@ -0,0 +1,475 @@
+import asyncio
+import os
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from utils.chunk_cache import ChunkCache
+from utils.pacing import Pacer, PacingStats, create_pacer
+from utils.single_flight import SingleFlight
+from utils.stream_registry import ActiveStream, StreamRegistry
+from utils.file_handlers import (
+    FileRangeResponse,
+    RangeNotSatisfiable,
+    SharedFile,
+    ZERO_COPY_SEND_EXTENSION,
+    build_file_response,
+    file_sender,
+    parse_range_header,
+    ranged_file_sender,
+)
+
+
+@pytest.fixture(scope="function")
+def video_file(tmp_path):
+    # Create a small test video file with predictable content
+    path = tmp_path / "video.mp4"
+    path.write_bytes(bytes(range(256)) * 40)
+    return str(path)
+
+
+def run_response(response, scope):
+    # Drive an ASGI response by hand and collect the messages it sends
+    messages = []
+
+    received = []
+
+    async def receive():
+        # Like a server, hand over the request body once then wait for a disconnect
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(response(scope, receive, send))
+    return messages
+
+
+def test_file_range_response_uses_zero_copy_send(video_file):
+    response = FileRangeResponse(video_file, 100, 199, status_code=206, media_type="video/mp4")
+    scope = {"type": "http", "method": "GET", "extensions": {ZERO_COPY_SEND_EXTENSION: {}}}
+
+    messages = run_response(response, scope)
+
+    assert messages[0]["status"] == 206
+    assert messages[1]["type"] == ZERO_COPY_SEND_EXTENSION
+    assert messages[1]["offset"] == 100
+    assert messages[1]["count"] == 100
+    assert len(messages) == 2
+
+
+def test_file_range_response_falls_back_to_chunked_reads(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    response = FileRangeResponse(video_file, 500, 3499, status_code=206, media_type="video/mp4")
+    scope = {"type": "http", "method": "GET"}
+
+    messages = run_response(response, scope)
+
+    chunks = [m["body"] for m in messages[1:] if m["body"]]
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    with open(video_file, "rb") as f:
+        assert b"".join(chunks) == f.read()[500:3500]
+    assert messages[-1]["more_body"] is False
+
+
+def test_pacer_holds_back_output_after_the_burst(monkeypatch):
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr("utils.pacing.time.monotonic", lambda: 100.0)
+    monkeypatch.setattr("utils.pacing.asyncio.sleep", fake_sleep)
+    stats = PacingStats()
+    pacer = Pacer(rate=1000, burst_bytes=2000, stats=stats)
+
+    async def send_chunks():
+        for _ in range(4):
+            await pacer.pace(1000)
+
+    asyncio.run(send_chunks())
+    pacer.close()
+
+    # The clock is frozen, so every byte past the burst waits at the paced rate
+    assert delays == [1.0, 2.0]
+    assert stats.stats()["bytes_sent"] == 4000
+    assert stats.stats()["throttled"] == 2
+    assert stats.stats()["active"] == 0
+
+
+def test_create_pacer_scales_with_bitrate(monkeypatch):
+    assert create_pacer(8_000_000) is None
+
+    monkeypatch.setattr("core.config.settings.STREAM_PACING_ENABLED", True)
+    monkeypatch.setattr("core.config.settings.STREAM_PACING_BURST_SECONDS", 10.0)
+    monkeypatch.setattr("core.config.settings.STREAM_PACING_RATE_MULTIPLIER", 2.0)
+    pacer = create_pacer(8_000_000)
+
+    assert pacer.rate == 2_000_000
+    assert pacer.burst_bytes == 10_000_000
+    # Files that were never probed are not paced
+    assert create_pacer(None) is None
+
+
+def test_paced_zero_copy_send_is_split_into_chunks(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    pacer = Pacer(rate=10 ** 9, burst_bytes=10 ** 9, stats=PacingStats())
+    response = FileRangeResponse(video_file, 500, 2999, status_code=206, media_type="video/mp4", pacer=pacer)
+    scope = {"type": "http", "method": "GET", "extensions": {ZERO_COPY_SEND_EXTENSION: {}}}
+
+    messages = run_response(response, scope)
+
+    assert [(m["offset"], m["count"], m["more_body"]) for m in messages[1:]] == [
+        (500, 1000, True), (1500, 1000, True), (2500, 500, False)
+    ]
+    assert pacer.sent == 2500
+
+
+def test_file_range_response_stops_when_the_client_disconnects(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    registry = StreamRegistry()
+    monkeypatch.setattr("utils.file_handlers.stream_registry", registry)
+    stream = ActiveStream(1, "127.0.0.1:5000")
+    response = FileRangeResponse(video_file, 0, os.path.getsize(video_file) - 1, media_type="video/mp4", stream=stream)
+    bodies = []
+
+    async def run():
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] != "http.response.body":
+                return
+            bodies.append(message["body"])
+            if len(bodies) == 2:
+                # The viewer goes away while the second chunk is stuck in the socket
+                disconnected.set()
+                await asyncio.sleep(10)
+
+        await asyncio.wait_for(response({"type": "http", "method": "GET"}, receive, send), timeout=5)
+
+    asyncio.run(run())
+
+    assert len(bodies) == 2
+    assert stream.bytes_sent == 1000
+    assert registry.stats() == {
+        "active": 0,
+        "completed": 0,
+        "aborted": 1,
+        "aborted_bytes_sent": 1000,
+        "aborted_bytes_unsent": os.path.getsize(video_file) - 1000,
+        "handed_off": 0,
+        "draining": False,
+        "drain_remaining": None,
+    }
+
+
+def test_draining_hands_off_streams_at_a_chunk_boundary(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    registry = StreamRegistry()
+    monkeypatch.setattr("utils.file_handlers.stream_registry", registry)
+    stream = ActiveStream(1, "127.0.0.1:5000")
+    response = FileRangeResponse(video_file, 0, os.path.getsize(video_file) - 1, media_type="video/mp4", stream=stream)
+    bodies = []
+
+    async def run():
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                bodies.append(message["body"])
+                if len(bodies) == 2:
+                    # The worker starts draining while the stream is running, with no time left
+                    registry.drain(timeout=0, spread=0)
+
+        await asyncio.wait_for(response({"type": "http", "method": "GET"}, receive, send), timeout=5)
+
+    asyncio.run(run())
+
+    # The body ends short right after the chunk in flight, the player resumes it with a range request
+    assert len(bodies) == 2
+    assert registry.stats()["handed_off"] == 1
+    assert registry.stats()["aborted"] == 0
+    assert registry.draining
+
+
+def test_drain_spreads_handoffs_and_can_be_resumed():
+    registry = StreamRegistry()
+    streams = [ActiveStream(i, None) for i in range(20)]
+    for stream in streams:
+        registry.open(stream, 100)
+    registry.drain(timeout=30, spread=10)
+
+    handoffs = [stream.handoff_at - registry.draining_since for stream in streams]
+    assert all(20 <= handoff <= 30 for handoff in handoffs)
+    assert len(set(handoffs)) > 1
+    assert 0 < registry.stats()["drain_remaining"] <= 30
+
+    late = ActiveStream(99, None)
+    registry.open(late, 100)
+    assert late.handoff_at is not None
+
+    registry.resume()
+    assert not registry.draining
+    assert all(stream.handoff_at is None for stream in streams + [late])
+
+
+def test_stream_registry_lists_active_streams(video_file, monkeypatch):
+    registry = StreamRegistry()
+    monkeypatch.setattr("utils.file_handlers.stream_registry", registry)
+    stream = ActiveStream(7, "127.0.0.1:5000", rendition="720p")
+    response = FileRangeResponse(video_file, 0, 99, status_code=206, media_type="video/mp4", stream=stream)
+    seen = []
+
+    async def run():
+        async def receive():
+            await asyncio.Event().wait()
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                seen.append(registry.list())
+
+        await response({"type": "http", "method": "GET"}, receive, send)
+
+    asyncio.run(run())
+
+    assert seen[0][0]["video_id"] == 7
+    assert seen[0][0]["rendition"] == "720p"
+    assert seen[0][0]["total_bytes"] == 100
+    assert registry.list() == []
+    assert registry.stats()["completed"] == 1
+
+
+def test_file_range_response_head_sends_no_body(video_file):
+    response = FileRangeResponse(video_file, 0, os.path.getsize(video_file) - 1)
+    messages = run_response(response, {"type": "http", "method": "HEAD"})
+
+    assert messages[1] == {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+def test_file_sender_streams_bounded_chunks(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 4096)
+
+    async def collect():
+        return [chunk async for chunk in file_sender(video_file)]
+
+    chunks = asyncio.run(collect())
+    assert len(chunks) == 3
+    with open(video_file, "rb") as f:
+        assert b"".join(chunks) == f.read()
+
+
+def test_ranged_file_sender_reads_ahead_on_io_pool(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    monkeypatch.setattr("core.config.settings.STREAM_READ_AHEAD_CHUNKS", 2)
+    reads = []
+    original_pread = os.pread
+
+    def tracking_pread(fd, size, offset):
+        reads.append((offset, threading.current_thread().name))
+        return original_pread(fd, size, offset)
+
+    monkeypatch.setattr("os.pread", tracking_pread)
+
+    async def take_first_chunk():
+        sender = ranged_file_sender(video_file, 0, 9999)
+        chunk = await sender.__anext__()
+        await sender.aclose()
+        return chunk
+
+    chunk = asyncio.run(take_first_chunk())
+
+    assert len(chunk) == 1000
+    # The current chunk plus two read-ahead chunks were requested up front
+    assert sorted(offset for offset, _ in reads)[:3] == [0, 1000, 2000]
+    assert all(name.startswith("stream-io") for _, name in reads)
+
+
+def test_ranged_file_sender_keeps_the_descriptor_open_until_a_cancelled_read_returns(video_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.STREAM_CHUNK_SIZE", 1000)
+    monkeypatch.setattr("core.config.settings.STREAM_READ_AHEAD_CHUNKS", 0)
+    started, resume = threading.Event(), threading.Event()
+    original_pread = os.pread
+
+    def blocked_pread(fd, size, offset):
+        started.set()
+        resume.wait(5)
+        return original_pread(fd, size, offset)
+
+    monkeypatch.setattr("os.pread", blocked_pread)
+    shared = SharedFile(video_file)
+    shared.retire()
+
+    async def cancel_mid_read():
+        async def consume():
+            return [chunk async for chunk in ranged_file_sender(shared, 0, 999)]
+
+        task = asyncio.ensure_future(consume())
+        while not started.is_set():
+            await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_mid_read())
+    # The pread is still running in its thread and holds on to the descriptor
+    assert shared._fd is not None
+    resume.set()
+    deadline = time.monotonic() + 5
+    while shared._fd is not None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert shared._fd is None
+
+
+def test_coalesced_chunk_load_holds_its_own_reader(video_file, monkeypatch):
+    monkeypatch.setattr("utils.file_handlers.chunk_cache", ChunkCache(max_bytes=0, chunk_size=1000, head_chunks=0))
+    monkeypatch.setattr("utils.file_handlers.chunk_reads", SingleFlight())
+    monkeypatch.setattr("core.config.settings.STREAM_READ_AHEAD_CHUNKS", 0)
+    shared = SharedFile(video_file, cache_key=("video", 1))
+    readers = []
+    original_pread = os.pread
+
+    def counting_pread(fd, size, offset):
+        readers.append(shared._readers)
+        return original_pread(fd, size, offset)
+
+    monkeypatch.setattr("os.pread", counting_pread)
+
+    async def collect():
+        return [chunk async for chunk in ranged_file_sender(shared, 0, 999)]
+
+    asyncio.run(collect())
+
+    # The stream and the load it started each hold the file
+    assert readers == [2]
+    assert shared._readers == 0
+
+
+def test_parse_range_header_suffix_and_multiple_ranges():
+    assert parse_range_header("bytes=-500", 1000) == [(500, 999)]
+    assert parse_range_header("bytes=-5000", 1000) == [(0, 999)]
+    assert parse_range_header("bytes=0-99, 900-", 1000) == [(0, 99), (900, 999)]
+    # Overlapping and adjacent ranges are merged
+    assert parse_range_header("bytes=50-99,0-49,80-120", 1000) == [(0, 120)]
+    # Ranges past the end are dropped when another one is satisfiable
+    assert parse_range_header("bytes=2000-3000,0-9", 1000) == [(0, 9)]
+
+
+def test_parse_range_header_ignores_malformed_headers():
+    assert parse_range_header("items=0-10", 1000) is None
+    assert parse_range_header("bytes=abc", 1000) is None
+    assert parse_range_header("bytes=10-5", 1000) is None
+
+
+def test_parse_range_header_unsatisfiable():
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=1000-", 1000)
+    with pytest.raises(RangeNotSatisfiable):
+        parse_range_header("bytes=-0", 1000)
+
+
+def test_build_file_response_returns_416_for_unsatisfiable_range(video_file):
+    response = build_file_response(video_file, 10240, "bytes=20000-", media_type="video/mp4")
+
+    assert response.status_code == 416
+    assert response.headers["content-range"] == "bytes */10240"
+
+
+def test_build_file_response_serves_multipart_byteranges(video_file):
+    response = build_file_response(video_file, 10240, "bytes=0-9,-10", media_type="video/mp4")
+    messages = run_response(response, {"type": "http", "method": "GET"})
+
+    body = b"".join(m["body"] for m in messages[1:])
+    headers = dict(messages[0]["headers"])
+    boundary = headers[b"content-type"].decode().split("boundary=")[1]
+    with open(video_file, "rb") as f:
+        data = f.read()
+
+    assert response.status_code == 206
+    assert int(headers[b"content-length"]) == len(body)
+    parts = body.split(f"--{boundary}".encode())
+    assert parts[-1] == b"--\r\n"
+    assert b"Content-Range: bytes 0-9/10240\r\n\r\n" + data[:10] + b"\r\n" in parts[1]
+    assert b"Content-Range: bytes 10230-10239/10240\r\n\r\n" + data[-10:] + b"\r\n" in parts[2]
+
+
+def test_chunk_cache_admits_hot_chunks_within_budget():
+    cache = ChunkCache(max_bytes=3000, chunk_size=1000, head_chunks=1)
+
+    # Leading chunks are admitted straight away
+    cache.put("video", 0, b"a" * 1000)
+    assert bytes(cache.get("video", 0)) == b"a" * 1000
+
+    # Other chunks are admitted on their second read
+    cache.put("video", 5, b"b" * 1000)
+    assert cache.get("video", 5) is None
+    cache.put("video", 5, b"b" * 1000)
+    assert cache.get("video", 5) is not None
+
+    # The byte budget evicts the least recently used chunk
+    for index in (6, 7):
+        cache.put("video", index, b"c" * 1000)
+        cache.put("video", index, b"c" * 1000)
+    assert cache.get("video", 0) is None
+    assert cache.stats()["bytes"] == 3000
+    assert cache.stats()["evictions"] == 1
+
+
+def test_ranged_file_sender_serves_repeat_reads_from_chunk_cache(video_file, monkeypatch):
+    cache = ChunkCache(max_bytes=100000, chunk_size=1000, head_chunks=100)
+    monkeypatch.setattr("utils.file_handlers.chunk_cache", cache)
+    shared = SharedFile(video_file, cache_key=("video", 1))
+
+    async def collect(start, end):
+        return [chunk async for chunk in ranged_file_sender(shared, start, end)]
+
+    first = asyncio.run(collect(1500, 3499))
+    monkeypatch.setattr("os.pread", MagicMock(side_effect=AssertionError("unexpected read")))
+    second = asyncio.run(collect(1500, 3499))
+
+    with open(video_file, "rb") as f:
+        expected = f.read()[1500:3500]
+    assert b"".join(first) == expected
+    assert b"".join(second) == expected
+    # Slices of cached chunks are views, not copies
+    assert all(isinstance(chunk, memoryview) for chunk in second)
+    assert cache.stats()["hits"] == 3
+
+
+def test_concurrent_reads_of_the_same_chunk_are_coalesced(video_file, monkeypatch):
+    # Disable the cache so only coalescing can save reads
+    monkeypatch.setattr("utils.file_handlers.chunk_cache", ChunkCache(max_bytes=0, chunk_size=1000, head_chunks=0))
+    flights = SingleFlight()
+    monkeypatch.setattr("utils.file_handlers.chunk_reads", flights)
+    reads = []
+    original_pread = os.pread
+
+    def slow_pread(fd, size, offset):
+        reads.append(offset)
+        time.sleep(0.05)
+        return original_pread(fd, size, offset)
+
+    monkeypatch.setattr("os.pread", slow_pread)
+    shared = SharedFile(video_file, cache_key=("video", 1))
+
+    async def collect():
+        return [chunk async for chunk in ranged_file_sender(shared, 0, 2999)]
+
+    async def viewers():
+        return await asyncio.gather(*(collect() for _ in range(5)))
+
+    results = asyncio.run(viewers())
+
+    with open(video_file, "rb") as f:
+        expected = f.read()[:3000]
+    assert all(b"".join(chunks) == expected for chunks in results)
+    assert sorted(reads) == [0, 1000, 2000]
+    assert flights.stats()["coalesced"] == 12
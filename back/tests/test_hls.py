@@ -0,0 +1,138 @@
+import asyncio
+import os
+import struct
+import pytest
+from fastapi import HTTPException
+
+from services.hls_service import HLSService
+from services.video_file_resolver import VideoFile
+from utils.fmp4 import build_init_segment, build_media_playlist, build_media_segment, plan_segments
+from utils.mp4 import parse_box_tree
+from utils.mp4_index import SampleIndex
+from utils.segment_cache import SegmentCache
+from tests.mp4_samples import AUDIO_SAMPLE_SIZES, VIDEO_SAMPLE_SIZES, build_mp4, sample_data
+
+@pytest.fixture(scope="function")
+def mp4_file(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=True))
+    return str(path)
+
+def parse_segment(data):
+    # Split a media segment into its parsed moof and the raw mdat payload
+    moof_size = struct.unpack_from(">I", data)[0]
+    moof = parse_box_tree(data[8:moof_size], b"moof")
+    assert data[moof_size + 4:moof_size + 8] == b"mdat"
+    return moof, moof_size, data[moof_size + 8:]
+
+
+def test_plan_segments_cuts_at_keyframes(mp4_file):
+    index = SampleIndex.build(mp4_file)
+
+    segments = plan_segments(index, target_duration=0.4)
+
+    # Keyframes are samples 0 and 5 of the video track, 100ms apart each
+    assert [segment.start for segment in segments] == [0.0, 0.5]
+    assert [segment.sample_ranges[0] for segment in segments] == [(0, 5), (5, 10)]
+    # Every audio sample lands in exactly one segment
+    audio_ranges = [segment.sample_ranges[1] for segment in segments]
+    assert sum(last - first for first, last in audio_ranges) == len(AUDIO_SAMPLE_SIZES)
+    # A target longer than the movie gives a single segment
+    assert len(plan_segments(index, target_duration=10)) == 1
+
+
+def test_build_media_segment_remuxes_samples(mp4_file):
+    index = SampleIndex.build(mp4_file)
+    segment = plan_segments(index, target_duration=0.4)[1]
+
+    fd = os.open(mp4_file, os.O_RDONLY)
+    try:
+        data = build_media_segment(fd, index, segment)
+    finally:
+        os.close(fd)
+
+    moof, moof_size, mdat = parse_segment(data)
+    assert struct.unpack_from(">I", moof.find(b"mfhd").payload, 4)[0] == 2
+    trafs = moof.find_all(b"traf")
+    # The audio track has no samples left after 0.5s
+    assert len(trafs) == 1
+    tfdt = trafs[0].find(b"tfdt").payload
+    assert struct.unpack_from(">Q", tfdt, 4)[0] == 500
+    trun = trafs[0].find(b"trun").payload
+    sample_count, data_offset = struct.unpack_from(">Ii", trun, 4)
+    assert sample_count == 5
+    assert data_offset == moof_size + 8
+    # The first sample is the keyframe, the others depend on it
+    flags = [struct.unpack_from(">IIIi", trun, 12 + 16 * i)[2] for i in range(sample_count)]
+    assert flags[0] == 0x02000000 and all(flag & 0x10000 for flag in flags[1:])
+    assert mdat == b"".join(sample_data("video", i, VIDEO_SAMPLE_SIZES[i]) for i in range(5, 10))
+
+
+def test_build_init_segment_empties_sample_tables(mp4_file):
+    index = SampleIndex.build(mp4_file)
+
+    data = build_init_segment(mp4_file, index)
+
+    ftyp_size = struct.unpack_from(">I", data)[0]
+    assert data[4:8] == b"ftyp"
+    moov = parse_box_tree(data[ftyp_size + 8:], b"moov")
+    trex = [struct.unpack_from(">I", box.payload, 4)[0] for box in moov.find(b"mvex").find_all(b"trex")]
+    assert trex == [1, 2]
+    for trak in moov.find_all(b"trak"):
+        stbl = trak.find(b"mdia").find(b"minf").find(b"stbl")
+        assert stbl.find(b"stsd") is not None
+        assert stbl.find(b"stss") is None
+        assert struct.unpack_from(">I", stbl.find(b"stsz").payload, 8)[0] == 0
+
+
+def test_build_media_playlist():
+    class FakeSegment:
+        def __init__(self, number, duration):
+            self.number = number
+            self.duration = duration
+
+    playlist = build_media_playlist([FakeSegment(0, 6.006), FakeSegment(1, 2.5)], "init.mp4", "{}.m4s")
+
+    lines = playlist.splitlines()
+    assert lines[0] == "#EXTM3U"
+    assert "#EXT-X-TARGETDURATION:7" in lines
+    assert '#EXT-X-MAP:URI="init.mp4"' in lines
+    assert lines[-5:] == ["#EXTINF:6.006,", "0.m4s", "#EXTINF:2.500,", "1.m4s", "#EXT-X-ENDLIST"]
+
+
+def test_hls_service_packages_segments_once(mp4_file, tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.INDEXES_DIR", str(tmp_path))
+    stat = os.stat(mp4_file)
+    video_file = VideoFile(1, "movie.mp4", mp4_file, stat.st_size, stat.st_mtime, "video/mp4")
+    cache = SegmentCache(max_bytes=1024 * 1024)
+    service = HLSService(cache=cache, segment_duration=0.4)
+
+    async def fetch_concurrently():
+        return await asyncio.gather(*(service.get_media_segment(video_file, 0) for _ in range(5)))
+
+    # The index is built on first use, concurrent requests share one packaging
+    segments = asyncio.run(fetch_concurrently())
+    assert all(segment == segments[0] for segment in segments)
+    assert cache.stats()["segments"] == 1
+
+    again = asyncio.run(service.get_media_segment(video_file, 0))
+    assert again == segments[0]
+    assert cache.stats()["hits"] == 1
+
+
+def test_hls_service_refuses_to_package_a_replaced_file(mp4_file, tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.INDEXES_DIR", str(tmp_path))
+    stat = os.stat(mp4_file)
+    video_file = VideoFile(1, "movie.mp4", mp4_file, stat.st_size, stat.st_mtime, "video/mp4")
+    service = HLSService(cache=SegmentCache(max_bytes=1024 * 1024), segment_duration=0.4)
+    asyncio.run(service.get_playlist(video_file))
+
+    # Another worker replaces the file, this one retired its descriptor and reopens the path
+    with open(mp4_file, "r+b") as f:
+        f.seek(0, os.SEEK_END)
+        f.write(b"\x00" * 16)
+    video_file.file.retire()
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.get_media_segment(video_file, 0))
+    assert error.value.status_code == 404
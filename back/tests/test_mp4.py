@@ -0,0 +1,179 @@
+import os
+import struct
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.database import Base
+from models.video import Video
+from services.ingest_service import IngestService
+from services.sample_index_service import sample_index_service
+from utils.mp4 import MP4Error, is_faststart, make_faststart, read_box_tree, read_top_level_boxes
+from utils.mp4_index import SampleIndex
+from tests.mp4_samples import VIDEO_SAMPLE_SIZES, build_mp4, sample_data
+
+# Create test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_mp4.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="function")
+def test_db():
+    # Create tables
+    Base.metadata.create_all(bind=engine)
+    yield
+    # Drop tables
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture(scope="function")
+def mp4_file(tmp_path):
+    # Create a movie with its moov box at the end of the file
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=False))
+    return str(path)
+
+def chunk_offsets(path):
+    # Read the chunk offsets of every track
+    boxes = read_top_level_boxes(path)
+    moov = read_box_tree(path, next(box for box in boxes if box.type == b"moov"))
+    offsets = []
+    for node in moov.walk():
+        if node.type in (b"stco", b"co64"):
+            count = struct.unpack_from(">I", node.payload, 4)[0]
+            item = "I" if node.type == b"stco" else "Q"
+            offsets.append(list(struct.unpack_from(f">{count}{item}", node.payload, 8)))
+    return offsets
+
+
+def test_make_faststart_moves_moov_and_fixes_offsets(mp4_file, tmp_path):
+    output = str(tmp_path / "faststart.mp4")
+
+    assert not is_faststart(read_top_level_boxes(mp4_file))
+    assert make_faststart(mp4_file, output)
+
+    boxes = read_top_level_boxes(output)
+    assert [box.type for box in boxes] == [b"ftyp", b"moov", b"mdat"]
+    assert is_faststart(boxes)
+    assert os.path.getsize(output) == os.path.getsize(mp4_file)
+
+    # Every chunk offset still points at the same sample data
+    with open(output, "rb") as f:
+        data = f.read()
+    video_offsets, audio_offsets = chunk_offsets(output)
+    assert data[video_offsets[0]:video_offsets[0] + VIDEO_SAMPLE_SIZES[0]] == sample_data("video", 0, VIDEO_SAMPLE_SIZES[0])
+    assert data[video_offsets[1]:video_offsets[1] + VIDEO_SAMPLE_SIZES[5]] == sample_data("video", 5, VIDEO_SAMPLE_SIZES[5])
+    assert data[audio_offsets[0]:audio_offsets[0] + 64] == sample_data("audio", 0, 64)
+
+
+def test_make_faststart_shifts_data_past_a_mid_file_moov_grown_to_co64(tmp_path, monkeypatch):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=False, moov_between_tracks=True))
+    output = str(tmp_path / "faststart.mp4")
+    # Every offset overflows stco, so the moov grows while it moves
+    monkeypatch.setattr("utils.mp4.STCO_MAX_OFFSET", 0)
+
+    assert make_faststart(str(path), output)
+
+    boxes = read_top_level_boxes(output)
+    assert [box.type for box in boxes] == [b"ftyp", b"moov", b"mdat", b"mdat"]
+    moov = read_box_tree(output, boxes[1])
+    assert {node.type for node in moov.walk()} & {b"stco", b"co64"} == {b"co64"}
+    with open(output, "rb") as f:
+        data = f.read()
+    video_offsets, audio_offsets = chunk_offsets(output)
+    assert data[video_offsets[1]:video_offsets[1] + VIDEO_SAMPLE_SIZES[5]] == sample_data("video", 5, VIDEO_SAMPLE_SIZES[5])
+    # The audio sits past the old moov position and only moves by how much the moov grew
+    assert data[audio_offsets[0]:audio_offsets[0] + 64] == sample_data("audio", 0, 64)
+    assert data[audio_offsets[1]:audio_offsets[1] + 64] == sample_data("audio", 10, 64)
+
+
+def test_make_faststart_leaves_faststart_files_alone(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=True))
+    output = str(tmp_path / "faststart.mp4")
+
+    assert not make_faststart(str(path), output)
+    assert not os.path.exists(output)
+
+
+def test_read_top_level_boxes_rejects_non_mp4(tmp_path):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(b"\x1a\x45\xdf\xa3" + b"\x00" * 100)
+
+    with pytest.raises(MP4Error):
+        read_top_level_boxes(str(path))
+
+
+def test_ingest_normalizes_faststart(test_db, mp4_file, monkeypatch):
+    monkeypatch.setattr("core.config.settings.VIDEOS_DIR", os.path.dirname(mp4_file))
+    db = TestingSessionLocal()
+    video = Video(title="Test Video", filename=os.path.basename(mp4_file), content_type="video/mp4")
+    db.add(video)
+    db.commit()
+    video_id = video.id
+    db.close()
+
+    service = IngestService(session_factory=TestingSessionLocal)
+    assert service.normalize_faststart(video_id)
+
+    assert is_faststart(read_top_level_boxes(mp4_file))
+    db = TestingSessionLocal()
+    assert db.get(Video, video_id).is_faststart is True
+    db.close()
+
+
+def test_sample_index_maps_samples_to_bytes(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=True))
+    data = path.read_bytes()
+
+    index = SampleIndex.build(str(path))
+    video, audio = index.video_track, index.audio_track
+
+    assert video.sample_count == len(VIDEO_SAMPLE_SIZES)
+    assert audio.sample_count == 20
+    assert list(video.sync_samples) == [0, 5]
+    assert video.duration == pytest.approx(1.0)
+    for sample, size in enumerate(VIDEO_SAMPLE_SIZES):
+        offset = video.offsets[sample]
+        assert data[offset:offset + size] == sample_data("video", sample, size)
+    assert data[audio.offsets[13]:audio.offsets[13] + 64] == sample_data("audio", 13, 64)
+
+
+def test_sample_index_seeks_to_previous_keyframe(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=True))
+    index = SampleIndex.build(str(path))
+
+    # 0.75s falls between the keyframes at 0.5s and 1.0s
+    keyframe_time, first_byte = index.seek(0.75)
+    assert keyframe_time == pytest.approx(0.5)
+    assert first_byte == index.video_track.offsets[5]
+
+    keyframe_time, first_byte = index.seek(0.3)
+    assert keyframe_time == 0
+    assert first_byte == index.video_track.offsets[0]
+
+
+def test_sample_index_sidecar_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.INDEXES_DIR", str(tmp_path))
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=True))
+    stat = os.stat(path)
+
+    built = sample_index_service.build_index(str(path), "movie.mp4")
+    loaded = sample_index_service.get_index("movie.mp4", stat.st_size, stat.st_mtime)
+
+    assert loaded is not None
+    for built_track, loaded_track in zip(built.tracks, loaded.tracks):
+        assert loaded_track.offsets == built_track.offsets
+        assert loaded_track.decode_times == built_track.decode_times
+        assert loaded_track.sync == built_track.sync
+    assert sample_index_service.seek("movie.mp4", stat.st_size, stat.st_mtime, 0.75)[0] == pytest.approx(0.5)
+    # An index never describes another version of the file
+    assert sample_index_service.get_index("movie.mp4", stat.st_size + 1, stat.st_mtime) is None
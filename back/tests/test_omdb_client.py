@@ -0,0 +1,106 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from services.omdb_client import CircuitBreaker, OMDBClient, OMDBError, OMDBUnavailable
+
+MOVIE = {"Title": "Blade", "Year": "1998", "Runtime": "120 min", "Genre": "Action, Horror"}
+
+
+@pytest.fixture
+def omdb_server(monkeypatch):
+    # Local stand-in for the OMDB API, answers are queued per test
+    answers = []
+    requests = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requests.append(parse_qs(urlparse(self.path).query))
+            status, body = answers.pop(0) if answers else (200, MOVIE)
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True).start()
+    monkeypatch.setattr("core.config.settings.OMDB_BASE_URL", f"http://127.0.0.1:{server.server_address[1]}/")
+    monkeypatch.setattr("core.config.settings.OMDB_API_KEY", "test-key")
+    monkeypatch.setattr("core.config.settings.OMDB_RETRY_BACKOFF", 0.01)
+    yield answers, requests
+    server.shutdown()
+    server.server_close()
+
+
+def get_movie(client, imdb_id="tt0120611"):
+    async def run():
+        try:
+            return await client.get_movie(imdb_id)
+        finally:
+            await client.aclose()
+
+    return asyncio.run(run())
+
+
+def test_get_movie(omdb_server):
+    answers, requests = omdb_server
+
+    assert get_movie(OMDBClient())["Title"] == "Blade"
+    assert requests == [{"i": ["tt0120611"], "apikey": ["test-key"]}]
+
+
+def test_transient_failures_are_retried(omdb_server):
+    answers, requests = omdb_server
+    answers.extend([(503, {}), (429, {})])
+
+    assert get_movie(OMDBClient())["Title"] == "Blade"
+    assert len(requests) == 3
+
+
+def test_omdb_errors_are_not_retried(omdb_server):
+    answers, requests = omdb_server
+    answers.append((200, {"Response": "False", "Error": "Incorrect IMDb ID."}))
+
+    with pytest.raises(OMDBError, match="Incorrect IMDb ID"):
+        get_movie(OMDBClient())
+    assert len(requests) == 1
+
+
+def test_breaker_opens_after_repeated_failures(omdb_server, monkeypatch):
+    answers, requests = omdb_server
+    monkeypatch.setattr("core.config.settings.OMDB_RETRIES", 1)
+    monkeypatch.setattr("core.config.settings.OMDB_BREAKER_FAILURES", 2)
+    answers.extend([(500, {})] * 4)
+    client = OMDBClient()
+
+    for _ in range(2):
+        with pytest.raises(OMDBUnavailable):
+            get_movie(client)
+    assert len(requests) == 4
+
+    # Open: refused without a request
+    with pytest.raises(OMDBUnavailable) as error:
+        get_movie(client)
+    assert len(requests) == 4
+    assert error.value.retry_after > 0
+    assert client.stats()["breaker"]["state"] == "open"
+
+
+def test_half_open_breaker_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.state == "half-open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
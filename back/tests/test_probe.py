@@ -0,0 +1,131 @@
+import os
+import struct
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.database import Base
+from models.video import Video
+from services.ingest_service import IngestService
+from utils.probe import ProbeError, probe_file
+from tests.mp4_samples import build_mp4
+
+# Create test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_probe.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+MAX_HEADER_BYTES = 1024 * 1024
+
+@pytest.fixture(scope="function")
+def test_db():
+    # Create tables
+    Base.metadata.create_all(bind=engine)
+    yield
+    # Drop tables
+    Base.metadata.drop_all(bind=engine)
+
+def element(element_id: int, payload: bytes) -> bytes:
+    """Encode an EBML element with an 8-byte size"""
+    id_bytes = element_id.to_bytes((element_id.bit_length() + 7) // 8, "big")
+    return id_bytes + bytes([0x01]) + len(payload).to_bytes(7, "big") + payload
+
+def build_webm(video_codec: bytes = b"V_VP9", audio_codec: bytes = b"A_OPUS") -> bytes:
+    """Build the headers of a 2.5 second WebM followed by an empty cluster"""
+    header = element(0x1A45DFA3, element(0x4282, b"webm"))
+    info = element(0x1549A966, element(0x2AD7B1, struct.pack(">I", 1_000_000)) + element(0x4489, struct.pack(">d", 2500.0)))
+    video_track = element(0xAE, element(0x83, b"\x01") + element(0x86, video_codec)
+                          + element(0xE0, element(0xB0, struct.pack(">H", 1280)) + element(0xBA, struct.pack(">H", 720))))
+    audio_track = element(0xAE, element(0x83, b"\x02") + element(0x86, audio_codec))
+    tracks = element(0x1654AE6B, video_track + audio_track)
+    cluster = element(0x1F43B675, b"\x00" * 64)
+    return header + element(0x18538067, info + tracks + cluster)
+
+def test_probe_mp4(tmp_path):
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4(moov_first=False))
+
+    info = probe_file(str(path), MAX_HEADER_BYTES)
+
+    assert info.container == "mp4"
+    assert info.content_type == "video/mp4"
+    assert info.duration == 1.0
+    assert info.bitrate == os.path.getsize(path) * 8
+    assert (info.width, info.height) == (640, 360)
+    assert info.video_codec == "avc1.64001f"
+    assert info.audio_codec == "mp4a.40.2"
+    assert info.is_playable
+
+def test_probe_webm(tmp_path):
+    path = tmp_path / "movie.webm"
+    path.write_bytes(build_webm())
+
+    info = probe_file(str(path), MAX_HEADER_BYTES)
+
+    assert info.container == "webm"
+    assert info.content_type == "video/webm"
+    assert info.duration == 2.5
+    assert (info.width, info.height) == (1280, 720)
+    assert info.video_codec == "vp9"
+    assert info.audio_codec == "opus"
+    assert info.is_playable
+
+def test_probe_flags_unplayable_codecs(tmp_path):
+    path = tmp_path / "movie.mkv"
+    path.write_bytes(build_webm(video_codec=b"V_MPEG2", audio_codec=b"A_DTS"))
+
+    info = probe_file(str(path), MAX_HEADER_BYTES)
+
+    assert info.video_codec == "V_MPEG2"
+    assert not info.is_playable
+
+def test_probe_rejects_unknown_and_oversized_files(tmp_path):
+    path = tmp_path / "movie.avi"
+    path.write_bytes(b"RIFF" + b"\x00" * 100)
+    with pytest.raises(ProbeError):
+        probe_file(str(path), MAX_HEADER_BYTES)
+
+    path = tmp_path / "movie.mp4"
+    path.write_bytes(build_mp4())
+    with pytest.raises(ProbeError):
+        probe_file(str(path), 64)
+
+def test_probe_rejects_corrupt_matroska(tmp_path):
+    path = tmp_path / "movie.webm"
+    # A 3-byte Duration float
+    info = element(0x1549A966, element(0x4489, b"\x00" * 3))
+    path.write_bytes(element(0x1A45DFA3, element(0x4282, b"webm")) + element(0x18538067, info))
+    with pytest.raises(ProbeError):
+        probe_file(str(path), MAX_HEADER_BYTES)
+
+    # A track field of unknown size
+    tracks = element(0x1654AE6B, element(0xAE, bytes([0x83, 0xFF])))
+    path.write_bytes(element(0x1A45DFA3, b"") + element(0x18538067, tracks))
+    with pytest.raises(ProbeError):
+        probe_file(str(path), MAX_HEADER_BYTES)
+
+def test_ingest_records_probe(test_db, tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.VIDEOS_DIR", str(tmp_path))
+    (tmp_path / "movie.webm").write_bytes(build_webm())
+    db = TestingSessionLocal()
+    video = Video(title="Test Video", filename="movie.webm", content_type="video/mp4")
+    db.add(video)
+    db.commit()
+    video_id = video.id
+    db.close()
+
+    service = IngestService(session_factory=TestingSessionLocal)
+    assert service.probe_video(video_id)
+
+    db = TestingSessionLocal()
+    video = db.get(Video, video_id)
+    assert video.content_type == "video/webm"
+    assert video.duration_seconds == 2.5
+    assert (video.width, video.height) == (1280, 720)
+    assert (video.video_codec, video.audio_codec) == ("vp9", "opus")
+    db.close()
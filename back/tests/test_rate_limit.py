@@ -0,0 +1,124 @@
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from fastapi.testclient import TestClient
+
+from utils.rate_limit import (
+    MemoryRateLimitStore,
+    RateLimitMiddleware,
+    RateLimitStore,
+    RateLimiter,
+    client_key,
+    load_store,
+)
+
+
+def test_token_bucket_refuses_past_the_burst():
+    async def run():
+        store = MemoryRateLimitStore()
+        taken = [await store.take("req:a", rate=1, burst=3, amount=1) for _ in range(4)]
+        other_client = await store.take("req:b", rate=1, burst=3, amount=1)
+        return taken, other_client
+
+    taken, other_client = asyncio.run(run())
+    assert taken[:3] == [0, 0, 0]
+    assert 0.9 < taken[3] <= 1
+    assert other_client == 0
+
+
+def test_token_bucket_debt_paces_bandwidth():
+    async def run():
+        store = MemoryRateLimitStore()
+        first = await store.take("bytes:a", rate=1000, burst=1000, amount=1000, allow_debt=True)
+        second = await store.take("bytes:a", rate=1000, burst=1000, amount=500, allow_debt=True)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == 0
+    assert second == pytest.approx(0.5, abs=0.01)
+
+
+def test_concurrent_streams_are_capped_per_client():
+    async def run():
+        store = MemoryRateLimitStore()
+        opened = [await store.acquire("streams:a", 2) for _ in range(3)]
+        await store.release("streams:a")
+        return opened, await store.acquire("streams:a", 2)
+
+    opened, reopened = asyncio.run(run())
+    assert opened == [True, True, False]
+    assert reopened
+
+
+def test_client_key_uses_the_token_when_configured(monkeypatch):
+    scope = {"client": ("10.0.0.1", 5000), "headers": [], "query_string": b"token=abc&t=3"}
+    assert client_key(scope) == "ip:10.0.0.1"
+
+    monkeypatch.setattr("core.config.settings.RATE_LIMIT_KEY", "token")
+    assert client_key(scope) == "token:abc"
+    assert client_key({**scope, "headers": [(b"authorization", b"Bearer xyz")]}) == "token:xyz"
+    assert client_key({**scope, "query_string": b""}) == "ip:10.0.0.1"
+
+
+def test_store_is_pluggable():
+    assert isinstance(load_store("memory"), MemoryRateLimitStore)
+    assert isinstance(load_store("utils.rate_limit:MemoryRateLimitStore"), MemoryRateLimitStore)
+    store = load_store("tests.test_rate_limit:SHARED_STORE")
+    assert store is SHARED_STORE
+
+
+def test_store_must_implement_every_operation():
+    class BucketsOnly(RateLimitStore):
+        async def take(self, key, rate, burst, amount, allow_debt=False):
+            return 0.0
+
+    with pytest.raises(TypeError):
+        BucketsOnly()
+
+
+SHARED_STORE = MemoryRateLimitStore()
+
+
+@pytest.fixture
+def limited_client(monkeypatch):
+    monkeypatch.setattr("core.config.settings.RATE_LIMIT_REQUESTS_PER_SECOND", 0.001)
+    monkeypatch.setattr("core.config.settings.RATE_LIMIT_REQUESTS_BURST", 2)
+    monkeypatch.setattr("core.config.settings.RATE_LIMIT_STREAMS_PER_CLIENT", 1)
+    limiter = RateLimiter(MemoryRateLimitStore())
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+
+    @app.get("/api/videos/")
+    def list_videos():
+        return []
+
+    @app.get("/api/videos/stream/{video_id}")
+    async def stream_video(video_id: int):
+        async def body():
+            yield b"video"
+            # Another request of the same client arrives while this stream is running
+            response = await asyncio.to_thread(TestClient(app).get, "/api/videos/stream/2")
+            statuses.append(response.status_code)
+
+        return StreamingResponse(body())
+
+    statuses = []
+    return TestClient(app), limiter, statuses
+
+
+def test_middleware_limits_request_rate(limited_client):
+    client, limiter, _ = limited_client
+    assert [client.get("/api/videos/").status_code for _ in range(3)] == [200, 200, 429]
+    assert int(client.get("/api/videos/").headers["retry-after"]) > 0
+    # Routes outside the API (health, load) are never limited, this one just doesn't exist
+    assert client.get("/health").status_code == 404
+    assert limiter.stats()["limited_requests"] == 2
+
+
+def test_middleware_caps_concurrent_streams(limited_client):
+    client, limiter, statuses = limited_client
+    assert client.get("/api/videos/stream/1").content == b"video"
+    assert statuses == [429]
+    assert limiter.stats()["limited_streams"] == 1
+
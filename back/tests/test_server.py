@@ -0,0 +1,60 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import uvicorn
+
+import server
+
+
+def test_worker_count_defaults_to_cores(monkeypatch):
+    monkeypatch.setattr("core.config.settings.SERVER_WORKERS", 0)
+    monkeypatch.setattr("server.multiprocessing.cpu_count", lambda: 6)
+    assert server.worker_count() == 6
+
+    monkeypatch.setattr("core.config.settings.SERVER_WORKERS", 2)
+    assert server.worker_count() == 2
+
+
+def test_server_options_follow_settings(monkeypatch):
+    monkeypatch.setattr("core.config.settings.SERVER_LOOP", "uvloop")
+    monkeypatch.setattr("core.config.settings.SERVER_KEEP_ALIVE", 75)
+    options = server.server_options(port=8001)
+
+    assert options["port"] == 8001
+    assert options["loop"] == "uvloop"
+    assert options["timeout_keep_alive"] == 75
+
+
+def test_max_requests_adds_jitter(monkeypatch):
+    monkeypatch.setattr("core.config.settings.SERVER_MAX_REQUESTS", 0)
+    assert server.max_requests() is None
+
+    monkeypatch.setattr("core.config.settings.SERVER_MAX_REQUESTS", 1000)
+    monkeypatch.setattr("core.config.settings.SERVER_MAX_REQUESTS_JITTER", 50)
+    assert all(1000 <= server.max_requests() <= 1050 for _ in range(20))
+
+
+def test_supervisor_stops_when_a_worker_fails_to_boot():
+    supervisor = server.Supervisor(config=None, workers=1, preload=False)
+    pid = os.fork()
+    if pid == 0:
+        os._exit(server.WORKER_BOOT_ERROR)
+    supervisor.children[pid] = 0.0
+    os.waitid(os.P_PID, pid, os.WEXITED | os.WNOWAIT)
+    supervisor._reap()
+
+    assert supervisor.children == {}
+    assert supervisor.should_exit
+    assert supervisor.exit_code == server.WORKER_BOOT_ERROR
+
+
+def test_supervisor_runs_the_before_fork_hook_of_the_app_module(monkeypatch):
+    calls = []
+    monkeypatch.setitem(sys.modules, "hooked_app", SimpleNamespace(app=None, before_fork=lambda: calls.append(1)))
+    monkeypatch.setitem(sys.modules, "plain_app", SimpleNamespace(app=None))
+
+    server.Supervisor(uvicorn.Config("hooked_app:app"), workers=1, preload=True)._before_fork()
+    server.Supervisor(uvicorn.Config("plain_app:app"), workers=1, preload=True)._before_fork()
+
+    assert calls == [1]
@@ -0,0 +1,144 @@
+import os
+import subprocess
+import sys
+import pytest
+from fastapi.testclient import TestClient
+
+from stream_app import app
+from utils.http_cache import make_etag
+from utils.stream_tokens import StreamGrant, expiry_from_now, sign_stream_grant
+
+KEY = "test-signing-key"
+
+
+@pytest.fixture
+def stream_client(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr("core.config.settings.THUMBNAILS_DIR", str(tmp_path / "thumbnails"))
+    monkeypatch.setattr("core.config.settings.STREAM_SIGNING_KEY", KEY)
+    for directory in ("videos", "subtitles"):
+        (tmp_path / directory).mkdir()
+    return TestClient(app)
+
+
+def sign(path, **overrides):
+    stat = os.stat(path)
+    values = {
+        "video_id": 1,
+        "path": os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path)),
+        "version": make_etag(stat.st_size, stat.st_mtime),
+        "content_type": "video/mp4",
+        "expires_at": expiry_from_now(60),
+    }
+    values.update(overrides)
+    return sign_stream_grant(StreamGrant(**values), KEY)
+
+
+def test_stream_app_does_not_load_the_orm():
+    code = (
+        "import sys, stream_app; "
+        "print(sorted(m for m in sys.modules if m.split('.')[0] in ('sqlalchemy', 'models', 'db', 'services', 'api')))"
+    )
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run([sys.executable, "-c", code], cwd=backend_dir, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+
+def test_stream_app_serves_signed_streams(stream_client, tmp_path):
+    path = tmp_path / "videos" / "movie.mp4"
+    path.write_bytes(b"signed video content")
+
+    response = stream_client.get(f"/api/videos/stream/1?token={sign(path)}", headers={"Range": "bytes=0-5"})
+    assert response.status_code == 206
+    assert response.content == b"signed"
+
+    # Players probe the length with HEAD before requesting ranges
+    response = stream_client.head(f"/api/videos/stream/1?token={sign(path)}")
+    assert response.status_code == 200
+    assert response.headers["content-length"] == str(len(b"signed video content"))
+    assert response.content == b""
+
+    # Unsigned, tampered, reused for another video or issued for an older file
+    assert stream_client.get("/api/videos/stream/1").status_code == 422
+    assert stream_client.get(f"/api/videos/stream/1?token={sign(path)}x").status_code == 403
+    assert stream_client.get(f"/api/videos/stream/2?token={sign(path)}").status_code == 403
+    stale_token = sign(path, version=make_etag(1, 0))
+    assert stream_client.get(f"/api/videos/stream/1?token={stale_token}").status_code == 410
+
+
+def test_stream_app_serves_signed_subtitles(stream_client, tmp_path):
+    path = tmp_path / "subtitles" / "movie.vtt"
+    path.write_text("WEBVTT\n")
+    token = sign(path, subtitle_id=4, content_type="text/vtt")
+
+    response = stream_client.get(f"/api/subtitles/content/4?token={token}")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/vtt")
+    assert response.text == "WEBVTT\n"
+
+    # A subtitle grant doesn't open another subtitle, nor the video it belongs to
+    assert stream_client.get(f"/api/subtitles/content/5?token={token}").status_code == 403
+    assert stream_client.get(f"/api/videos/stream/1?token={token}").status_code == 403
+    video_token = sign(path)
+    assert stream_client.get(f"/api/subtitles/content/4?token={video_token}").status_code == 403
+
+
+def test_stream_app_serves_thumbnails_and_health(stream_client, tmp_path, monkeypatch):
+    trickplay_dir = tmp_path / "thumbnails" / "trickplay" / "1"
+    trickplay_dir.mkdir(parents=True)
+    (trickplay_dir / "thumbnails.vtt").write_text("WEBVTT\n")
+
+    assert stream_client.get("/api/videos/1/thumbnails.vtt").text == "WEBVTT\n"
+    assert stream_client.get("/api/videos/1/thumbnails/sprite_001.jpg").status_code == 404
+    assert stream_client.get("/health").json()["status"] == "healthy"
+    monkeypatch.setattr("core.config.settings.ADMIN_TOKEN", "admin-token")
+    admin = {"Authorization": "Bearer admin-token"}
+    assert "video_files" in stream_client.get("/api/admin/stats", headers=admin).json()
+    # Active streams list client addresses
+    assert stream_client.get("/api/admin/streams").status_code == 401
+    assert stream_client.get("/api/admin/streams", headers=admin).json()["streams"] == []
+
+
+def test_stream_app_signs_thumbnail_tracks(stream_client, tmp_path, monkeypatch):
+    trickplay_dir = tmp_path / "thumbnails" / "trickplay" / "1"
+    trickplay_dir.mkdir(parents=True)
+    (trickplay_dir / "thumbnails.vtt").write_text("WEBVTT\n\n00:00:00.000 --> 00:00:10.000\nthumbnails/sprite_001.jpg#xywh=0,0,160,90\n")
+    (trickplay_dir / "sprite_001.jpg").write_bytes(b"jpeg")
+    path = tmp_path / "videos" / "movie.mp4"
+    path.write_bytes(b"signed video content")
+    token = sign(path)
+    monkeypatch.setattr("core.config.settings.STREAM_REQUIRE_SIGNED_URLS", True)
+
+    assert stream_client.get("/api/videos/1/thumbnails.vtt").status_code == 401
+    assert stream_client.get("/api/videos/1/thumbnails/sprite_001.jpg").status_code == 401
+    assert stream_client.get(f"/api/videos/2/thumbnails.vtt?token={token}").status_code == 403
+
+    # The cues point at sprite sheets signed with the same token
+    track = stream_client.get(f"/api/videos/1/thumbnails.vtt?token={token}").text
+    assert f"thumbnails/sprite_001.jpg?token={token}#xywh=0,0,160,90" in track
+    assert stream_client.get(f"/api/videos/1/thumbnails/sprite_001.jpg?token={token}").content == b"jpeg"
+
+
+def test_draining_node_refuses_new_streams(stream_client, tmp_path, monkeypatch):
+    path = tmp_path / "videos" / "movie.mp4"
+    path.write_bytes(b"signed video content")
+    admin = {"Authorization": "Bearer admin-token"}
+
+    # Admin routes are disabled until a token is configured, then need it
+    assert stream_client.post("/api/admin/drain").status_code == 403
+    monkeypatch.setattr("core.config.settings.ADMIN_TOKEN", "admin-token")
+    assert stream_client.post("/api/admin/drain").status_code == 401
+    assert stream_client.post("/api/admin/drain", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    assert stream_client.get("/health").status_code == 200
+
+    assert stream_client.post("/api/admin/drain", headers=admin).json()["draining"]
+    try:
+        assert stream_client.get("/health").status_code == 503
+        response = stream_client.get(f"/api/videos/stream/1?token={sign(path)}")
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "1"
+    finally:
+        stream_client.delete("/api/admin/drain", headers=admin)
+
+    assert stream_client.get("/health").status_code == 200
+    assert stream_client.get(f"/api/videos/stream/1?token={sign(path)}").status_code == 200
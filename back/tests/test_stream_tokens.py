@@ -0,0 +1,131 @@
+import time
+import pytest
+from unittest.mock import MagicMock
+
+from services.stream_url_service import StreamURLService
+from utils.http_cache import make_etag
+from utils.stream_tokens import StreamGrant, StreamTokenError, sign_stream_grant, verify_stream_token
+
+KEY = "test-signing-key"
+
+
+def make_grant(**overrides):
+    values = {
+        "video_id": 1,
+        "path": "videos/movie.mp4",
+        "version": '"abc"',
+        "content_type": "video/mp4",
+        "expires_at": int(time.time()) + 60,
+        "bitrate": 800000,
+    }
+    values.update(overrides)
+    return StreamGrant(**values)
+
+
+def test_signed_grant_round_trip():
+    grant = verify_stream_token(sign_stream_grant(make_grant(), KEY), KEY)
+
+    assert grant.video_id == 1
+    assert grant.path == "videos/movie.mp4"
+    assert grant.version == '"abc"'
+    assert grant.content_type == "video/mp4"
+    assert grant.bitrate == 800000
+    assert grant.client is None
+
+
+def test_tampered_expired_and_foreign_tokens_are_rejected():
+    token = sign_stream_grant(make_grant(), KEY)
+    with pytest.raises(StreamTokenError):
+        verify_stream_token(token, "another-key")
+    with pytest.raises(StreamTokenError):
+        verify_stream_token(token[:-2] + ("A" if token[-2] != "A" else "B") + token[-1], KEY)
+
+    expired = sign_stream_grant(make_grant(expires_at=int(time.time()) - 10), KEY)
+    with pytest.raises(StreamTokenError, match="expired"):
+        verify_stream_token(expired, KEY)
+
+
+def test_client_bound_token_only_works_for_its_client():
+    token = sign_stream_grant(make_grant(client="10.0.0.1"), KEY)
+
+    assert verify_stream_token(token, KEY, client="10.0.0.1").client == "10.0.0.1"
+    with pytest.raises(StreamTokenError, match="another client"):
+        verify_stream_token(token, KEY, client="10.0.0.2")
+
+
+def test_stream_url_is_signed_with_the_file_version(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr("core.config.settings.VIDEOS_DIR", str(tmp_path / "videos"))
+    (tmp_path / "videos").mkdir()
+    path = tmp_path / "videos" / "movie.mp4"
+    path.write_bytes(b"video")
+    video = MagicMock()
+    video.id = 3
+    video.filename = "movie.mp4"
+    video.content_type = "video/webm"
+    video.bitrate = None
+    service = StreamURLService()
+
+    # Without a key, URLs stay plain
+    assert service.build_stream_url(video) == "/videos/stream/3"
+
+    monkeypatch.setattr("core.config.settings.STREAM_SIGNING_KEY", KEY)
+    monkeypatch.setattr("core.config.settings.STREAM_URL_BIND_CLIENT", True)
+    url = service.build_stream_url(video, client="10.0.0.1")
+    assert url.startswith("/videos/stream/3?token=")
+
+    grant = verify_stream_token(url.split("token=")[1], KEY, client="10.0.0.1")
+    stat = path.stat()
+    assert grant.path == "videos/movie.mp4"
+    assert grant.version == make_etag(stat.st_size, stat.st_mtime)
+    assert grant.content_type == "video/webm"
+
+
+def test_hls_and_rendition_urls_are_signed_for_the_video(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr("core.config.settings.VIDEOS_DIR", str(tmp_path / "videos"))
+    monkeypatch.setattr("core.config.settings.STREAM_BASE_URL", "https://stream.example.com/api/")
+    (tmp_path / "videos").mkdir()
+    (tmp_path / "videos" / "movie.mp4").write_bytes(b"video")
+    video = MagicMock()
+    video.id = 3
+    video.filename = "movie.mp4"
+    video.content_type = "video/mp4"
+    video.bitrate = None
+    service = StreamURLService()
+
+    assert service.build_hls_url(video) == "/videos/hls/3/master.m3u8"
+    assert service.build_rendition_url(video, "720p") == "/videos/stream/3?rendition=720p"
+
+    # Stream nodes neither look renditions up nor package HLS, these URLs stay on the metadata API
+    monkeypatch.setattr("core.config.settings.STREAM_SIGNING_KEY", KEY)
+    hls_url = service.build_hls_url(video)
+    assert hls_url.startswith("/videos/hls/3/master.m3u8?token=")
+    rendition_url = service.build_rendition_url(video, "720p")
+    assert rendition_url.startswith("/videos/stream/3?rendition=720p&token=")
+    for url in (hls_url, rendition_url):
+        grant = verify_stream_token(url.split("token=")[1], KEY)
+        assert grant.video_id == 3
+        assert grant.path == "videos/movie.mp4"
+
+
+def test_subtitle_url_points_at_the_stream_nodes(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr("core.config.settings.SUBTITLES_DIR", str(tmp_path / "subtitles"))
+    monkeypatch.setattr("core.config.settings.STREAM_SIGNING_KEY", KEY)
+    monkeypatch.setattr("core.config.settings.STREAM_BASE_URL", "https://stream.example.com/api/")
+    (tmp_path / "subtitles").mkdir()
+    (tmp_path / "subtitles" / "movie.vtt").write_text("WEBVTT\n")
+    subtitle = MagicMock()
+    subtitle.id = 7
+    subtitle.video_id = 3
+    subtitle.filename = "movie.vtt"
+
+    url = StreamURLService().build_subtitle_url(subtitle)
+    assert url.startswith("https://stream.example.com/api/subtitles/content/7?token=")
+
+    grant = verify_stream_token(url.split("token=")[1], KEY)
+    assert grant.subtitle_id == 7
+    assert grant.video_id == 3
+    assert grant.path == "subtitles/movie.vtt"
+    assert grant.content_type == "text/vtt"
@@ -226,3 +226,37 @@ def test_get_subtitle_unknown_format(client, test_db, monkeypatch, setup_test_di
     assert response.headers["content-type"].startswith("text/plain")  # Accept any charset
     assert "content-disposition" in response.headers
     assert response.content.decode() == subtitle_content
+
+
+def test_get_subtitle_not_modified(client, test_db, monkeypatch, setup_test_dirs):
+    # Create a test subtitle file
+    test_subtitle_path = "uploads/subtitles/test_subtitle.vtt"
+    with open(test_subtitle_path, "w") as f:
+        f.write("WEBVTT")
+
+    # Mock the query to return a subtitle
+    def mock_query_filter(*args, **kwargs):
+        mock = MagicMock()
+        subtitle = MagicMock()
+        subtitle.id = 1
+        subtitle.filename = "test_subtitle.vtt"
+        mock.first.return_value = subtitle
+        return mock
+
+    # Apply the mock
+    monkeypatch.setattr("sqlalchemy.orm.Query.filter", mock_query_filter)
+
+    # The first response carries validators
+    response = client.get("/api/subtitles/content/1")
+    assert response.status_code == 200
+    assert "etag" in response.headers
+    assert "last-modified" in response.headers
+
+    # Revalidating with either validator returns 304 without content
+    response = client.get("/api/subtitles/content/1", headers={"If-None-Match": response.headers["etag"]})
+    assert response.status_code == 304
+    assert response.content == b""
+
+    response = client.get(
+        "/api/subtitles/content/1", headers={"If-Modified-Since": "Fri, 01 Jan 2100 00:00:00 GMT"})
+    assert response.status_code == 304
@@ -0,0 +1,101 @@
+import os
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.database import Base
+from models.video import Video
+from services.thumbnail_service import ThumbnailService
+from utils import ffmpeg
+from utils.trickplay import build_thumbnail_vtt, thumbnail_size
+from tests.mp4_samples import build_mp4
+
+# Create test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_thumbnails.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="function")
+def test_db():
+    # Create tables
+    Base.metadata.create_all(bind=engine)
+    yield
+    # Drop tables
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture(scope="function")
+def video_id(test_db, tmp_path, monkeypatch):
+    for name in ("VIDEOS_DIR", "THUMBNAILS_DIR", "INDEXES_DIR"):
+        os.makedirs(tmp_path / name)
+        monkeypatch.setattr(f"core.config.settings.{name}", str(tmp_path / name))
+    (tmp_path / "VIDEOS_DIR" / "movie.mp4").write_bytes(build_mp4(moov_first=True))
+
+    db = TestingSessionLocal()
+    video = Video(title="Test Video", filename="movie.mp4", content_type="video/mp4")
+    db.add(video)
+    db.commit()
+    video_id = video.id
+    db.close()
+    return video_id
+
+def fake_ffmpeg_run(command, timeout=None):
+    # Stand in for ffmpeg by writing a single sprite sheet
+    with open(command[-1].replace("%03d", "001"), "wb") as f:
+        f.write(b"\xff\xd8\xff\xd9")
+
+
+def test_thumbnail_size_keeps_aspect_ratio():
+    assert thumbnail_size(160, (640, 360)) == (160, 90)
+    assert thumbnail_size(160, (1440, 1080)) == (160, 120)
+    # Unknown dimensions fall back to 16:9
+    assert thumbnail_size(160, None) == (160, 90)
+
+
+def test_build_thumbnail_vtt_maps_cues_to_tiles():
+    vtt = build_thumbnail_vtt(25, 10, 160, 90, columns=2, rows=1, sheet_name="thumbnails/sprite_{:03d}.jpg")
+
+    lines = vtt.splitlines()
+    assert lines[0] == "WEBVTT"
+    assert lines[2:5] == ["00:00:00.000 --> 00:00:10.000", "thumbnails/sprite_001.jpg#xywh=0,0,160,90", ""]
+    assert lines[5:7] == ["00:00:10.000 --> 00:00:20.000", "thumbnails/sprite_001.jpg#xywh=160,0,160,90"]
+    # The last cue ends with the video and starts a new sheet
+    assert lines[8:10] == ["00:00:20.000 --> 00:00:25.000", "thumbnails/sprite_002.jpg#xywh=0,0,160,90"]
+
+
+def test_generate_is_idempotent(video_id, monkeypatch):
+    runs = []
+    monkeypatch.setattr(ffmpeg, "run", lambda command, timeout=None: runs.append(fake_ffmpeg_run(command)))
+    service = ThumbnailService(session_factory=TestingSessionLocal, max_workers=1)
+
+    assert service.generate(video_id)
+    assert not service.generate(video_id)
+
+    assert len(runs) == 1
+    output_dir = service.get_output_dir(video_id)
+    assert sorted(os.listdir(output_dir)) == ["sprite_001.jpg", "thumbnails.vtt"]
+    with open(os.path.join(output_dir, "thumbnails.vtt")) as f:
+        assert "thumbnails/sprite_001.jpg#xywh=0,0,160,90" in f.read()
+
+
+def test_get_file_response_only_serves_thumbnails(video_id, monkeypatch):
+    monkeypatch.setattr(ffmpeg, "run", fake_ffmpeg_run)
+    service = ThumbnailService(session_factory=TestingSessionLocal, max_workers=1)
+    service.generate(video_id)
+
+    response = service.get_file_response(video_id, "thumbnails.vtt", {})
+    assert response.status_code == 200
+    assert response.media_type == "text/vtt"
+
+    not_modified = service.get_file_response(video_id, "thumbnails.vtt", {"if-none-match": response.headers["etag"]})
+    assert not_modified.status_code == 304
+
+    for name in ("../../VIDEOS_DIR/movie.mp4", "sprite_999.jpg"):
+        with pytest.raises(HTTPException) as error:
+            service.get_file_response(video_id, name, {})
+        assert error.value.status_code == 404
@@ -0,0 +1,291 @@
+import asyncio
+import fcntl
+import os
+import sys
+import time
+import pytest
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from db.database import Base
+from db.repositories.rendition_repository import rendition_repository
+from models.rendition import (
+    Rendition, AUDIO_RENDITION, RENDITION_FAILED, RENDITION_PENDING, RENDITION_PROCESSING, RENDITION_READY
+)
+from models.video import Video
+from services.hls_service import HLSService
+from services.transcode_service import (
+    JOB_COMPLETED, JOB_FAILED, JOB_SKIPPED, PRIORITY_BACKFILL, PRIORITY_UPLOAD, TranscodeService
+)
+from services.video_file_resolver import VideoFile
+from utils import ffmpeg
+from utils.segment_cache import SegmentCache
+from tests.mp4_samples import build_mp4
+
+# Create test database
+SQLALCHEMY_DATABASE_URL = "sqlite:///./test_transcode.db"
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    poolclass=StaticPool,
+)
+TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+@pytest.fixture(scope="function")
+def test_db():
+    # Create tables
+    Base.metadata.create_all(bind=engine)
+    yield
+    # Drop tables
+    Base.metadata.drop_all(bind=engine)
+
+@pytest.fixture(scope="function")
+def storage(tmp_path, monkeypatch):
+    # Keep every file the pipeline writes in a temporary directory
+    for name in ("VIDEOS_DIR", "RENDITIONS_DIR", "INDEXES_DIR"):
+        os.makedirs(tmp_path / name)
+        monkeypatch.setattr(f"core.config.settings.{name}", str(tmp_path / name))
+    monkeypatch.setattr(ffmpeg, "is_available", lambda path: True)
+    (tmp_path / "VIDEOS_DIR" / "movie.mp4").write_bytes(build_mp4(moov_first=True))
+    return tmp_path
+
+@pytest.fixture(scope="function")
+def video_id(test_db, storage):
+    db = TestingSessionLocal()
+    video = Video(title="Test Video", filename="movie.mp4", content_type="video/mp4")
+    db.add(video)
+    db.commit()
+    video_id = video.id
+    db.close()
+    return video_id
+
+class RecordingExecutor:
+    # Records submitted jobs instead of running them, freeing the slot they were given
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, func, rendition_id, slot):
+        self.submitted.append(rendition_id)
+        if slot is not None:
+            os.close(slot)
+
+
+def fake_ffmpeg_run(command, timeout=None):
+    # Stand in for the encoder by writing a small valid MP4 to the output path
+    with open(command[-1], "wb") as f:
+        f.write(build_mp4(moov_first=True))
+
+
+def test_schedule_video_skips_upscaling_rungs(video_id):
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+
+    rendition_ids = service.schedule_video(video_id)
+
+    # The source is 640x360, only the 360p rung doesn't upscale it
+    db = TestingSessionLocal()
+    renditions = db.query(Rendition).all()
+    assert [rendition.name for rendition in renditions] == ["360p", "audio"]
+    assert renditions[0].status == RENDITION_PENDING
+    assert renditions[0].filename == "movie_360p.mp4"
+    db.close()
+    # One job runs, the other waits for the slot
+    assert service._executor.submitted == rendition_ids[:1]
+    assert service.stats()["queued"] == 1
+    # Scheduling again doesn't duplicate the ladder
+    assert service.schedule_video(video_id) == []
+
+
+def test_transcode_audio_rendition(video_id, storage, monkeypatch):
+    commands = []
+
+    def fake_run(command, timeout=None):
+        commands.append(command)
+        fake_ffmpeg_run(command)
+
+    monkeypatch.setattr(ffmpeg, "run", fake_run)
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    service.schedule_video(video_id)
+
+    db = TestingSessionLocal()
+    audio = db.query(Rendition).filter(Rendition.name == AUDIO_RENDITION).one()
+    db.close()
+    assert service.transcode_rendition(audio.id) == JOB_COMPLETED
+
+    # The video is dropped, only the audio track is encoded
+    assert "-vn" in commands[0] and "libx264" not in commands[0]
+    db = TestingSessionLocal()
+    audio = db.get(Rendition, audio.id)
+    assert audio.status == RENDITION_READY
+    assert audio.filename == "movie_audio.mp4"
+    db.close()
+
+
+def test_new_uploads_run_before_backfill():
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    service.transcode_rendition = lambda rendition_id: JOB_COMPLETED
+
+    service.enqueue(1, PRIORITY_BACKFILL)
+    service.enqueue(2, PRIORITY_BACKFILL)
+    service.enqueue(3, PRIORITY_BACKFILL)
+    service.enqueue(4, PRIORITY_UPLOAD)
+    # Only one slot, the rest waits in the queue
+    assert service._executor.submitted == [1]
+    assert service.stats()["queued"] == 3
+
+    # Each finished job frees the slot for the next one by priority
+    for position in range(4):
+        service._run(service._executor.submitted[position], None)
+
+    assert service._executor.submitted == [1, 4, 2, 3]
+    assert service.stats()["completed"] == 4
+
+
+def test_jobs_stay_queued_while_other_workers_hold_every_slot(tmp_path, monkeypatch):
+    monkeypatch.setattr("core.config.settings.TRANSCODE_LOCK_DIR", str(tmp_path))
+    # The services package exports the singleton under the module's name
+    monkeypatch.setattr(sys.modules["services.transcode_service"], "SLOT_POLL_INTERVAL", 0.05)
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    # Another worker process of the box runs a job
+    held = os.open(str(tmp_path / "transcode-slot-0.lock"), os.O_RDWR | os.O_CREAT)
+    fcntl.flock(held, fcntl.LOCK_EX)
+
+    service.enqueue(1, PRIORITY_UPLOAD)
+
+    # No thread was handed the job, it waits in the queue for the slot
+    assert service._executor.submitted == []
+    assert service.stats()["running"] == 0
+    assert service.stats()["queued"] == 1
+
+    os.close(held)
+    deadline = time.monotonic() + 5
+    while not service._executor.submitted and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert service._executor.submitted == [1]
+
+
+def test_transcode_rendition_records_ready_output(video_id, storage, monkeypatch):
+    monkeypatch.setattr(ffmpeg, "run", fake_ffmpeg_run)
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    rendition_id = service.schedule_video(video_id)[0]
+
+    assert service.transcode_rendition(rendition_id) == JOB_COMPLETED
+
+    db = TestingSessionLocal()
+    rendition = db.get(Rendition, rendition_id)
+    assert rendition.status == RENDITION_READY
+    assert rendition.size_bytes == os.path.getsize(storage / "RENDITIONS_DIR" / "movie_360p.mp4")
+    assert rendition.width == 640
+    assert rendition.bandwidth == rendition.size_bytes * 8
+    db.close()
+    # The rendition gets its own seek/packaging index
+    assert os.path.exists(storage / "INDEXES_DIR" / "movie_360p.mp4.idx")
+
+
+def test_transcode_rendition_respects_disk_budget(video_id, storage, monkeypatch):
+    monkeypatch.setattr(ffmpeg, "run", fake_ffmpeg_run)
+    monkeypatch.setattr("core.config.settings.TRANSCODE_DISK_BUDGET_BYTES", 100)
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    rendition_id = service.schedule_video(video_id)[0]
+
+    assert service.transcode_rendition(rendition_id) == JOB_FAILED
+
+    db = TestingSessionLocal()
+    rendition = db.get(Rendition, rendition_id)
+    assert rendition.status == RENDITION_FAILED
+    assert "budget" in rendition.error
+    db.close()
+    assert os.listdir(storage / "RENDITIONS_DIR") == []
+
+
+def test_a_rendition_is_claimed_by_a_single_worker(video_id, storage, monkeypatch):
+    monkeypatch.setattr(ffmpeg, "run", fake_ffmpeg_run)
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    rendition_id = service.schedule_video(video_id)[0]
+
+    db = TestingSessionLocal()
+    # Another worker got there first
+    assert rendition_repository.claim(db, rendition_id=rendition_id, reserve_bytes=10, budget_bytes=100)
+    assert not rendition_repository.claim(db, rendition_id=rendition_id, reserve_bytes=10, budget_bytes=100)
+    db.close()
+
+    # A lost claim is no failure
+    assert service.transcode_rendition(rendition_id) == JOB_SKIPPED
+    service._run(rendition_id, None)
+    assert service.stats()["skipped"] == 1
+    assert service.stats()["failed"] == 0
+    db = TestingSessionLocal()
+    assert db.get(Rendition, rendition_id).status == RENDITION_PROCESSING
+    db.close()
+
+
+def test_encoding_renditions_hold_their_share_of_the_budget(video_id, storage):
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    first, second = service.schedule_video(video_id)
+
+    db = TestingSessionLocal()
+    assert rendition_repository.claim(db, rendition_id=first, reserve_bytes=60, budget_bytes=100)
+    # The first one isn't done, but its reservation already counts
+    assert not rendition_repository.claim(db, rendition_id=second, reserve_bytes=60, budget_bytes=100)
+    # Its actual size replaces the reservation
+    assert rendition_repository.finish(db, rendition_id=first, size_bytes=30, budget_bytes=100, obj_in={"width": 640})
+    assert rendition_repository.claim(db, rendition_id=second, reserve_bytes=60, budget_bytes=100)
+    assert db.get(Rendition, first).size_bytes == 30
+    db.close()
+
+
+def test_requeue_stale_renditions(video_id, storage):
+    service = TranscodeService(session_factory=TestingSessionLocal, max_jobs=1)
+    service._executor = RecordingExecutor()
+    abandoned, running = service.schedule_video(video_id)
+    # Start from a fresh worker
+    service._executor.submitted.clear()
+    service._queue.clear()
+    service._running = 0
+
+    db = TestingSessionLocal()
+    for rendition_id in (abandoned, running):
+        rendition_repository.claim(db, rendition_id=rendition_id, reserve_bytes=0, budget_bytes=100)
+    # The abandoned job started before the longest a job may run
+    db.get(Rendition, abandoned).updated_at = datetime.now() - timedelta(days=1)
+    db.commit()
+    db.close()
+
+    assert service.reset_stale() == 1
+    assert service.queue_pending() == 1
+    assert service._executor.submitted == [abandoned]
+    db = TestingSessionLocal()
+    assert db.get(Rendition, abandoned).status == RENDITION_PENDING
+    assert db.get(Rendition, running).status == RENDITION_PROCESSING
+    db.close()
+
+
+def test_master_playlist_lists_renditions(storage):
+    path = str(storage / "VIDEOS_DIR" / "movie.mp4")
+    stat = os.stat(path)
+    video_file = VideoFile(1, "movie.mp4", path, stat.st_size, stat.st_mtime, "video/mp4")
+    rendition = Rendition(name="360p", filename="movie_360p.mp4", height=360, width=640,
+                          video_bitrate=800, audio_bitrate=96, bandwidth=900000)
+    (storage / "RENDITIONS_DIR" / "movie_360p.mp4").write_bytes(build_mp4(moov_first=True))
+    service = HLSService(cache=SegmentCache(max_bytes=1024 * 1024), segment_duration=6)
+
+    playlist = asyncio.run(service.get_master_playlist(video_file, [rendition]))
+
+    lines = playlist.splitlines()
+    assert lines[0] == "#EXTM3U"
+    variant = '#EXT-X-STREAM-INF:BANDWIDTH=900000,RESOLUTION=640x360,CODECS="avc1.64001f,mp4a.40.2"'
+    assert variant in lines
+    assert lines[lines.index(variant) + 1] == "360p/index.m3u8"
+    assert "index.m3u8" in lines
+    # The original file is probed for its resolution and codecs too
+    source = lines[lines.index("index.m3u8") - 1]
+    assert source.endswith(',RESOLUTION=640x360,CODECS="avc1.64001f,mp4a.40.2"')
@@ -0,0 +1,17 @@
+import hmac
+from typing import Optional
+from fastapi import Header, HTTPException
+
+from core.config import settings
+
+
+def require_admin(authorization: Optional[str] = Header(None)) -> None:
+    """
+    Dependency of the admin routes: the request must carry ADMIN_TOKEN as a bearer token.
+    Without an ADMIN_TOKEN configured the admin routes are disabled
+    """
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin routes are disabled")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), settings.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
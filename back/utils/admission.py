@@ -0,0 +1,174 @@
+import asyncio
+import json
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from core.config import settings
+
+STREAM = "stream"
+UPLOAD = "upload"
+CATALOG = "catalog"
+
+
+def route_class(method: str, path: str) -> Optional[str]:
+    """Route class of a request, None for the routes that are never limited (health, load)"""
+    prefix = settings.API_V1_STR
+    if not path.startswith(f"{prefix}/"):
+        return None
+    if path.startswith((f"{prefix}/videos/stream/", f"{prefix}/videos/hls/")):
+        return STREAM
+    if method == "POST" and path.endswith("/upload"):
+        return UPLOAD
+    return CATALOG
+
+
+async def send_error(send: Send, status_code: int, detail: str, retry_after: int) -> None:
+    """Answer a request from a middleware with a JSON error and Retry-After"""
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionRejected(Exception):
+    """A request found its route class at capacity, with a full queue or after waiting too long"""
+
+    def __init__(self, gate: "AdmissionGate"):
+        super().__init__(f"Too many concurrent {gate.name} requests")
+        self.gate = gate
+
+
+class AdmissionGate:
+    """
+    Concurrency limit of one route class. Requests beyond the limit wait in a bounded FIFO queue
+    for up to queue_timeout seconds, the ones that don't fit are rejected at once
+    """
+
+    def __init__(self, name: str, limit: int, queue_depth: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_depth = queue_depth
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self) -> None:
+        """Wait for a slot, raise AdmissionRejected when the queue is full or the wait too long"""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_depth:
+            self.rejected += 1
+            raise AdmissionRejected(self)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # A released slot is handed to the waiter directly, active stays the same
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self.rejected += 1
+            raise AdmissionRejected(self)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Got the slot as the client went away, pass it on
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self) -> None:
+        """Give the slot to the oldest waiter, or free it"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @property
+    def occupancy(self) -> float:
+        """Share of the slots in use, above 1 when requests are queued"""
+        return (self.active + len(self._waiters)) / self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "limit": self.limit,
+            "queue_depth": self.queue_depth,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "occupancy": round(self.occupancy, 3),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+        }
+
+
+class AdmissionController:
+    """The gates of every route class of this worker, a class without a limit is not gated"""
+
+    def __init__(self):
+        self.gates: Dict[str, AdmissionGate] = {}
+        for name, limit, queue_depth in (
+            (STREAM, settings.ADMISSION_STREAM_LIMIT, settings.ADMISSION_STREAM_QUEUE),
+            (UPLOAD, settings.ADMISSION_UPLOAD_LIMIT, settings.ADMISSION_UPLOAD_QUEUE),
+            (CATALOG, settings.ADMISSION_CATALOG_LIMIT, settings.ADMISSION_CATALOG_QUEUE),
+        ):
+            if limit > 0:
+                self.gates[name] = AdmissionGate(name, limit, queue_depth, settings.ADMISSION_QUEUE_TIMEOUT)
+
+    def load(self) -> Dict[str, Any]:
+        """Occupancy of this worker, load is the occupancy of its busiest route class"""
+        classes = {name: gate.stats() for name, gate in self.gates.items()}
+        busiest = max((gate.occupancy for gate in self.gates.values()), default=0.0)
+        return {"load": round(busiest, 3), "classes": classes}
+
+
+class AdmissionMiddleware:
+    """
+    Sheds load per route class: past its concurrency limit and queue a request gets 503 with
+    Retry-After right away. A stream holds its slot until its body is sent
+    """
+
+    def __init__(self, app: ASGIApp, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        gate = self.controller.gates.get(route_class(scope["method"], scope["path"]))
+        if gate is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await gate.acquire()
+        except AdmissionRejected as error:
+            await send_error(send, 503, str(error), settings.ADMISSION_RETRY_AFTER)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            gate.release()
+
+
+# Create a singleton instance
+admission = AdmissionController()
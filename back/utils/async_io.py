@@ -0,0 +1,35 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Optional
+
+from core.config import settings
+
+# Dedicated pool so slow disk reads never compete with FastAPI's default threadpool
+_io_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """Get the shared file I/O thread pool, creating it on first use"""
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = ThreadPoolExecutor(
+            max_workers=settings.STREAM_IO_THREADS,
+            thread_name_prefix="stream-io",
+        )
+    return _io_executor
+
+
+def run_io(func: Callable[..., Any], *args: Any) -> "asyncio.Future[Any]":
+    """Run a blocking file operation on the I/O thread pool"""
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(get_io_executor(), partial(func, *args))
+
+
+def submit_io(func: Callable[..., Any], *args: Any) -> "Future[Any]":
+    """
+    Submit a blocking file operation to the I/O thread pool. Unlike the asyncio future of run_io,
+    the returned future only completes once the call itself returned, even after a cancel
+    """
+    return get_io_executor().submit(func, *args)
+
@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from core.config import settings
+
+
+class ChunkCache:
+    """
+    Process-wide LRU cache of aligned file chunks bounded by a byte budget.
+    A chunk is only admitted on its second request (or when it is one of the first
+    chunks of a file), so a single long sequential stream can't flush the hot set
+    """
+
+    def __init__(self, max_bytes: int, chunk_size: int, head_chunks: int):
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.head_chunks = head_chunks
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._chunks: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        # Keys requested once but not admitted yet, bounded by the chunk capacity
+        self._seen: "OrderedDict[Hashable, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes >= self.chunk_size > 0
+
+    def get(self, file_key: Hashable, chunk_index: int) -> Optional[memoryview]:
+        """Get a cached chunk as a read-only view, counting the hit or miss"""
+        key = (file_key, chunk_index)
+        with self._lock:
+            chunk = self._chunks.get(key)
+            if chunk is None:
+                self.misses += 1
+                return None
+            self._chunks.move_to_end(key)
+            self.hits += 1
+        return memoryview(chunk)
+
+    def put(self, file_key: Hashable, chunk_index: int, chunk: bytes) -> None:
+        """Offer a chunk read from disk to the cache"""
+        key = (file_key, chunk_index)
+        size = len(chunk)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            if key in self._chunks:
+                return
+            if chunk_index >= self.head_chunks and key not in self._seen:
+                self._seen[key] = None
+                while len(self._seen) > self.max_bytes // self.chunk_size:
+                    self._seen.popitem(last=False)
+                return
+
+            self._seen.pop(key, None)
+            self._chunks[key] = chunk
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._chunks.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached chunk"""
+        with self._lock:
+            self._chunks.clear()
+            self._seen.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache occupancy and hit counters"""
+        return {
+            "chunks": len(self._chunks),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "chunk_size": self.chunk_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Create a singleton instance
+chunk_cache = ChunkCache(
+    max_bytes=settings.STREAM_CACHE_MAX_BYTES,
+    chunk_size=settings.STREAM_CHUNK_SIZE,
+    head_chunks=settings.STREAM_CACHE_HEAD_CHUNKS,
+)
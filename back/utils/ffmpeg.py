@@ -0,0 +1,112 @@
+import shutil
+import subprocess
+from typing import List, Optional
+
+
+class FFmpegError(Exception):
+    """An ffmpeg run failed"""
+
+
+def is_available(ffmpeg_path: str) -> bool:
+    """Whether the ffmpeg binary can be found"""
+    return shutil.which(ffmpeg_path) is not None
+
+
+def build_rendition_command(
+    ffmpeg_path: str,
+    source_path: str,
+    output_path: str,
+    height: int,
+    video_bitrate: int,
+    audio_bitrate: int,
+    keyframe_interval: float,
+    threads: int,
+    preset: str,
+) -> List[str]:
+    """
+    Build the command encoding one rung of the ladder to a faststart H.264/AAC MP4.
+    Keyframes are forced at the same times in every rung so players can switch between them
+    at segment boundaries
+    """
+    return [
+        ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", source_path,
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-vf", f"scale=-2:{height}",
+        "-c:v", "libx264", "-preset", preset, "-profile:v", "main", "-pix_fmt", "yuv420p",
+        "-b:v", f"{video_bitrate}k",
+        "-maxrate", f"{video_bitrate * 107 // 100}k",
+        "-bufsize", f"{video_bitrate * 3 // 2}k",
+        "-force_key_frames", f"expr:gte(t,n_forced*{keyframe_interval})",
+        "-sc_threshold", "0",
+        "-c:a", "aac", "-b:a", f"{audio_bitrate}k", "-ac", "2",
+        "-threads", str(threads),
+        "-movflags", "+faststart",
+        "-f", "mp4", output_path,
+    ]
+
+
+def build_audio_rendition_command(
+    ffmpeg_path: str,
+    source_path: str,
+    output_path: str,
+    audio_bitrate: int,
+    codec: str,
+    threads: int,
+) -> List[str]:
+    """Build the command extracting the first audio track to a faststart AAC or Opus MP4"""
+    return [
+        ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        "-i", source_path,
+        "-map", "0:a:0", "-vn", "-sn",
+        "-c:a", "libopus" if codec == "opus" else "aac", "-b:a", f"{audio_bitrate}k", "-ac", "2",
+        "-threads", str(threads),
+        "-movflags", "+faststart",
+        "-f", "mp4", output_path,
+    ]
+
+
+def run(command: List[str], timeout: Optional[float] = None) -> None:
+    """Run an ffmpeg command, raising FFmpegError with its error output if it fails"""
+    try:
+        result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as error:
+        raise FFmpegError(str(error)) from error
+    if result.returncode != 0:
+        # The last lines carry the actual error
+        message = result.stderr.decode(errors="replace").strip().splitlines()[-5:]
+        raise FFmpegError("\n".join(message) or f"ffmpeg exited with status {result.returncode}")
+
+
+def build_sprite_command(
+    ffmpeg_path: str,
+    source_path: str,
+    output_pattern: str,
+    interval: float,
+    width: int,
+    height: int,
+    columns: int,
+    rows: int,
+    image_format: str,
+) -> List[str]:
+    """
+    Build the command sampling one frame every interval seconds, scaled and letterboxed
+    to width x height, and tiling them into columns x rows sprite sheets
+    """
+    codec = ["-c:v", "libwebp", "-quality", "75"] if image_format == "webp" else ["-c:v", "mjpeg", "-q:v", "5"]
+    return [
+        ffmpeg_path, "-hide_banner", "-nostdin", "-loglevel", "error", "-y",
+        # Only keyframes are decoded, which is plenty for previews and much cheaper
+        "-skip_frame", "nokey",
+        "-i", source_path,
+        "-an", "-sn",
+        "-vf", (
+            f"fps=1/{interval},"
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease,"
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2,"
+            f"tile={columns}x{rows}"
+        ),
+        "-fps_mode", "vfr",
+        *codec,
+        output_pattern,
+    ]
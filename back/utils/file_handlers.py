@@ -1,33 +1,555 @@
+import asyncio
 import os
-from typing import Tuple, AsyncGenerator
+import secrets
+import threading
+from collections import deque
+from concurrent.futures import Future
+from contextlib import aclosing
+from typing import Tuple, AsyncGenerator, Awaitable, Callable, Dict, Hashable, Iterator, List, Mapping, Optional, Set, Union
+from urllib.parse import quote
+import anyio
 from fastapi import Request
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from core.config import settings
+from utils.async_io import run_io, submit_io
+from utils.chunk_cache import chunk_cache
+from utils.pacing import Pacer
+from utils.stream_registry import ActiveStream, StreamHandoff, stream_registry
+from utils.single_flight import chunk_reads
+
+# ASGI extension that lets the server copy a file straight to the socket (os.sendfile)
+ZERO_COPY_SEND_EXTENSION = "http.response.zerocopysend"
+
+# Response header telling the front proxy to serve a file itself, by STREAM_OFFLOAD mode
+OFFLOAD_HEADERS = {"x-accel-redirect": "X-Accel-Redirect", "x-sendfile": "X-Sendfile"}
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested byte ranges overlaps the file"""
+
+    def __init__(self, file_size: int):
+        super().__init__(f"Range not satisfiable for a {file_size} byte file")
+        self.file_size = file_size
+
+
+def parse_range_header(range_header: str, file_size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse an HTTP Range header (RFC 7233) into sorted, coalesced (start, end) pairs.
+    Returns None when the header must be ignored and the full file served
+    """
+    unit, _, range_set = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or not range_set.strip():
+        return None
+
+    ranges = []
+    for range_spec in range_set.split(","):
+        range_spec = range_spec.strip()
+        if not range_spec:
+            continue
+        start_str, dash, end_str = range_spec.partition("-")
+        start_str, end_str = start_str.strip(), end_str.strip()
+        if not dash or not (start_str.isdigit() or (not start_str and end_str.isdigit())):
+            return None
+        if end_str and not end_str.isdigit():
+            return None
+
+        if not start_str:
+            # Suffix range: the last N bytes of the file
+            suffix_length = int(end_str)
+            if suffix_length == 0 or file_size == 0:
+                continue
+            start, end = max(file_size - suffix_length, 0), file_size - 1
+        else:
+            start = int(start_str)
+            if end_str and int(end_str) < start:
+                return None
+            if start >= file_size:
+                continue
+            end = min(int(end_str), file_size - 1) if end_str else file_size - 1
+        ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable(file_size)
+
+    # Merge overlapping and adjacent ranges so no byte is sent twice
+    ranges.sort()
+    coalesced = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = coalesced[-1]
+        if start <= last_end + 1:
+            coalesced[-1] = (last_start, max(last_end, end))
+        else:
+            coalesced.append((start, end))
+
+    # Too many disjoint ranges is either a broken client or an attempt to amplify work
+    if len(coalesced) > settings.STREAM_MAX_RANGES:
+        return None
+    return coalesced
+
 
 def get_range_header(range_header: str, file_size: int) -> Tuple[int, int]:
-    """Parse HTTP range header and return start and end positions"""
-    if range_header.startswith("bytes="):
-        ranges = range_header.replace("bytes=", "").split(",")
-        for range_str in ranges:
-            start_str, end_str = range_str.split("-")
-            start = int(start_str) if start_str else 0
-            end = int(end_str) if end_str else file_size - 1
-            return start, min(end, file_size - 1)
-    return 0, file_size - 1
-
-async def ranged_file_sender(file_path: str, start: int, end: int) -> AsyncGenerator[bytes, None]:
-    """Send a file in chunks with support for range requests"""
-    with open(file_path, "rb") as video_file:
-        video_file.seek(start)
-        chunk_size = 1024 * 1024  # 1MB chunks
-        remaining = end - start + 1
-        while remaining > 0:
-            chunk = video_file.read(min(chunk_size, remaining))
-            if not chunk:
+    """Parse HTTP range header and return start and end positions of the first range"""
+    ranges = parse_range_header(range_header, file_size)
+    if not ranges:
+        return 0, file_size - 1
+    return ranges[0]
+
+class SharedFile:
+    """
+    File descriptor shared by every concurrent reader of the same file.
+    Opened on first use and closed once it is retired and the last reader is done
+    """
+
+    def __init__(self, path: str, cache_key: Optional[Hashable] = None):
+        self.path = path
+        # Identifies this exact file version in the chunk cache, None to bypass the cache
+        self.cache_key = cache_key
+        self._fd: Optional[int] = None
+        self._readers = 0
+        self._retired = False
+        self._lock = threading.Lock()
+
+    def acquire(self) -> int:
+        """Register a reader and return the descriptor, opening it if needed"""
+        with self._lock:
+            if self._fd is None:
+                self._fd = os.open(self.path, os.O_RDONLY)
+            self._readers += 1
+            return self._fd
+
+    def release(self) -> None:
+        """Unregister a reader, closing the descriptor if it is no longer needed"""
+        with self._lock:
+            self._readers -= 1
+            self._close_if_unused()
+
+    def retire(self) -> None:
+        """Close the descriptor as soon as the current readers are done"""
+        with self._lock:
+            self._retired = True
+            self._close_if_unused()
+
+    def _close_if_unused(self) -> None:
+        if self._retired and self._readers == 0 and self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _as_shared_file(file: Union[str, SharedFile]) -> SharedFile:
+    """Wrap a plain path in a SharedFile private to a single reader"""
+    if isinstance(file, SharedFile):
+        return file
+    shared = SharedFile(file)
+    shared.retire()
+    return shared
+
+
+def _plan_reads(shared: SharedFile, start: int, end: int) -> Iterator[Tuple[int, int, Optional[int]]]:
+    """
+    Split a byte range into (offset, size, chunk_index) reads. Shareable files are read
+    in whole aligned chunks so concurrent and later viewers can reuse them, others read exactly the range
+    """
+    if shared.cache_key is not None:
+        chunk_size = chunk_cache.chunk_size
+        for chunk_index in range(start // chunk_size, end // chunk_size + 1):
+            yield chunk_index * chunk_size, chunk_size, chunk_index
+        return
+
+    chunk_size = settings.STREAM_CHUNK_SIZE
+    offset = start
+    while offset <= end:
+        size = min(chunk_size, end + 1 - offset)
+        yield offset, size, None
+        offset += size
+
+
+def _release_when_done(shared: SharedFile, reads: Set["Future[bytes]"]) -> None:
+    """
+    Release a reader of shared once its reads on the I/O pool returned. A cancelled
+    read keeps running in its thread, closing the descriptor under it could hit a reused fd
+    """
+    remaining = [read for read in reads if not read.done()]
+    if not remaining:
+        shared.release()
+        return
+
+    lock = threading.Lock()
+    count = [len(remaining)]
+
+    def read_done(_):
+        with lock:
+            count[0] -= 1
+            last = count[0] == 0
+        if last:
+            shared.release()
+
+    for read in remaining:
+        read.add_done_callback(read_done)
+
+
+async def _read_chunk(
+    shared: SharedFile, read: Callable[[int, int], Awaitable[bytes]], offset: int, size: int, chunk_index: Optional[int]
+) -> bytes:
+    """Read a planned chunk, from the chunk cache or an identical read already in flight when possible"""
+    if chunk_index is None:
+        return await read(offset, size)
+
+    cached = chunk_cache.get(shared.cache_key, chunk_index)
+    if cached is not None:
+        return cached
+
+    async def load() -> bytes:
+        # Coalesced callers wait on this read, so it holds the file itself instead of borrowing the first caller's
+        fd = await run_io(shared.acquire)
+        io_read = submit_io(os.pread, fd, size, offset)
+        try:
+            chunk = await asyncio.wrap_future(io_read)
+        finally:
+            _release_when_done(shared, {io_read})
+        chunk_cache.put(shared.cache_key, chunk_index, chunk)
+        return chunk
+
+    return await chunk_reads.do((shared.cache_key, chunk_index), load)
+
+
+async def ranged_file_sender(
+    file: Union[str, SharedFile], start: int, end: int
+) -> AsyncGenerator[Union[bytes, memoryview], None]:
+    """Send a file in chunks with support for range requests, reading ahead on the I/O pool"""
+    shared = _as_shared_file(file)
+    fd = await run_io(shared.acquire)
+    planned = _plan_reads(shared, start, end)
+    pending = deque()
+    # Reads of the descriptor on the I/O pool, tracked past a cancel until their pread returned
+    io_reads: Set["Future[bytes]"] = set()
+
+    def read(offset: int, size: int) -> "asyncio.Future[bytes]":
+        io_read = submit_io(os.pread, fd, size, offset)
+        io_reads.add(io_read)
+        return asyncio.wrap_future(io_read)
+
+    def schedule_reads():
+        # Keep the current chunk plus the configured number of read-ahead chunks in flight
+        while len(pending) <= settings.STREAM_READ_AHEAD_CHUNKS:
+            planned_read = next(planned, None)
+            if planned_read is None:
                 break
-            remaining -= len(chunk)
-            yield chunk
+            offset, size, chunk_index = planned_read
+            pending.append((asyncio.ensure_future(_read_chunk(shared, read, offset, size, chunk_index)), offset, size))
+        io_reads.difference_update([io_read for io_read in io_reads if io_read.done()])
+
+    try:
+        schedule_reads()
+        while pending:
+            chunk_read, offset, size = pending[0]
+            chunk = await chunk_read
+            pending.popleft()
+            schedule_reads()
+
+            # Aligned chunks may extend past either end of the requested range
+            low = max(start - offset, 0)
+            high = min(end + 1 - offset, len(chunk))
+            if high > low:
+                yield chunk if low == 0 and high == len(chunk) else memoryview(chunk)[low:high]
+            if len(chunk) < size and offset + len(chunk) <= end:
+                # The file shrank underneath us
+                break
+    finally:
+        # Reads not started are dropped, the ones in flight hold on to the descriptor until their pread returned
+        for chunk_read, _, _ in pending:
+            chunk_read.cancel()
+        _release_when_done(shared, io_reads)
 
 async def file_sender(file_path: str) -> AsyncGenerator[bytes, None]:
-    """Send a complete file in one chunk"""
-    with open(file_path, "rb") as video_file:
-        data = video_file.read()
-        yield data
+    """Send a complete file in bounded chunks"""
+    file_size = (await run_io(os.stat, file_path)).st_size
+    async for chunk in ranged_file_sender(file_path, 0, file_size - 1):
+        yield chunk
+
+
+class FileRangeResponse(Response):
+    """
+    Response that sends a byte range of a file without copying it through Python
+    when the ASGI server supports zero-copy send, falling back to bounded reads otherwise
+    """
+
+    def __init__(
+        self,
+        file: Union[str, SharedFile],
+        start: int,
+        end: int,
+        status_code: int = 200,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: Optional[str] = None,
+        pacer: Optional[Pacer] = None,
+        stream: Optional[ActiveStream] = None,
+    ) -> None:
+        self.file = file
+        self.start = start
+        self.end = end
+        self.status_code = status_code
+        self.media_type = media_type
+        self.pacer = pacer
+        self.stream = stream
+        self.background = None
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope["method"] == "HEAD" or self.end < self.start:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async def send_body() -> None:
+            await send_file_range(
+                scope, send, self.file, self.start, self.end, more_body=False, pacer=self.pacer, stream=self.stream)
+
+        await _send_until_disconnect(receive, send_body, self.end - self.start + 1, self.pacer, self.stream)
+
+
+class MultipartFileRangeResponse(Response):
+    """Response that sends several byte ranges of a file as multipart/byteranges"""
+
+    def __init__(
+        self,
+        file: Union[str, SharedFile],
+        file_size: int,
+        ranges: List[Tuple[int, int]],
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: str = "application/octet-stream",
+        pacer: Optional[Pacer] = None,
+        stream: Optional[ActiveStream] = None,
+    ) -> None:
+        self.file = file
+        self.ranges = ranges
+        self.pacer = pacer
+        self.stream = stream
+        self.status_code = 206
+        self.background = None
+        boundary = secrets.token_hex(16)
+        self.media_type = f"multipart/byteranges; boundary={boundary}"
+
+        self.part_headers = [
+            (
+                f"--{boundary}\r\n"
+                f"Content-Type: {media_type}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n"
+            ).encode("latin-1")
+            for start, end in ranges
+        ]
+        self.closing = f"--{boundary}--\r\n".encode("latin-1")
+        content_length = sum(len(part) + 2 for part in self.part_headers) + len(self.closing)
+        self.range_bytes = sum(end - start + 1 for start, end in ranges)
+        content_length += self.range_bytes
+
+        headers = dict(headers or {})
+        headers["Content-Length"] = str(content_length)
+        self.init_headers(headers)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            "type": "http.response.start",
+            "status": self.status_code,
+            "headers": self.raw_headers,
+        })
+
+        if scope["method"] == "HEAD":
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        async def send_body() -> None:
+            for part_header, (start, end) in zip(self.part_headers, self.ranges):
+                await send({"type": "http.response.body", "body": part_header, "more_body": True})
+                await send_file_range(
+                    scope, send, self.file, start, end, more_body=True, pacer=self.pacer, stream=self.stream)
+                await send({"type": "http.response.body", "body": b"\r\n", "more_body": True})
+            await send({"type": "http.response.body", "body": self.closing, "more_body": False})
+
+        # Only file bytes are accounted, part headers are negligible
+        await _send_until_disconnect(receive, send_body, self.range_bytes, self.pacer, self.stream)
+
+
+async def _send_until_disconnect(
+    receive: Receive,
+    send_body: Callable[[], Awaitable[None]],
+    body_bytes: int,
+    pacer: Optional[Pacer],
+    stream: Optional[ActiveStream],
+) -> None:
+    """
+    Send a response body while listening for the client going away. A disconnect cancels
+    the body at once, so reads and read-ahead stop instead of running until the next send fails
+    """
+    if stream is not None:
+        stream_registry.open(stream, body_bytes)
+    try:
+        async with anyio.create_task_group() as task_group:
+            async def run_body() -> None:
+                try:
+                    await send_body()
+                except StreamHandoff:
+                    # The response ends short, the player resumes the range from another worker
+                    pass
+                task_group.cancel_scope.cancel()
+
+            async def listen_for_disconnect() -> None:
+                while (await receive())["type"] != "http.disconnect":
+                    pass
+                task_group.cancel_scope.cancel()
+
+            task_group.start_soon(run_body)
+            task_group.start_soon(listen_for_disconnect)
+    finally:
+        if pacer is not None:
+            pacer.close()
+        if stream is not None:
+            stream_registry.close(stream)
+
+
+async def send_file_range(
+    scope: Scope,
+    send: Send,
+    file: Union[str, SharedFile],
+    start: int,
+    end: int,
+    more_body: bool,
+    pacer: Optional[Pacer] = None,
+    stream: Optional[ActiveStream] = None,
+) -> None:
+    """
+    Send a byte range of a file as response body, zero-copy when the server allows it.
+    A paced range is sent in chunks, each one waiting for the pacer
+    """
+    if ZERO_COPY_SEND_EXTENSION in scope.get("extensions", {}):
+        shared = _as_shared_file(file)
+        fd = await run_io(shared.acquire)
+        # Unpaced ranges are handed to the server in a single send
+        piece_size = settings.STREAM_CHUNK_SIZE if pacer is not None else end - start + 1
+        try:
+            with open(fd, "rb", closefd=False) as video_file:
+                for offset in range(start, end + 1, piece_size):
+                    count = min(piece_size, end + 1 - offset)
+                    if pacer is not None:
+                        await pacer.pace(count)
+                    await send({
+                        "type": ZERO_COPY_SEND_EXTENSION,
+                        "file": video_file,
+                        "offset": offset,
+                        "count": count,
+                        "more_body": more_body or offset + count <= end,
+                    })
+                    if stream is not None:
+                        stream.record(count)
+                        if stream.handoff_due():
+                            raise StreamHandoff()
+        finally:
+            shared.release()
+        return
+
+    # Closed explicitly so a cancelled send stops reading right away
+    async with aclosing(ranged_file_sender(file, start, end)) as chunks:
+        async for chunk in chunks:
+            if pacer is not None:
+                await pacer.pace(len(chunk))
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            if stream is not None:
+                stream.record(len(chunk))
+                if stream.handoff_due():
+                    raise StreamHandoff()
+    if not more_body:
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def build_file_response(
+    file: Union[str, SharedFile],
+    file_size: int,
+    range_header: Optional[str],
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    pacer: Optional[Pacer] = None,
+    stream: Optional[ActiveStream] = None,
+) -> Response:
+    """
+    Build a full, single-range, multi-range or 416 response for a file, optionally paced.
+    A stream is registered as active while the body is sent
+    """
+    headers = {"Accept-Ranges": "bytes", **(headers or {})}
+
+    try:
+        ranges = parse_range_header(range_header, file_size) if range_header else None
+    except RangeNotSatisfiable:
+        return Response(
+            status_code=416,
+            headers={**headers, "Content-Range": f"bytes */{file_size}"},
+        )
+
+    if not ranges:
+        # No range header, return full file
+        return FileRangeResponse(
+            file,
+            0,
+            file_size - 1,
+            media_type=media_type,
+            headers={**headers, "Content-Length": str(file_size)},
+            pacer=pacer,
+            stream=stream,
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return FileRangeResponse(
+            file,
+            start,
+            end,
+            status_code=206,
+            media_type=media_type,
+            headers={
+                **headers,
+                "Content-Range": f"bytes {start}-{end}/{file_size}",
+                "Content-Length": str(end - start + 1),
+            },
+            pacer=pacer,
+            stream=stream,
+        )
+
+    return MultipartFileRangeResponse(file, file_size, ranges, headers=headers, media_type=media_type, pacer=pacer, stream=stream)
+
+
+def offload_enabled() -> bool:
+    """Whether file bodies are served by the front proxy instead of this worker"""
+    return settings.STREAM_OFFLOAD in OFFLOAD_HEADERS
+
+
+def build_offload_response(
+    path: str,
+    media_type: str,
+    headers: Optional[Dict[str, str]] = None,
+    limit_rate: Optional[int] = None,
+) -> Response:
+    """
+    Build an empty response pointing the front proxy at a file, which then serves it
+    (ranges included) without the bytes going through Python. nginx gets the file's URI
+    under the internal STREAM_OFFLOAD_PREFIX location, X-Sendfile servers its absolute path.
+
+    The proxy answers with its own validators: nginx drops the upstream ETag and Last-Modified
+    of an X-Accel-Redirect and sends the ones of its static module, which doesn't know our ETag.
+    Conditional GETs are answered before offloading, but If-Range is evaluated by the proxy,
+    so callers serve Range requests carrying If-Range from Python instead
+    """
+    if settings.STREAM_OFFLOAD == "x-accel-redirect":
+        relative_path = os.path.relpath(path, settings.UPLOAD_DIR).replace(os.sep, "/")
+        location = f"{settings.STREAM_OFFLOAD_PREFIX.rstrip('/')}/{quote(relative_path)}"
+    else:
+        location = os.path.abspath(path)
+
+    headers = {**(headers or {}), OFFLOAD_HEADERS[settings.STREAM_OFFLOAD]: location}
+    if limit_rate is not None and settings.STREAM_OFFLOAD == "x-accel-redirect":
+        # nginx paces the response itself
+        headers["X-Accel-Limit-Rate"] = str(limit_rate)
+    return Response(status_code=200, headers=headers, media_type=media_type)
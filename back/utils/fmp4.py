@@ -0,0 +1,180 @@
+import math
+import os
+import struct
+from bisect import bisect_left
+from typing import List, Optional, Tuple
+
+from utils.mp4 import BoxNode, MP4Error, read_moov
+from utils.mp4_index import SampleIndex, TrackIndex
+
+# trun flags: data offset, then per sample duration, size, flags and composition offset
+TRUN_FLAGS = 0x000001 | 0x000100 | 0x000200 | 0x000400 | 0x000800
+# tfhd flag: sample data offsets are relative to the moof box
+TFHD_DEFAULT_BASE_IS_MOOF = 0x020000
+# Sample flags: a sync sample depends on nothing, any other sample is a non-sync dependent one
+SYNC_SAMPLE_FLAGS = 0x02000000
+NON_SYNC_SAMPLE_FLAGS = 0x01010000
+
+# Boxes of a track that describe the samples themselves, not needed in a fragmented init segment
+SAMPLE_TABLE_BOXES = {b"stts", b"ctts", b"stss", b"stsc", b"stsz", b"stz2", b"stco", b"co64", b"sdtp", b"sgpd", b"sbgp"}
+
+
+class Segment:
+    """A run of samples starting at a keyframe, one sample range per track"""
+
+    def __init__(self, number: int, start: float, duration: float, sample_ranges: List[Tuple[int, int]]):
+        self.number = number
+        self.start = start
+        self.duration = duration
+        self.sample_ranges = sample_ranges
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+
+def _full_box(box_type: bytes, version: int, flags: int, payload: bytes) -> bytes:
+    return _box(box_type, struct.pack(">I", (version << 24) | flags) + payload)
+
+
+def _first_sample_at_or_after(track: TrackIndex, seconds: float) -> int:
+    return bisect_left(track.decode_times, round(seconds * track.timescale))
+
+
+def plan_segments(index: SampleIndex, target_duration: float) -> List[Segment]:
+    """
+    Cut a movie into segments of at least target_duration seconds. Cuts are made at the
+    keyframes of the video track (or the first track of an audio-only file), and every
+    other track is cut at the same times
+    """
+    reference = index.video_track or (index.tracks[0] if index.tracks else None)
+    if reference is None or not reference.sample_count:
+        return []
+
+    cuts = [0]
+    for sample in reference.sync_samples:
+        if sample and reference.time_of(sample) - reference.time_of(cuts[-1]) >= target_duration:
+            cuts.append(sample)
+    times = [reference.time_of(sample) for sample in cuts]
+    # The first segment also carries any sample of the other tracks that starts before the first cut
+    times[0] = 0.0
+
+    segments = []
+    for number, start in enumerate(times):
+        is_last = number + 1 == len(times)
+        end = reference.duration if is_last else times[number + 1]
+        sample_ranges = []
+        for track in index.tracks:
+            first = _first_sample_at_or_after(track, start) if number else 0
+            last = track.sample_count if is_last else _first_sample_at_or_after(track, end)
+            sample_ranges.append((first, last))
+        segments.append(Segment(number, start, end - start, sample_ranges))
+    return segments
+
+
+def build_init_segment(path: str, index: SampleIndex) -> bytes:
+    """
+    Build the initialization segment of a fragmented MP4: the movie header of the source
+    file with its sample tables emptied, and a trex box per track
+    """
+    moov = read_moov(path)
+
+    for stbl in (node for node in moov.walk() if node.type == b"stbl"):
+        stbl.children = [child for child in stbl.children if child.type not in SAMPLE_TABLE_BOXES] + [
+            BoxNode(b"stts", payload=struct.pack(">II", 0, 0)),
+            BoxNode(b"stsc", payload=struct.pack(">II", 0, 0)),
+            BoxNode(b"stsz", payload=struct.pack(">III", 0, 0, 0)),
+            BoxNode(b"stco", payload=struct.pack(">II", 0, 0)),
+        ]
+    moov.children = [child for child in moov.children if child.type != b"mvex"]
+    moov.children.append(BoxNode(b"mvex", children=[
+        BoxNode(b"trex", payload=struct.pack(">IIIIII", 0, track.track_id, 1, 0, 0, 0))
+        for track in index.tracks
+    ]))
+
+    ftyp = _box(b"ftyp", b"iso6" + struct.pack(">I", 0) + b"iso6mp41")
+    return ftyp + moov.serialize()
+
+
+def _read_samples(fd: int, track: TrackIndex, first: int, last: int) -> bytes:
+    """Read the data of a run of samples, one read per contiguous byte run"""
+    parts = []
+    sample = first
+    while sample < last:
+        run_start = track.offsets[sample]
+        run_end = run_start + track.sizes[sample]
+        sample += 1
+        while sample < last and track.offsets[sample] == run_end:
+            run_end += track.sizes[sample]
+            sample += 1
+        data = os.pread(fd, run_end - run_start, run_start)
+        if len(data) != run_end - run_start:
+            raise MP4Error("Sample data beyond the end of the file")
+        parts.append(data)
+    return b"".join(parts)
+
+
+def _traf(track: TrackIndex, first: int, last: int, data_offset: int) -> bytes:
+    entries = []
+    for sample in range(first, last):
+        flags = SYNC_SAMPLE_FLAGS if track.sync[sample] else NON_SYNC_SAMPLE_FLAGS
+        entries.append(struct.pack(">IIIi", track.durations[sample], track.sizes[sample], flags,
+                                   track.composition_offsets[sample]))
+    tfhd = _full_box(b"tfhd", 0, TFHD_DEFAULT_BASE_IS_MOOF, struct.pack(">I", track.track_id))
+    tfdt = _full_box(b"tfdt", 1, 0, struct.pack(">Q", track.decode_times[first]))
+    # Version 1 so that composition offsets are signed
+    trun = _full_box(b"trun", 1, TRUN_FLAGS, struct.pack(">Ii", last - first, data_offset) + b"".join(entries))
+    return _box(b"traf", tfhd + tfdt + trun)
+
+
+def build_media_segment(fd: int, index: SampleIndex, segment: Segment) -> bytes:
+    """Remux the samples of a segment into a moof and mdat pair, without touching the media data"""
+    runs = [(track, first, last) for track, (first, last) in zip(index.tracks, segment.sample_ranges) if last > first]
+    mfhd = _full_box(b"mfhd", 0, 0, struct.pack(">I", segment.number + 1))
+
+    # Every track's data follows the previous one in the mdat, offsets are relative to the moof
+    moof_size = 8 + len(mfhd) + sum(len(_traf(track, first, last, 0)) for track, first, last in runs)
+    data_offset = moof_size + 8
+    trafs = []
+    for track, first, last in runs:
+        trafs.append(_traf(track, first, last, data_offset))
+        data_offset += sum(track.sizes[first:last])
+
+    mdat = b"".join(_read_samples(fd, track, first, last) for track, first, last in runs)
+    return _box(b"moof", mfhd + b"".join(trafs)) + _box(b"mdat", mdat)
+
+
+def build_media_playlist(segments: List[Segment], init_uri: str, segment_uri: str) -> str:
+    """Build an HLS VOD media playlist, segment_uri is formatted with the segment number"""
+    target_duration = max((math.ceil(segment.duration) for segment in segments), default=1)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-INDEPENDENT-SEGMENTS",
+        f'#EXT-X-MAP:URI="{init_uri}"',
+    ]
+    for segment in segments:
+        lines.append(f"#EXTINF:{segment.duration:.3f},")
+        lines.append(segment_uri.format(segment.number))
+    lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+def build_master_playlist(variants: List[Tuple[str, int, Optional[Tuple[int, int]], Optional[str]]]) -> str:
+    """
+    Build an HLS master playlist from (uri, bandwidth in bit/s, (width, height) or None,
+    RFC 6381 codecs or None) variants
+    """
+    lines = ["#EXTM3U", "#EXT-X-VERSION:7", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for uri, bandwidth, resolution, codecs in sorted(variants, key=lambda variant: -variant[1]):
+        attributes = f"BANDWIDTH={max(bandwidth, 1)}"
+        if resolution:
+            attributes += f",RESOLUTION={resolution[0]}x{resolution[1]}"
+        if codecs:
+            attributes += f',CODECS="{codecs}"'
+        lines.append(f"#EXT-X-STREAM-INF:{attributes}")
+        lines.append(uri)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,55 @@
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Mapping, Optional
+
+
+def make_etag(size: int, mtime: float) -> str:
+    """Build a strong ETag from a file's size and modification time"""
+    return f'"{int(mtime * 1_000_000):x}-{size:x}"'
+
+
+def format_http_date(timestamp: float) -> str:
+    """Format a UNIX timestamp as an HTTP date"""
+    return formatdate(timestamp, usegmt=True)
+
+
+def parse_http_date(value: str) -> Optional[float]:
+    """Parse an HTTP date into a UNIX timestamp, None if it is not a valid date"""
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def validator_headers(etag: str, mtime: float) -> Dict[str, str]:
+    """Headers that let clients and caches revalidate a file"""
+    return {"ETag": etag, "Last-Modified": format_http_date(mtime)}
+
+
+def is_not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Check If-None-Match / If-Modified-Since to decide whether a 304 can be sent"""
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence and uses weak comparison
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since is not None:
+        since = parse_http_date(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def if_range_matches(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """Check If-Range, a Range header must be ignored when the representation changed"""
+    if_range = request_headers.get("if-range")
+    if if_range is None:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Strong comparison, a weak validator never matches
+        return if_range == etag
+
+    since = parse_http_date(if_range)
+    return since is not None and int(mtime) == since
@@ -0,0 +1,239 @@
+import os
+import struct
+from typing import BinaryIO, Callable, Iterator, List, Optional
+
+# Boxes whose payload is only a list of child boxes
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"mvex", b"moof", b"traf"}
+
+COPY_BUFFER_SIZE = 1024 * 1024
+# Largest chunk offset an stco table holds, larger ones need co64
+STCO_MAX_OFFSET = 0xFFFFFFFF
+
+
+class MP4Error(Exception):
+    """The file is not a well-formed MP4 / ISO BMFF file"""
+
+
+class Box:
+    """A box (atom) of an MP4 file, located by its offset and size in the file"""
+
+    def __init__(self, box_type: bytes, offset: int, size: int, header_size: int):
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def payload_size(self) -> int:
+        return self.size - self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+    def __repr__(self) -> str:
+        return f"Box({self.type!r}, offset={self.offset}, size={self.size})"
+
+
+def iter_boxes(f: BinaryIO, start: int, end: int) -> Iterator[Box]:
+    """Iterate over the boxes laid out between start and end of a file"""
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        size, box_type = struct.unpack(">I4s", f.read(8))
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", f.read(8))[0]
+            header_size = 16
+        elif size == 0:
+            # The last box extends to the end of the file
+            size = end - offset
+        if size < header_size or offset + size > end:
+            raise MP4Error(f"Invalid size for box {box_type!r} at offset {offset}")
+        yield Box(box_type, offset, size, header_size)
+        offset += size
+
+
+def read_top_level_boxes(path: str) -> List[Box]:
+    """List the top-level boxes of an MP4 file"""
+    with open(path, "rb") as f:
+        file_size = os.fstat(f.fileno()).st_size
+        boxes = list(iter_boxes(f, 0, file_size))
+    if not boxes or boxes[0].type not in (b"ftyp", b"styp"):
+        raise MP4Error("Missing ftyp box")
+    return boxes
+
+
+def is_faststart(boxes: List[Box]) -> bool:
+    """Whether the movie header (moov) comes before the media data (mdat)"""
+    for box in boxes:
+        if box.type == b"moov":
+            return True
+        if box.type == b"mdat":
+            return False
+    return False
+
+
+# In-memory box tree, used to rewrite the movie header
+
+class BoxNode:
+    """A parsed box, either a container with children or a leaf with its raw payload"""
+
+    def __init__(self, box_type: bytes, payload: bytes = b"", children: Optional[List["BoxNode"]] = None):
+        self.type = box_type
+        self.payload = payload
+        self.children = children
+
+    def find(self, box_type: bytes) -> Optional["BoxNode"]:
+        """First direct child of the given type"""
+        for child in self.children or []:
+            if child.type == box_type:
+                return child
+        return None
+
+    def find_all(self, box_type: bytes) -> List["BoxNode"]:
+        """All direct children of the given type"""
+        return [child for child in self.children or [] if child.type == box_type]
+
+    def walk(self) -> Iterator["BoxNode"]:
+        """This box and all its descendants, depth first"""
+        yield self
+        for child in self.children or []:
+            yield from child.walk()
+
+    def serialize(self) -> bytes:
+        if self.children is not None:
+            payload = b"".join(child.serialize() for child in self.children)
+        else:
+            payload = self.payload
+        size = len(payload) + 8
+        if size > 0xFFFFFFFF:
+            return struct.pack(">I4sQ", 1, self.type, size + 8) + payload
+        return struct.pack(">I4s", size, self.type) + payload
+
+
+def parse_box_tree(data: bytes, box_type: bytes) -> BoxNode:
+    """Parse the payload of a box into a tree, descending into known containers"""
+    if box_type not in CONTAINER_BOXES:
+        return BoxNode(box_type, payload=data)
+
+    children = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, child_type = struct.unpack_from(">I4s", data, offset)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, offset + 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header_size or offset + size > len(data):
+            raise MP4Error(f"Invalid size for box {child_type!r} inside {box_type!r}")
+        children.append(parse_box_tree(data[offset + header_size:offset + size], child_type))
+        offset += size
+    return BoxNode(box_type, children=children)
+
+
+def read_box_tree(path: str, box: Box) -> BoxNode:
+    """Read and parse a top-level box of a file"""
+    with open(path, "rb") as f:
+        f.seek(box.payload_offset)
+        return parse_box_tree(f.read(box.payload_size), box.type)
+
+
+def read_moov(path: str) -> BoxNode:
+    """Read and parse the movie header (moov box) of a file"""
+    moov_box = next((box for box in read_top_level_boxes(path) if box.type == b"moov"), None)
+    if moov_box is None:
+        raise MP4Error("Missing moov box")
+    return read_box_tree(path, moov_box)
+
+
+def _shift_chunk_offsets(moov: BoxNode, shift: Callable[[int], int]) -> None:
+    """Rewrite every stco/co64 table, upgrading stco to co64 when an offset no longer fits"""
+    for stbl in (node for node in moov.walk() if node.type == b"stbl"):
+        for index, table in enumerate(stbl.children):
+            if table.type not in (b"stco", b"co64"):
+                continue
+            version_flags, count = struct.unpack_from(">II", table.payload, 0)
+            item = "I" if table.type == b"stco" else "Q"
+            offsets = [shift(offset) for offset in struct.unpack_from(f">{count}{item}", table.payload, 8)]
+            box_type = table.type
+            if box_type == b"stco" and offsets and max(offsets) > STCO_MAX_OFFSET:
+                box_type, item = b"co64", "Q"
+            payload = struct.pack(f">II{count}{item}", version_flags, count, *offsets)
+            stbl.children[index] = BoxNode(box_type, payload=payload)
+
+
+def make_faststart(path: str, output_path: str) -> bool:
+    """
+    Write a copy of an MP4 file with the moov box moved in front of the first mdat box,
+    fixing up chunk offsets. Returns False, writing nothing, when the file already is faststart
+    """
+    boxes = read_top_level_boxes(path)
+    if is_faststart(boxes):
+        return False
+
+    moov_box = next((box for box in boxes if box.type == b"moov"), None)
+    if moov_box is None:
+        raise MP4Error("Missing moov box")
+    first_mdat = next(box for box in boxes if box.type == b"mdat")
+    insert_at = first_mdat.offset
+
+    moov_size = moov_box.size
+    # Converting stco to co64 grows the moov, which moves the data again, so repeat until stable
+    while True:
+        moov = read_box_tree(path, moov_box)
+        delta = moov_size
+
+        def shift(offset: int) -> int:
+            # Data between the new and the old moov position moves by the new moov size,
+            # data past the old moov only by how much the moov grew
+            if insert_at <= offset < moov_box.offset:
+                return offset + delta
+            elif offset >= moov_box.offset + moov_box.size:
+                return offset + (delta - moov_box.size)
+            return offset
+
+        _shift_chunk_offsets(moov, shift)
+        moov_data = moov.serialize()
+        if len(moov_data) == moov_size:
+            break
+        moov_size = len(moov_data)
+
+    with open(path, "rb") as src, open(output_path, "wb") as dst:
+        for box in boxes:
+            if box is first_mdat:
+                dst.write(moov_data)
+            if box is moov_box:
+                continue
+            src.seek(box.offset)
+            remaining = box.size
+            while remaining > 0:
+                data = src.read(min(COPY_BUFFER_SIZE, remaining))
+                if not data:
+                    raise MP4Error("Unexpected end of file")
+                dst.write(data)
+                remaining -= len(data)
+    return True
+
+
+def normalize_faststart(path: str) -> bool:
+    """
+    Rewrite an MP4 file in place with its moov box in front of the media data.
+    Returns False, leaving the file untouched, when it already is faststart
+    """
+    temp_path = f"{path}.faststart"
+    try:
+        if not make_faststart(path, temp_path):
+            return False
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return True
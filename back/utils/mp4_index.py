@@ -0,0 +1,295 @@
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+from typing import BinaryIO, List, Optional, Tuple
+
+from utils.mp4 import BoxNode, MP4Error, read_moov
+
+SIDECAR_MAGIC = b"VIDX"
+SIDECAR_VERSION = 1
+
+# Per-sample columns of a track and their array type codes
+SAMPLE_COLUMNS = (
+    ("offsets", "Q"),
+    ("sizes", "I"),
+    ("decode_times", "Q"),
+    ("durations", "I"),
+    ("composition_offsets", "i"),
+    ("sync", "B"),
+)
+
+
+class TrackIndex:
+    """Sample table of one track, flattened into packed per-sample arrays"""
+
+    def __init__(self, track_id: int, handler: bytes, timescale: int):
+        self.track_id = track_id
+        self.handler = handler
+        self.timescale = timescale
+        self.offsets = array("Q")
+        self.sizes = array("I")
+        self.decode_times = array("Q")
+        self.durations = array("I")
+        self.composition_offsets = array("i")
+        self.sync = array("B")
+        self._sync_samples: Optional[array] = None
+
+    @property
+    def sample_count(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def is_video(self) -> bool:
+        return self.handler == b"vide"
+
+    @property
+    def is_audio(self) -> bool:
+        return self.handler == b"soun"
+
+    @property
+    def duration(self) -> float:
+        """Track duration in seconds"""
+        if not self.sample_count:
+            return 0.0
+        return (self.decode_times[-1] + self.durations[-1]) / self.timescale
+
+    @property
+    def sync_samples(self) -> array:
+        """Indices of the samples a decoder can start from"""
+        if self._sync_samples is None:
+            self._sync_samples = array("I", (i for i, is_sync in enumerate(self.sync) if is_sync))
+        return self._sync_samples
+
+    def sample_at(self, seconds: float) -> int:
+        """Index of the sample being presented (in decode order) at a time"""
+        position = bisect_right(self.decode_times, int(seconds * self.timescale)) - 1
+        return min(max(position, 0), self.sample_count - 1)
+
+    def keyframe_at(self, seconds: float) -> int:
+        """Index of the last sync sample at or before a time"""
+        sample = self.sample_at(seconds)
+        sync_samples = self.sync_samples
+        position = bisect_right(sync_samples, sample) - 1
+        return sync_samples[max(position, 0)] if sync_samples else 0
+
+    def time_of(self, sample: int) -> float:
+        """Decode time of a sample in seconds"""
+        return self.decode_times[sample] / self.timescale
+
+
+class SampleIndex:
+    """Sample tables of every track of an MP4 file, tied to the exact file version they describe"""
+
+    def __init__(self, tracks: List[TrackIndex], source_size: int, source_mtime_ns: int):
+        self.tracks = tracks
+        self.source_size = source_size
+        self.source_mtime_ns = source_mtime_ns
+
+    @property
+    def video_track(self) -> Optional[TrackIndex]:
+        return next((track for track in self.tracks if track.is_video), None)
+
+    @property
+    def audio_track(self) -> Optional[TrackIndex]:
+        return next((track for track in self.tracks if track.is_audio), None)
+
+    @property
+    def duration(self) -> float:
+        return max((track.duration for track in self.tracks), default=0.0)
+
+    def matches(self, size: int, mtime: float) -> bool:
+        """Whether the index still describes the file with this size and mtime"""
+        # st_mtime is a float, compare at microsecond precision
+        return self.source_size == size and abs(self.source_mtime_ns / 1_000_000_000 - mtime) < 1e-6
+
+    def seek(self, seconds: float) -> Optional[Tuple[float, int]]:
+        """
+        Map a time to (keyframe time, first byte) so that every track can start decoding
+        from the video keyframe (or audio sample of an audio-only file) at or before that time
+        """
+        reference = self.video_track or (self.tracks[0] if self.tracks else None)
+        if reference is None or not reference.sample_count:
+            return None
+        keyframe = reference.keyframe_at(seconds)
+        keyframe_time = reference.time_of(keyframe)
+
+        first_byte = reference.offsets[keyframe]
+        for track in self.tracks:
+            if track is not reference and track.sample_count:
+                first_byte = min(first_byte, track.offsets[track.sample_at(keyframe_time)])
+        return keyframe_time, first_byte
+
+    def save(self, path: str) -> None:
+        """Write the index to a packed binary sidecar file"""
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(struct.pack("<4sHHQQ", SIDECAR_MAGIC, SIDECAR_VERSION, len(self.tracks),
+                                self.source_size, self.source_mtime_ns))
+            for track in self.tracks:
+                f.write(struct.pack("<I4sII", track.track_id, track.handler, track.timescale, track.sample_count))
+                for name, _ in SAMPLE_COLUMNS:
+                    _write_array(f, getattr(track, name))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SampleIndex":
+        """Read an index from its sidecar file"""
+        with open(path, "rb") as f:
+            magic, version, track_count, source_size, source_mtime_ns = struct.unpack("<4sHHQQ", f.read(24))
+            if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+                raise MP4Error(f"Unsupported sample index file {path}")
+            tracks = []
+            for _ in range(track_count):
+                track_id, handler, timescale, sample_count = struct.unpack("<I4sII", f.read(16))
+                track = TrackIndex(track_id, handler, timescale)
+                for name, type_code in SAMPLE_COLUMNS:
+                    setattr(track, name, _read_array(f, type_code, sample_count))
+                tracks.append(track)
+        return cls(tracks, source_size, source_mtime_ns)
+
+    @classmethod
+    def build(cls, path: str) -> "SampleIndex":
+        """Build the index of an MP4 file from its stbl sample tables"""
+        stat = os.stat(path)
+        moov = read_moov(path)
+        tracks = [build_track_index(trak) for trak in moov.find_all(b"trak")]
+        return cls(tracks, stat.st_size, stat.st_mtime_ns)
+
+
+def _write_array(f: BinaryIO, values: array) -> None:
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    f.write(values.tobytes())
+
+
+def _read_array(f: BinaryIO, type_code: str, count: int) -> array:
+    values = array(type_code)
+    values.frombytes(f.read(values.itemsize * count))
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _full_box_payload(node: Optional[BoxNode]) -> Tuple[Optional[int], bytes]:
+    """Split a full box into its version and the payload after version and flags"""
+    if node is None:
+        return None, b""
+    return node.payload[0], node.payload[4:]
+
+
+def _table(node: Optional[BoxNode], entry_format: str) -> List[Tuple[int, ...]]:
+    """Read the entries of a sample table box that starts with an entry count"""
+    _, payload = _full_box_payload(node)
+    if not payload:
+        return []
+    count = struct.unpack_from(">I", payload)[0]
+    return list(struct.iter_unpack(f">{entry_format}", payload[4:4 + count * struct.calcsize(f'>{entry_format}')]))
+
+
+def build_track_index(trak: BoxNode) -> TrackIndex:
+    """Flatten the stbl sample tables of a trak box"""
+    mdia = trak.find(b"mdia")
+    stbl = mdia.find(b"minf").find(b"stbl") if mdia and mdia.find(b"minf") else None
+    if stbl is None:
+        raise MP4Error("Track without sample table")
+
+    version, tkhd = _full_box_payload(trak.find(b"tkhd"))
+    track_id = struct.unpack_from(">I", tkhd, 16 if version == 1 else 8)[0]
+    version, mdhd = _full_box_payload(mdia.find(b"mdhd"))
+    timescale = struct.unpack_from(">I", mdhd, 16 if version == 1 else 8)[0]
+    _, hdlr = _full_box_payload(mdia.find(b"hdlr"))
+    handler = hdlr[4:8]
+    track = TrackIndex(track_id, handler, timescale)
+
+    # Sample sizes
+    _, stsz = _full_box_payload(stbl.find(b"stsz"))
+    if not stsz:
+        raise MP4Error("Track without stsz box")
+    constant_size, sample_count = struct.unpack_from(">II", stsz)
+    if constant_size:
+        track.sizes = array("I", [constant_size]) * sample_count
+    else:
+        track.sizes = array("I", struct.unpack_from(f">{sample_count}I", stsz, 8))
+
+    # Decode times and durations
+    for count, delta in _table(stbl.find(b"stts"), "II"):
+        track.durations.extend([delta] * count)
+    del track.durations[sample_count:]
+    decode_time = 0
+    for duration in track.durations:
+        track.decode_times.append(decode_time)
+        decode_time += duration
+
+    # Composition offsets, signed in practice whatever the box version says
+    for count, offset in _table(stbl.find(b"ctts"), "Ii"):
+        track.composition_offsets.extend([offset] * count)
+    missing = sample_count - len(track.composition_offsets)
+    if missing > 0:
+        track.composition_offsets.extend([0] * missing)
+    del track.composition_offsets[sample_count:]
+
+    # Sync samples, every sample is a sync sample when there is no stss box
+    stss = stbl.find(b"stss")
+    if stss is None:
+        track.sync = array("B", [1]) * sample_count
+    else:
+        track.sync = array("B", bytes(sample_count))
+        for (sample_number,) in _table(stss, "I"):
+            if 0 < sample_number <= sample_count:
+                track.sync[sample_number - 1] = 1
+
+    # Sample offsets from chunk offsets and the sample-to-chunk table
+    chunk_table = stbl.find(b"stco")
+    chunk_offsets = [offset for (offset,) in _table(chunk_table, "I")] if chunk_table else \
+        [offset for (offset,) in _table(stbl.find(b"co64"), "Q")]
+    sample_to_chunk = _table(stbl.find(b"stsc"), "III")
+    sample = 0
+    for entry_index, (first_chunk, samples_per_chunk, _) in enumerate(sample_to_chunk):
+        last_chunk = sample_to_chunk[entry_index + 1][0] - 1 if entry_index + 1 < len(sample_to_chunk) else len(chunk_offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            offset = chunk_offsets[chunk]
+            for _ in range(samples_per_chunk):
+                if sample >= sample_count:
+                    break
+                track.offsets.append(offset)
+                offset += track.sizes[sample]
+                sample += 1
+    if sample != sample_count or len(track.durations) != sample_count:
+        raise MP4Error(f"Inconsistent sample tables in track {track_id}")
+    return track
+
+
+def _track_handler(trak: BoxNode) -> bytes:
+    mdia = trak.find(b"mdia")
+    _, hdlr = _full_box_payload(mdia.find(b"hdlr") if mdia else None)
+    return hdlr[4:8]
+
+
+def track_handlers(moov: BoxNode) -> List[bytes]:
+    """Handler types (b"vide", b"soun", ...) of every track of a movie"""
+    return [_track_handler(trak) for trak in moov.find_all(b"trak")]
+
+
+def video_dimensions(moov: BoxNode) -> Optional[Tuple[int, int]]:
+    """Display width and height of the first video track of a movie, None without one"""
+    for trak in moov.find_all(b"trak"):
+        if _track_handler(trak) != b"vide":
+            continue
+        version, tkhd = _full_box_payload(trak.find(b"tkhd"))
+        # 16.16 fixed point values after the matrix
+        width, height = struct.unpack_from(">II", tkhd, 84 if version == 1 else 72)
+        return width >> 16, height >> 16
+    return None
+
+
+def read_track_handlers(path: str) -> List[bytes]:
+    """Handler types (b"vide", b"soun", ...) of every track of an MP4 file"""
+    return track_handlers(read_moov(path))
+
+
+def read_video_dimensions(path: str) -> Optional[Tuple[int, int]]:
+    """Display width and height of the first video track of an MP4 file, None without one"""
+    return video_dimensions(read_moov(path))
@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from core.config import settings
+
+
+class PacingStats:
+    """Process-wide counters of paced stream output"""
+
+    def __init__(self):
+        self.active = 0
+        self.streams = 0
+        self.bytes_sent = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def started(self) -> None:
+        with self._lock:
+            self.active += 1
+            self.streams += 1
+
+    def finished(self) -> None:
+        with self._lock:
+            self.active -= 1
+
+    def sent(self, size: int, delay: float) -> None:
+        with self._lock:
+            self.bytes_sent += size
+            if delay > 0:
+                self.throttled += 1
+                self.throttled_seconds += delay
+
+    def stats(self) -> Dict[str, Any]:
+        """Get paced stream counters, throttled seconds is the time sends were held back"""
+        return {
+            "enabled": settings.STREAM_PACING_ENABLED,
+            "active": self.active,
+            "streams": self.streams,
+            "bytes_sent": self.bytes_sent,
+            "throttled": self.throttled,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+class Pacer:
+    """
+    Caps the output rate of a single response: the first burst_bytes go out as fast as
+    the socket takes them, after that sends are held back to rate bytes per second
+    """
+
+    def __init__(self, rate: float, burst_bytes: int, stats: PacingStats):
+        self.rate = rate
+        self.burst_bytes = burst_bytes
+        self.stats = stats
+        self.sent = 0
+        self._started_at: Optional[float] = None
+
+    async def pace(self, size: int) -> None:
+        """Wait until size more bytes may be sent, then account for them"""
+        now = time.monotonic()
+        if self._started_at is None:
+            self._started_at = now
+            self.stats.started()
+
+        allowed = self.burst_bytes + self.rate * (now - self._started_at)
+        delay = (self.sent + size - allowed) / self.rate if self.sent + size > allowed else 0.0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.sent += size
+        self.stats.sent(size, delay)
+
+    def close(self) -> None:
+        """Mark the response as finished"""
+        if self._started_at is not None:
+            self.stats.finished()
+            self._started_at = None
+
+
+def create_pacer(bitrate: Optional[int]) -> Optional[Pacer]:
+    """Pacer for a response of a media file with the given average bitrate in bit/s, None when not paced"""
+    if not settings.STREAM_PACING_ENABLED or not bitrate:
+        return None
+    byte_rate = bitrate / 8
+    return Pacer(
+        rate=byte_rate * settings.STREAM_PACING_RATE_MULTIPLIER,
+        burst_bytes=int(byte_rate * settings.STREAM_PACING_BURST_SECONDS),
+        stats=pacing_stats,
+    )
+
+
+# Create a singleton instance
+pacing_stats = PacingStats()
@@ -0,0 +1,365 @@
+import os
+import struct
+from typing import BinaryIO, Dict, Iterator, Optional, Tuple
+
+from utils.mp4 import BoxNode, MP4Error, iter_boxes, read_box_tree
+from utils.mp4_index import _full_box_payload, _track_handler, video_dimensions
+
+# Matroska/WebM element IDs, with their marker bits
+EBML_HEADER = 0x1A45DFA3
+EBML_DOC_TYPE = 0x4282
+SEGMENT = 0x18538067
+SEGMENT_INFO = 0x1549A966
+TIMESTAMP_SCALE = 0x2AD7B1
+DURATION = 0x4489
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_TYPE = 0x83
+CODEC_ID = 0x86
+TRACK_VIDEO = 0xE0
+PIXEL_WIDTH = 0xB0
+PIXEL_HEIGHT = 0xBA
+CLUSTER = 0x1F43B675
+
+MATROSKA_VIDEO_TRACK = 1
+MATROSKA_AUDIO_TRACK = 2
+
+# Matroska codec IDs under the names MP4 uses for the same codecs
+MATROSKA_CODECS = {
+    "V_MPEG4/ISO/AVC": "avc1",
+    "V_MPEGH/ISO/HEVC": "hvc1",
+    "V_AV1": "av01",
+    "V_VP8": "vp8",
+    "V_VP9": "vp9",
+    "A_AAC": "mp4a",
+    "A_OPUS": "opus",
+    "A_VORBIS": "vorbis",
+    "A_MPEG/L3": "mp3",
+    "A_FLAC": "flac",
+    "A_AC3": "ac-3",
+    "A_EAC3": "ec-3",
+}
+
+# Codec families browsers can decode
+PLAYABLE_VIDEO_CODECS = {"avc1", "avc3", "hvc1", "hev1", "av01", "vp8", "vp08", "vp9", "vp09"}
+PLAYABLE_AUDIO_CODECS = {"mp4a", "opus", "vorbis", "mp3", ".mp3", "flac", "ac-3", "ec-3"}
+
+CONTAINER_CONTENT_TYPES = {"mp4": "video/mp4", "webm": "video/webm", "matroska": "video/x-matroska"}
+
+
+class ProbeError(Exception):
+    """The file is not a container the probe understands"""
+
+
+class MediaInfo:
+    """What a container header says about a media file"""
+
+    def __init__(
+        self,
+        container: str,
+        duration: Optional[float] = None,
+        size: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        video_codec: Optional[str] = None,
+        audio_codec: Optional[str] = None,
+    ):
+        self.container = container
+        self.duration = duration
+        self.size = size
+        self.width = width
+        self.height = height
+        self.video_codec = video_codec
+        self.audio_codec = audio_codec
+
+    @property
+    def bitrate(self) -> Optional[int]:
+        """Average bitrate in bit/s"""
+        if not self.duration:
+            return None
+        return int(self.size * 8 / self.duration)
+
+    @property
+    def content_type(self) -> str:
+        return CONTAINER_CONTENT_TYPES[self.container]
+
+    @property
+    def is_playable(self) -> bool:
+        """Whether a browser can play the file: a decodable video track, or an audio-only file it can decode"""
+        if self.video_codec is not None:
+            return _codec_family(self.video_codec) in PLAYABLE_VIDEO_CODECS
+        return self.audio_codec is not None and _codec_family(self.audio_codec) in PLAYABLE_AUDIO_CODECS
+
+    def to_dict(self) -> Dict[str, object]:
+        """Video columns recorded from the probe"""
+        return {
+            "container": self.container,
+            "duration_seconds": self.duration,
+            "bitrate": self.bitrate,
+            "width": self.width,
+            "height": self.height,
+            "video_codec": self.video_codec,
+            "audio_codec": self.audio_codec,
+        }
+
+
+def _codec_family(codec: str) -> str:
+    return codec.split(".")[0].lower()
+
+
+def probe_file(path: str, max_header_bytes: int) -> MediaInfo:
+    """
+    Identify the container of a file and read its duration, resolution and codecs.
+    Only headers are read, and never more than max_header_bytes of them
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        magic = f.read(8)
+        f.seek(0)
+        if magic[4:8] in (b"ftyp", b"styp"):
+            return _probe_mp4(path, f, size, max_header_bytes)
+        if magic[:4] == struct.pack(">I", EBML_HEADER):
+            return _probe_matroska(f, size, max_header_bytes)
+    raise ProbeError("Unknown container")
+
+
+# MP4
+
+def _probe_mp4(path: str, f: BinaryIO, size: int, max_header_bytes: int) -> MediaInfo:
+    try:
+        moov_box = next((box for box in iter_boxes(f, 0, size) if box.type == b"moov"), None)
+        if moov_box is None:
+            raise ProbeError("Missing moov box")
+        if moov_box.payload_size > max_header_bytes:
+            raise ProbeError("Movie header too large")
+        moov = read_box_tree(path, moov_box)
+
+        info = MediaInfo("mp4", duration=_mp4_duration(moov), size=size)
+        dimensions = video_dimensions(moov)
+        if dimensions is not None:
+            info.width, info.height = dimensions
+        for trak in moov.find_all(b"trak"):
+            handler = _track_handler(trak)
+            if handler == b"vide" and info.video_codec is None:
+                info.video_codec = _mp4_codec(trak)
+            elif handler == b"soun" and info.audio_codec is None:
+                info.audio_codec = _mp4_codec(trak)
+        return info
+    except (MP4Error, struct.error, IndexError, AttributeError) as error:
+        raise ProbeError(f"Invalid MP4 file: {error}")
+
+
+def _mp4_duration(moov: BoxNode) -> Optional[float]:
+    version, mvhd = _full_box_payload(moov.find(b"mvhd"))
+    if not mvhd:
+        return None
+    if version == 1:
+        timescale, duration = struct.unpack_from(">IQ", mvhd, 16)
+    else:
+        timescale, duration = struct.unpack_from(">II", mvhd, 8)
+    return duration / timescale if timescale and duration else None
+
+
+def _mp4_codec(trak: BoxNode) -> Optional[str]:
+    """RFC 6381 codec string of the first sample entry of a track, as used in HLS CODECS"""
+    stbl = trak.find(b"mdia").find(b"minf").find(b"stbl")
+    _, stsd = _full_box_payload(stbl.find(b"stsd"))
+    if len(stsd) < 12:
+        return None
+    entry_size, entry_type = struct.unpack_from(">I4s", stsd, 4)
+    entry = stsd[12:4 + entry_size]
+    codec = entry_type.decode("latin-1").strip()
+
+    if entry_type in (b"avc1", b"avc3"):
+        # Children follow the 78 bytes of visual sample entry fields
+        avcc = _find_child(entry[78:], b"avcC")
+        if avcc is not None and len(avcc) >= 4:
+            return f"{codec}.{avcc[1]:02x}{avcc[2]:02x}{avcc[3]:02x}"
+    elif entry_type == b"mp4a":
+        # Children follow the 28 bytes of audio sample entry fields
+        esds = _find_child(entry[28:], b"esds")
+        if esds is not None:
+            return _mp4a_codec(esds[4:])
+    return codec
+
+
+def _find_child(data: bytes, box_type: bytes) -> Optional[bytes]:
+    offset = 0
+    while offset + 8 <= len(data):
+        size, child_type = struct.unpack_from(">I4s", data, offset)
+        if size < 8:
+            return None
+        if child_type == box_type:
+            return data[offset + 8:offset + size]
+        offset += size
+    return None
+
+
+def _read_descriptor(data: bytes, offset: int) -> Tuple[int, int, int]:
+    """Read an MPEG-4 descriptor header, returning (tag, payload offset, payload size)"""
+    tag = data[offset]
+    size = 0
+    offset += 1
+    for _ in range(4):
+        byte = data[offset]
+        offset += 1
+        size = (size << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            break
+    return tag, offset, size
+
+
+def _mp4a_codec(esds: bytes) -> str:
+    """mp4a.<object type>[.<audio object type>] from an ES descriptor"""
+    tag, offset, _ = _read_descriptor(esds, 0)
+    if tag != 0x03:
+        return "mp4a"
+    flags = esds[offset + 2]
+    offset += 3
+    if flags & 0x80:
+        offset += 2
+    if flags & 0x40:
+        offset += 1 + esds[offset]
+    if flags & 0x20:
+        offset += 2
+
+    tag, offset, _ = _read_descriptor(esds, offset)
+    if tag != 0x04:
+        return "mp4a"
+    object_type = esds[offset]
+    if object_type != 0x40:
+        return f"mp4a.{object_type:02x}"
+    tag, offset, _ = _read_descriptor(esds, offset + 13)
+    if tag != 0x05:
+        return "mp4a.40"
+    audio_object_type = esds[offset] >> 3
+    return f"mp4a.40.{audio_object_type}"
+
+
+# Matroska / WebM
+
+def _read_vint(f: BinaryIO, keep_marker: bool) -> Tuple[Optional[int], int]:
+    """Read an EBML variable-size integer, returning (value or None if unknown, length)"""
+    first = f.read(1)
+    if not first:
+        raise ProbeError("Unexpected end of file")
+    first_byte = first[0]
+    length = 1
+    while length <= 8 and not first_byte & (0x80 >> (length - 1)):
+        length += 1
+    if length > 8:
+        raise ProbeError("Invalid EBML variable-size integer")
+    rest = f.read(length - 1)
+    if len(rest) != length - 1:
+        raise ProbeError("Unexpected end of file")
+
+    value = first_byte if keep_marker else first_byte & (0xFF >> length)
+    for byte in rest:
+        value = (value << 8) | byte
+    if not keep_marker and value == (1 << (7 * length)) - 1:
+        # All value bits set means the size is unknown
+        return None, length
+    return value, length
+
+
+def _iter_elements(f: BinaryIO, start: int, end: int) -> Iterator[Tuple[int, int, Optional[int]]]:
+    """Iterate over (id, payload offset, payload size or None if unknown) of the elements between start and end"""
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        element_id, id_length = _read_vint(f, keep_marker=True)
+        size, size_length = _read_vint(f, keep_marker=False)
+        payload_offset = offset + id_length + size_length
+        yield element_id, payload_offset, size
+        if size is None:
+            return
+        offset = payload_offset + size
+
+
+def _read_payload(f: BinaryIO, offset: int, size: int) -> bytes:
+    if size > 64:
+        raise ProbeError("Unexpectedly large header element")
+    f.seek(offset)
+    return f.read(size)
+
+
+def _read_uint(f: BinaryIO, offset: int, size: int) -> int:
+    return int.from_bytes(_read_payload(f, offset, size), "big")
+
+
+def _read_float(f: BinaryIO, offset: int, size: int) -> float:
+    data = _read_payload(f, offset, size)
+    return struct.unpack(">f" if size == 4 else ">d", data)[0]
+
+
+def _probe_matroska(f: BinaryIO, size: int, max_header_bytes: int) -> MediaInfo:
+    try:
+        return _read_matroska(f, size, max_header_bytes)
+    except (struct.error, StopIteration, TypeError, ValueError, OverflowError) as error:
+        # Truncated or corrupt elements: short float payloads, sizes that are unknown or out of range...
+        raise ProbeError(f"Invalid Matroska file: {error or type(error).__name__}")
+
+
+def _read_matroska(f: BinaryIO, size: int, max_header_bytes: int) -> MediaInfo:
+    elements = _iter_elements(f, 0, size)
+    element_id, payload_offset, payload_size = next(elements)
+    doc_type = "matroska"
+    for child_id, child_offset, child_size in _iter_elements(f, payload_offset, payload_offset + (payload_size or 0)):
+        if child_id == EBML_DOC_TYPE:
+            doc_type = _read_payload(f, child_offset, child_size).rstrip(b"\x00").decode("ascii", "replace")
+
+    segment = next((element for element in elements if element[0] == SEGMENT), None)
+    if segment is None:
+        raise ProbeError("Missing Segment element")
+    _, segment_offset, segment_size = segment
+    segment_end = size if segment_size is None else min(size, segment_offset + segment_size)
+
+    info = MediaInfo("webm" if doc_type == "webm" else "matroska", size=size)
+    timestamp_scale = 1_000_000
+    duration = None
+    found_tracks = False
+    for child_id, child_offset, child_size in _iter_elements(f, segment_offset, segment_end):
+        if child_offset > max_header_bytes:
+            break
+        if child_id == SEGMENT_INFO and child_size is not None:
+            for info_id, info_offset, info_size in _iter_elements(f, child_offset, child_offset + child_size):
+                if info_id == TIMESTAMP_SCALE:
+                    timestamp_scale = _read_uint(f, info_offset, info_size)
+                elif info_id == DURATION:
+                    duration = _read_float(f, info_offset, info_size)
+        elif child_id == TRACKS and child_size is not None:
+            found_tracks = True
+            _read_matroska_tracks(f, child_offset, child_offset + child_size, info)
+        elif child_id == CLUSTER and (found_tracks or child_size is None):
+            # Media data, every header we need comes before it
+            break
+
+    if not found_tracks:
+        raise ProbeError("Missing Tracks element")
+    if duration:
+        info.duration = duration * timestamp_scale / 1_000_000_000
+    return info
+
+
+def _read_matroska_tracks(f: BinaryIO, start: int, end: int, info: MediaInfo) -> None:
+    for entry_id, entry_offset, entry_size in _iter_elements(f, start, end):
+        if entry_id != TRACK_ENTRY or entry_size is None:
+            continue
+        track_type, codec_id, width, height = None, None, None, None
+        for field_id, field_offset, field_size in _iter_elements(f, entry_offset, entry_offset + entry_size):
+            if field_id == TRACK_TYPE:
+                track_type = _read_uint(f, field_offset, field_size)
+            elif field_id == CODEC_ID:
+                codec_id = _read_payload(f, field_offset, field_size).rstrip(b"\x00").decode("ascii", "replace")
+            elif field_id == TRACK_VIDEO and field_size is not None:
+                for video_id, video_offset, video_size in _iter_elements(f, field_offset, field_offset + field_size):
+                    if video_id == PIXEL_WIDTH:
+                        width = _read_uint(f, video_offset, video_size)
+                    elif video_id == PIXEL_HEIGHT:
+                        height = _read_uint(f, video_offset, video_size)
+
+        codec = MATROSKA_CODECS.get(codec_id, codec_id) if codec_id else None
+        if track_type == MATROSKA_VIDEO_TRACK and info.video_codec is None:
+            info.video_codec, info.width, info.height = codec, width, height
+        elif track_type == MATROSKA_AUDIO_TRACK and info.audio_codec is None:
+            info.audio_codec = codec
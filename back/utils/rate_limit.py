@@ -0,0 +1,211 @@
+import asyncio
+import importlib
+from abc import ABC, abstractmethod
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from core.config import settings
+from utils.admission import STREAM, route_class, send_error
+
+# Clients tracked by the in-process store, the least recently seen are forgotten past it
+MAX_TRACKED_CLIENTS = 100_000
+
+
+class RateLimitStore(ABC):
+    """
+    Where token buckets and stream counts live. The in-process store limits each worker on its
+    own, a store shared by every worker (e.g. backed by Redis) is plugged in with RATE_LIMIT_STORE
+    """
+
+    @abstractmethod
+    async def take(self, key: str, rate: float, burst: float, amount: float, allow_debt: bool = False) -> float:
+        """
+        Take amount tokens from the bucket of key, refilled at rate per second up to burst. Returns 0
+        when taken, otherwise the seconds until they are available. With allow_debt the tokens are
+        always taken and the result is how long the caller has to wait to stay within the rate
+        """
+
+    @abstractmethod
+    async def acquire(self, key: str, limit: int) -> bool:
+        """Count one more concurrent stream for key, False when it already has limit"""
+
+    @abstractmethod
+    async def release(self, key: str) -> None:
+        """Count a stream of key as finished"""
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """In-process store, for a single worker or limits per worker"""
+
+    def __init__(self, max_clients: int = MAX_TRACKED_CLIENTS):
+        self.max_clients = max_clients
+        # Bucket key -> (tokens, last refill)
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._streams: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, rate: float, burst: float, amount: float, allow_debt: bool = False) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= amount or allow_debt:
+                tokens -= amount
+                wait = -tokens / rate if tokens < 0 else 0.0
+            else:
+                wait = (amount - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        return wait
+
+    async def acquire(self, key: str, limit: int) -> bool:
+        with self._lock:
+            count = self._streams.get(key, 0)
+            if count >= limit:
+                return False
+            self._streams[key] = count + 1
+        return True
+
+    async def release(self, key: str) -> None:
+        with self._lock:
+            count = self._streams.pop(key, 0) - 1
+            if count > 0:
+                self._streams[key] = count
+
+
+def load_store(spec: str) -> RateLimitStore:
+    """The store named by RATE_LIMIT_STORE: memory, or module:attribute of a RateLimitStore (or a factory)"""
+    if spec == "memory":
+        return MemoryRateLimitStore()
+    module_name, _, attribute = spec.partition(":")
+    store = getattr(importlib.import_module(module_name), attribute)
+    return store() if callable(store) and not isinstance(store, RateLimitStore) else store
+
+
+def client_key(scope: Scope) -> str:
+    """
+    Who a request is counted against: its IP, or with RATE_LIMIT_KEY=token the bearer token
+    or signed URL token it carries, falling back to the IP
+    """
+    if settings.RATE_LIMIT_KEY == "token":
+        for name, value in scope.get("headers", []):
+            if name == b"authorization" and value.lower().startswith(b"bearer "):
+                return "token:" + value[7:].decode("latin-1")
+        token = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("token")
+        if token:
+            return "token:" + token[0]
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+class RateLimiter:
+    """Per-client limits on request rate, stream bandwidth and concurrent streams"""
+
+    def __init__(self, store: RateLimitStore):
+        self.store = store
+        self.limited_requests = 0
+        self.limited_streams = 0
+        self.throttled_seconds = 0.0
+
+    async def check_request(self, key: str) -> float:
+        """0 when the client may make one more request, otherwise seconds until it may"""
+        if not settings.RATE_LIMIT_REQUESTS_PER_SECOND:
+            return 0.0
+        wait = await self.store.take(
+            f"req:{key}", settings.RATE_LIMIT_REQUESTS_PER_SECOND, settings.RATE_LIMIT_REQUESTS_BURST, 1)
+        if wait:
+            self.limited_requests += 1
+        return wait
+
+    async def open_stream(self, key: str) -> bool:
+        """Whether the client may open one more concurrent stream"""
+        if not settings.RATE_LIMIT_STREAMS_PER_CLIENT:
+            return True
+        if await self.store.acquire(f"streams:{key}", settings.RATE_LIMIT_STREAMS_PER_CLIENT):
+            return True
+        self.limited_streams += 1
+        return False
+
+    async def close_stream(self, key: str) -> None:
+        if settings.RATE_LIMIT_STREAMS_PER_CLIENT:
+            await self.store.release(f"streams:{key}")
+
+    async def throttle(self, key: str, size: int) -> None:
+        """Wait as long as sending size more bytes to the client takes at its bandwidth limit"""
+        if not settings.RATE_LIMIT_BYTES_PER_SECOND or not size:
+            return
+        wait = await self.store.take(
+            f"bytes:{key}", settings.RATE_LIMIT_BYTES_PER_SECOND, settings.RATE_LIMIT_BYTES_BURST, size, allow_debt=True)
+        if wait:
+            self.throttled_seconds += wait
+            await asyncio.sleep(wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": type(self.store).__name__,
+            "limited_requests": self.limited_requests,
+            "limited_streams": self.limited_streams,
+            "throttled_seconds": round(self.throttled_seconds, 3),
+        }
+
+
+class RateLimitMiddleware:
+    """
+    Applies the per-client limits: requests past the request rate or the concurrent stream
+    cap get 429 with Retry-After, stream bodies are slowed down to the client's bandwidth
+    """
+
+    def __init__(self, app: ASGIApp, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        kind = route_class(scope["method"], scope["path"])
+        if kind is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter or get_rate_limiter()
+        key = client_key(scope)
+        wait = await limiter.check_request(key)
+        if wait:
+            await send_error(send, 429, "Too many requests", math.ceil(wait))
+            return
+        if kind != STREAM:
+            await self.app(scope, receive, send)
+            return
+
+        if not await limiter.open_stream(key):
+            await send_error(send, 429, "Too many concurrent streams", settings.ADMISSION_RETRY_AFTER)
+            return
+
+        async def throttled_send(message: Message) -> None:
+            # Plain and zero-copy body sends
+            await limiter.throttle(key, len(message.get("body", b"")) or message.get("count", 0))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, throttled_send)
+        finally:
+            await limiter.close_stream(key)
+
+
+_rate_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """The limiter of this worker, its store is loaded on first use"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(load_store(settings.RATE_LIMIT_STORE))
+    return _rate_limiter
@@ -0,0 +1,67 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from core.config import settings
+
+
+class SegmentCache:
+    """Process-wide LRU cache of packaged segments bounded by a byte budget"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._segments: "OrderedDict[Hashable, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        """Get a cached segment, counting the hit or miss"""
+        with self._lock:
+            segment = self._segments.get(key)
+            if segment is None:
+                self.misses += 1
+                return None
+            self._segments.move_to_end(key)
+            self.hits += 1
+            return segment
+
+    def put(self, key: Hashable, segment: bytes) -> None:
+        """Cache a segment, evicting the least recently used ones over the budget"""
+        size = len(segment)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._segments.pop(key, None)
+            if previous is not None:
+                self.current_bytes -= len(previous)
+            self._segments[key] = segment
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, evicted = self._segments.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached segment"""
+        with self._lock:
+            self._segments.clear()
+            self.current_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache occupancy and hit counters"""
+        return {
+            "segments": len(self._segments),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+# Create a singleton instance
+segment_cache = SegmentCache(max_bytes=settings.HLS_SEGMENT_CACHE_MAX_BYTES)
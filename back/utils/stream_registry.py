@@ -0,0 +1,167 @@
+import itertools
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Sends over this long are averaged into the current rate of a stream
+RATE_WINDOW_SECONDS = 2.0
+
+
+class StreamHandoff(Exception):
+    """A draining worker stopped sending a stream, the player resumes it elsewhere with a range request"""
+
+
+class ActiveStream:
+    """A response body being sent to a viewer, with what it has sent so far"""
+
+    def __init__(self, video_id: int, client: Optional[str], rendition: Optional[str] = None):
+        self.id: Optional[int] = None
+        self.video_id = video_id
+        self.client = client
+        self.rendition = rendition
+        self.total_bytes = 0
+        self.bytes_sent = 0
+        # Set when the worker drains, the stream stops at the first chunk boundary past it
+        self.handoff_at: Optional[float] = None
+        self.handed_off = False
+        self.started_at = datetime.now()
+        self._started = time.monotonic()
+        self._window_started = self._started
+        self._window_bytes = 0
+        self._rate = 0.0
+
+    def record(self, size: int) -> None:
+        """Account for size bytes handed to the server"""
+        self.bytes_sent += size
+        self._window_bytes += size
+        now = time.monotonic()
+        if now - self._window_started >= RATE_WINDOW_SECONDS:
+            self._rate = self._window_bytes / (now - self._window_started)
+            self._window_started = now
+            self._window_bytes = 0
+
+    def handoff_due(self) -> bool:
+        """Whether the stream must stop so the player resumes it from another worker"""
+        if self.handoff_at is None or time.monotonic() < self.handoff_at:
+            return False
+        self.handed_off = True
+        return True
+
+    @property
+    def rate(self) -> float:
+        """Send rate in bytes per second over the last window"""
+        elapsed = time.monotonic() - self._window_started
+        if self._rate and elapsed < RATE_WINDOW_SECONDS:
+            return self._rate
+        # A stream younger than a window, or one that stalled
+        return self._window_bytes / elapsed if elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "video_id": self.video_id,
+            "rendition": self.rendition,
+            "client": self.client,
+            "started_at": self.started_at.isoformat(),
+            "bytes_sent": self.bytes_sent,
+            "total_bytes": self.total_bytes,
+            "rate": int(self.rate),
+        }
+
+
+class StreamRegistry:
+    """
+    Process-wide registry of the streams being sent and the outcome of finished ones. While
+    draining, no new streams should be started and active ones are handed off before a deadline
+    """
+
+    def __init__(self):
+        self.completed = 0
+        self.aborted = 0
+        self.aborted_bytes_sent = 0
+        self.aborted_bytes_unsent = 0
+        self.handed_off = 0
+        self.draining_since: Optional[float] = None
+        self.drain_deadline: Optional[float] = None
+        self._drain_spread = 0.0
+        self._streams: Dict[int, ActiveStream] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def open(self, stream: ActiveStream, total_bytes: int) -> None:
+        """Register a stream about to send total_bytes of body"""
+        with self._lock:
+            stream.id = next(self._ids)
+            stream.total_bytes = total_bytes
+            self._streams[stream.id] = stream
+            if self.draining:
+                self._schedule_handoff(stream)
+
+    def close(self, stream: ActiveStream) -> None:
+        """Unregister a stream, counting it as aborted if it stopped before sending its whole body"""
+        with self._lock:
+            if self._streams.pop(stream.id, None) is None:
+                return
+            if stream.bytes_sent >= stream.total_bytes:
+                self.completed += 1
+            elif stream.handed_off:
+                self.handed_off += 1
+            else:
+                self.aborted += 1
+                self.aborted_bytes_sent += stream.bytes_sent
+                self.aborted_bytes_unsent += stream.total_bytes - stream.bytes_sent
+
+    @property
+    def draining(self) -> bool:
+        return self.draining_since is not None
+
+    def drain(self, timeout: float, spread: float) -> None:
+        """
+        Start draining: active streams may finish within timeout seconds, the ones still running
+        are handed off at random times over its last spread seconds so players don't reconnect together
+        """
+        with self._lock:
+            if self.draining:
+                return
+            self.draining_since = time.monotonic()
+            self.drain_deadline = self.draining_since + timeout
+            self._drain_spread = min(spread, timeout)
+            for stream in self._streams.values():
+                self._schedule_handoff(stream)
+
+    def resume(self) -> None:
+        """Stop draining, streams that weren't handed off yet keep going"""
+        with self._lock:
+            self.draining_since = None
+            self.drain_deadline = None
+            for stream in self._streams.values():
+                stream.handoff_at = None
+
+    def _schedule_handoff(self, stream: ActiveStream) -> None:
+        stream.handoff_at = self.drain_deadline - random.uniform(0, self._drain_spread)
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Get the streams currently being sent, oldest first"""
+        with self._lock:
+            streams = list(self._streams.values())
+        return [stream.to_dict() for stream in streams]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get live concurrency, drain progress and the counters of finished streams"""
+        deadline = self.drain_deadline
+        return {
+            "active": len(self._streams),
+            "completed": self.completed,
+            "aborted": self.aborted,
+            "aborted_bytes_sent": self.aborted_bytes_sent,
+            "aborted_bytes_unsent": self.aborted_bytes_unsent,
+            "handed_off": self.handed_off,
+            "draining": self.draining,
+            "drain_remaining": round(max(deadline - time.monotonic(), 0.0), 1) if deadline is not None else None,
+        }
+
+
+# Create a singleton instance
+stream_registry = StreamRegistry()
@@ -0,0 +1,92 @@
+import time
+from typing import Optional
+
+import jwt
+
+ALGORITHM = "HS256"
+
+
+class StreamTokenError(Exception):
+    """A stream URL token is invalid, expired or used by another client"""
+
+
+class StreamGrant:
+    """
+    What a signed stream URL lets its holder read: one version of one file, until it expires.
+    It carries everything needed to serve the file, so verifying it takes no database access
+    """
+
+    def __init__(
+        self,
+        video_id: int,
+        path: str,
+        version: str,
+        content_type: str,
+        expires_at: int,
+        bitrate: Optional[int] = None,
+        client: Optional[str] = None,
+        subtitle_id: Optional[int] = None,
+    ):
+        self.video_id = video_id
+        # Relative to UPLOAD_DIR
+        self.path = path
+        # ETag of the file the URL was issued for
+        self.version = version
+        self.content_type = content_type
+        self.expires_at = expires_at
+        self.bitrate = bitrate
+        self.client = client
+        # Set when the grant is for a subtitle file of the video instead of the video itself
+        self.subtitle_id = subtitle_id
+
+
+def sign_stream_grant(grant: StreamGrant, key: str) -> str:
+    """Encode a grant as a compact HMAC-signed token"""
+    claims = {
+        "vid": grant.video_id,
+        "f": grant.path,
+        "v": grant.version,
+        "ct": grant.content_type,
+        "exp": grant.expires_at,
+    }
+    if grant.bitrate:
+        claims["br"] = grant.bitrate
+    if grant.client:
+        claims["cip"] = grant.client
+    if grant.subtitle_id is not None:
+        claims["sid"] = grant.subtitle_id
+    token = jwt.encode(claims, key, algorithm=ALGORITHM)
+    # PyJWT 1.x returns bytes
+    return token.decode("ascii") if isinstance(token, bytes) else token
+
+
+def verify_stream_token(token: str, key: str, client: Optional[str] = None) -> StreamGrant:
+    """Check the signature, expiry and client binding of a token and return its grant"""
+    try:
+        claims = jwt.decode(token, key, algorithms=[ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise StreamTokenError("Stream URL expired")
+    except jwt.InvalidTokenError:
+        raise StreamTokenError("Invalid stream URL")
+
+    try:
+        grant = StreamGrant(
+            video_id=int(claims["vid"]),
+            path=str(claims["f"]),
+            version=str(claims["v"]),
+            content_type=str(claims["ct"]),
+            expires_at=int(claims["exp"]),
+            bitrate=claims.get("br"),
+            client=claims.get("cip"),
+            subtitle_id=claims.get("sid"),
+        )
+    except (KeyError, TypeError, ValueError):
+        raise StreamTokenError("Invalid stream URL")
+    if grant.client is not None and grant.client != client:
+        raise StreamTokenError("Stream URL issued to another client")
+    return grant
+
+
+def expiry_from_now(ttl: int) -> int:
+    """Expiry timestamp of a token valid for ttl seconds"""
+    return int(time.time()) + ttl
@@ -0,0 +1,118 @@
+from typing import Optional
+from fastapi import HTTPException, Query, Request, Response
+
+from core.config import settings
+from utils.file_handlers import build_file_response, build_offload_response, offload_enabled
+from utils.http_cache import if_range_matches, is_not_modified, validator_headers
+from utils.pacing import create_pacer
+from utils.stream_registry import ActiveStream, stream_registry
+from utils.stream_tokens import StreamGrant, StreamTokenError, verify_stream_token
+from utils.video_files import VideoFile
+
+
+def client_host(request: Request) -> Optional[str]:
+    """Address of the client, signed stream URLs can be bound to it"""
+    return request.client.host if request.client else None
+
+
+def client_address(request: Request) -> Optional[str]:
+    """Address and port of the client, telling apart the streams of a single viewer"""
+    return f"{request.client.host}:{request.client.port}" if request.client else None
+
+
+def verify_stream_url(
+    token: str,
+    request: Request,
+    video_id: Optional[int],
+    subtitle_id: Optional[int] = None,
+) -> StreamGrant:
+    """Check a signed URL token against the requested video (or subtitle) and the client using it"""
+    if not settings.STREAM_SIGNING_KEY:
+        raise HTTPException(status_code=403, detail="Signed stream URLs are not enabled")
+    try:
+        grant = verify_stream_token(token, settings.STREAM_SIGNING_KEY, client_host(request))
+    except StreamTokenError as error:
+        raise HTTPException(status_code=403, detail=str(error))
+    if grant.subtitle_id != subtitle_id or (subtitle_id is None and grant.video_id != video_id):
+        raise HTTPException(status_code=403, detail="Invalid stream URL")
+    return grant
+
+
+def authorize_video(
+    video_id: int,
+    request: Request,
+    token: Optional[str] = Query(None, description="Token of a signed URL of the video"),
+) -> Optional[StreamGrant]:
+    """
+    Dependency of the media routes of a video: a token must be a grant for the video, and is
+    required with STREAM_REQUIRE_SIGNED_URLS. A grant covers every file and rendition of its video
+    """
+    if token is not None:
+        return verify_stream_url(token, request, video_id)
+    if settings.STREAM_REQUIRE_SIGNED_URLS:
+        raise HTTPException(status_code=401, detail="A signed stream URL is required")
+    return None
+
+
+def signed_query(request: Request) -> str:
+    """Query string passing the token of a signed playlist or track on to the URIs it lists"""
+    token = request.query_params.get("token")
+    return f"?token={token}" if token else ""
+
+
+def build_video_response(
+    request: Request,
+    video_file: VideoFile,
+    rendition: Optional[str] = None,
+    seek_offset: Optional[int] = None,
+) -> Response:
+    """
+    Answer a stream request for a resolved video file: conditional requests, ranges, pacing
+    and proxy offload. seek_offset starts the body at a keyframe when the client sent no range
+    """
+    if stream_registry.draining:
+        # The load balancer sends the retry to another worker
+        raise HTTPException(
+            status_code=503,
+            detail="Worker is draining, retry the stream",
+            headers={"Retry-After": "1", "Connection": "close"},
+        )
+
+    headers = validator_headers(video_file.etag, video_file.mtime)
+
+    if is_not_modified(request.headers, video_file.etag, video_file.mtime):
+        return Response(status_code=304, headers=headers)
+
+    # A range is only valid against the representation the client already has
+    range_header = request.headers.get("range")
+    if range_header and not if_range_matches(request.headers, video_file.etag, video_file.mtime):
+        range_header = None
+
+    # A time seek becomes a range starting at the keyframe, one round trip instead of guessing offsets
+    seek_range = None
+    if seek_offset is not None and range_header is None:
+        seek_range = range_header = f"bytes={seek_offset}-"
+
+    headers["Content-Disposition"] = f"inline; filename={video_file.filename}"
+    # Past the initial burst, output is capped relative to the bitrate when pacing is enabled
+    pacer = create_pacer(video_file.bitrate)
+
+    # The proxy only sees the client's own Range header, so time seeks are still served from here.
+    # It checks If-Range against its own validators, not this ETag, so those ranges are served from here too
+    if offload_enabled() and seek_range is None and "if-range" not in request.headers:
+        return build_offload_response(
+            video_file.path,
+            media_type=video_file.content_type,
+            headers=headers,
+            limit_rate=int(pacer.rate) if pacer else None,
+        )
+
+    return build_file_response(
+        video_file.file,
+        video_file.size,
+        range_header,
+        media_type=video_file.content_type,
+        headers=headers,
+        pacer=pacer,
+        stream=ActiveStream(video_file.video_id, client_address(request), rendition),
+    )
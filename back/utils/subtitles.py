@@ -0,0 +1,68 @@
+import os
+from typing import Mapping, Optional
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from core.config import settings
+from utils.http_cache import is_not_modified, make_etag, validator_headers
+from utils.stream_tokens import StreamGrant
+
+# Common subtitle formats and their MIME types
+SUBTITLE_MEDIA_TYPES = {
+    'srt': 'application/x-subrip',
+    'vtt': 'text/vtt',
+    'ass': 'text/x-ssa',
+    'ssa': 'text/x-ssa',
+    'sub': 'text/x-subviewer'
+}
+
+
+def get_subtitle_media_type(filename: str) -> str:
+    """Get the appropriate media type for a subtitle file"""
+    # Get the file extension from the filename
+    file_ext = filename.split('.')[-1].lower() if '.' in filename else ''
+
+    # Use the appropriate MIME type or default to text/plain
+    return SUBTITLE_MEDIA_TYPES.get(file_ext, 'text/plain')
+
+
+def build_subtitle_response(subtitle_path: str, request_headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Serve a subtitle file, answering conditional requests with 304"""
+    # Check if the subtitle file exists
+    if not os.path.exists(subtitle_path):
+        raise HTTPException(status_code=404, detail="Subtitle file not found")
+
+    # Validators let players and caches skip downloads they already have
+    stat = os.stat(subtitle_path)
+    headers = validator_headers(make_etag(stat.st_size, stat.st_mtime), stat.st_mtime)
+    if request_headers is not None and is_not_modified(request_headers, headers["ETag"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    # Read the subtitle file
+    with open(subtitle_path, "r") as f:
+        subtitle_content = f.read()
+
+    filename = os.path.basename(subtitle_path)
+    # Return the subtitle content with appropriate headers
+    return Response(
+        content=subtitle_content,
+        media_type=get_subtitle_media_type(filename),
+        headers={
+            **headers,
+            'Content-Disposition': f'attachment; filename={filename}',
+            # Allow cross-origin requests for video players
+            'Access-Control-Allow-Origin': '*'
+        }
+    )
+
+
+def build_signed_subtitle_response(grant: StreamGrant, request_headers: Optional[Mapping[str, str]] = None) -> Response:
+    """Serve the subtitle file a signed URL grants access to, without any database access"""
+    subtitle_path = os.path.join(settings.UPLOAD_DIR, grant.path)
+    try:
+        stat = os.stat(subtitle_path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Subtitle file not found")
+    if make_etag(stat.st_size, stat.st_mtime) != grant.version:
+        raise HTTPException(status_code=410, detail="Subtitle file changed, request a new subtitle URL")
+    return build_subtitle_response(subtitle_path, request_headers)
@@ -0,0 +1,100 @@
+import math
+import os
+import re
+from typing import Mapping, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.responses import Response
+
+from core.config import settings
+from utils.file_handlers import build_file_response
+from utils.http_cache import is_not_modified, make_etag, validator_headers
+
+DEFAULT_ASPECT_RATIO = 16 / 9
+
+VTT_FILENAME = "thumbnails.vtt"
+SHEET_PATTERN = re.compile(r"^sprite_\d{3,}\.(jpg|webp)$")
+SHEET_MEDIA_TYPES = {"jpg": "image/jpeg", "webp": "image/webp"}
+# Sprite sheet URI of a cue, before its #xywh fragment
+CUE_SHEET_URI = re.compile(r"sprite_\d{3,}\.(?:jpg|webp)(?=#)")
+
+
+def thumbnail_size(width: int, dimensions: Optional[Tuple[int, int]]) -> Tuple[int, int]:
+    """Size of a single thumbnail of the given width, keeping the aspect ratio of the video"""
+    aspect_ratio = dimensions[0] / dimensions[1] if dimensions and dimensions[1] else DEFAULT_ASPECT_RATIO
+    # Encoders want even dimensions
+    return width, max(2, round(width / aspect_ratio / 2) * 2)
+
+
+def _format_timestamp(seconds: float) -> str:
+    milliseconds = round(seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600 * 1000)
+    minutes, milliseconds = divmod(milliseconds, 60 * 1000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}.{milliseconds:03d}"
+
+
+def build_thumbnail_vtt(
+    duration: float,
+    interval: float,
+    width: int,
+    height: int,
+    columns: int,
+    rows: int,
+    sheet_name: str,
+) -> str:
+    """
+    Build a WebVTT thumbnail track: one cue per interval pointing at the tile of its
+    frame in the sprite sheets. sheet_name is formatted with the 1-based sheet number
+    """
+    per_sheet = columns * rows
+    lines = ["WEBVTT", ""]
+    for frame in range(math.ceil(duration / interval)):
+        start = frame * interval
+        end = min(start + interval, duration)
+        sheet, tile = divmod(frame, per_sheet)
+        row, column = divmod(tile, columns)
+        lines.append(f"{_format_timestamp(start)} --> {_format_timestamp(end)}")
+        lines.append(f"{sheet_name.format(sheet + 1)}#xywh={column * width},{row * height},{width},{height}")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def get_trickplay_dir(video_id: int) -> str:
+    """Directory holding the sprite sheets and thumbnail track of a video"""
+    return os.path.join(settings.THUMBNAILS_DIR, "trickplay", str(video_id))
+
+
+def build_thumbnail_response(
+    video_id: int,
+    name: str,
+    request_headers: Mapping[str, str],
+    range_header: Optional[str] = None,
+    query: str = ""
+) -> Response:
+    """
+    Serve the thumbnail track or a sprite sheet of a video, answering conditional requests with 304.
+    query is appended to the sprite sheet URIs of the track, e.g. the token of a signed URL
+    """
+    if name == VTT_FILENAME:
+        media_type = "text/vtt"
+    elif SHEET_PATTERN.match(name):
+        media_type = SHEET_MEDIA_TYPES[name.rsplit(".", 1)[1]]
+    else:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    path = os.path.join(get_trickplay_dir(video_id), name)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    headers = validator_headers(make_etag(stat.st_size, stat.st_mtime), stat.st_mtime)
+    if is_not_modified(request_headers, headers["ETag"], stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+    # Allow cross-origin requests for video players
+    headers["Access-Control-Allow-Origin"] = "*"
+    if query and name == VTT_FILENAME:
+        with open(path, encoding="utf-8") as f:
+            track = CUE_SHEET_URI.sub(lambda match: match.group(0) + query, f.read())
+        return Response(content=track, media_type=media_type, headers=headers)
+    return build_file_response(path, stat.st_size, range_header, media_type=media_type, headers=headers)
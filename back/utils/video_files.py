@@ -0,0 +1,146 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from core.config import settings
+from utils.async_io import run_io
+from utils.file_handlers import SharedFile
+from utils.http_cache import make_etag
+from utils.stream_tokens import StreamGrant
+
+DEFAULT_CONTENT_TYPE = "video/mp4"
+
+
+class VideoFile:
+    """On-disk metadata of a video, everything the stream path needs to serve it"""
+
+    def __init__(
+        self,
+        video_id: int,
+        filename: str,
+        path: str,
+        size: int,
+        mtime: float,
+        content_type: str,
+        bitrate: Optional[int] = None,
+    ):
+        self.video_id = video_id
+        self.filename = filename
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.content_type = content_type
+        # Average bitrate in bit/s, None until the file was probed
+        self.bitrate = bitrate
+        self.etag = make_etag(size, mtime)
+        self.file = SharedFile(path, cache_key=(path, mtime))
+        # When the file on disk was last seen to be this version
+        self.checked_at = time.monotonic()
+
+
+class VideoFileCache:
+    """
+    In-process LRU cache of resolved video files. It only knows about files signed stream URLs
+    point at, so it works on stream nodes without a database. Entries are checked against the
+    disk every STREAM_RESOLVER_REVALIDATE seconds, a file replaced by another process is reloaded
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._entries: "OrderedDict[Hashable, VideoFile]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def resolve_signed(self, grant: StreamGrant) -> VideoFile:
+        """Get the file a signed stream URL grants access to, without any database access"""
+        return await self._resolve(("signed", grant.path, grant.version), self._load_signed, grant)
+
+    async def _resolve(self, key: Hashable, load: Callable[..., VideoFile], *args: Any) -> VideoFile:
+        with self._lock:
+            video_file = self._entries.get(key)
+            if video_file is not None:
+                self._entries.move_to_end(key)
+
+        if video_file is not None:
+            if await self._is_current(video_file):
+                with self._lock:
+                    self.hits += 1
+                return video_file
+            with self._lock:
+                self.stale += 1
+        with self._lock:
+            self.misses += 1
+
+        video_file = await run_in_threadpool(load, *args)
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                previous.file.retire()
+            self._entries[key] = video_file
+            while len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                evicted.file.retire()
+        return video_file
+
+    async def _is_current(self, video_file: VideoFile) -> bool:
+        """
+        Whether a cached file is still the one on disk. An ingest or transcode in another worker
+        replaces files with os.replace, the cached descriptor would keep reading the old one
+        """
+        now = time.monotonic()
+        if now - video_file.checked_at < settings.STREAM_RESOLVER_REVALIDATE:
+            return True
+        try:
+            stat = await run_io(os.stat, video_file.path)
+        except OSError:
+            return False
+        if make_etag(stat.st_size, stat.st_mtime) != video_file.etag:
+            return False
+        video_file.checked_at = now
+        return True
+
+    def invalidate(self, key: Hashable) -> None:
+        """Drop a video (or rendition) from the cache, e.g. after it was updated or deleted"""
+        with self._lock:
+            video_file = self._entries.pop(key, None)
+        if video_file is not None:
+            video_file.file.retire()
+
+    def clear(self) -> None:
+        """Drop every cached video"""
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for video_file in entries:
+            video_file.file.retire()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get cache occupancy and hit counters"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "stale": self.stale,
+        }
+
+    def _load_signed(self, grant: StreamGrant) -> VideoFile:
+        """Stat the file of a grant and check it is still the version the URL was issued for"""
+        path = os.path.join(settings.UPLOAD_DIR, grant.path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            raise HTTPException(status_code=404, detail="Video file not found")
+        if make_etag(stat.st_size, stat.st_mtime) != grant.version:
+            raise HTTPException(status_code=410, detail="Video file changed, request a new stream URL")
+
+        return VideoFile(
+            grant.video_id, os.path.basename(path), path, stat.st_size, stat.st_mtime, grant.content_type, grant.bitrate
+        )
@@ -17,10 +17,13 @@ import PropTypes from 'prop-types';
    * @param {object} videoData - The video data object containing the stream URL and thumbnail.
    * @param {function} onEndVideo - The callback called when the video finishes playing.
    */
+// Stream and subtitle URLs are absolute when they are served by separate stream nodes
+const resolveUrl = (url) => (/^https?:\/\//.test(url) ? url : `${config.api.baseUrl}${url}`);
+
 const VideoPlayer = ({ isLoading, error, videoData, onEndVideo }) => {
 
 
-  const urlStream = `${config.api.baseUrl}${videoData?.stream_url}`;
+  const urlStream = resolveUrl(videoData?.stream_url);
 
 
 
@@ -77,7 +80,7 @@ const VideoPlayer = ({ isLoading, error, videoData, onEndVideo }) => {
               // Subtitles configuration
               tracks: videoData?.subtitles_urls && videoData.subtitles_urls.length > 0 
                 ? videoData.subtitles_urls.map((subtitle, index) => {
-                    const subtitleUrl = `${config.api.baseUrl}${subtitle}`;
+                    const subtitleUrl = resolveUrl(subtitle);
                     return {
                       kind: 'subtitles',
                       src: subtitleUrl,